@@ -0,0 +1,228 @@
+import json
+import math
+import os
+import threading
+import time
+from collections import deque
+from typing import Any, Dict, Tuple
+
+from flask import Flask, g, jsonify, request
+
+
+class _RouteGate:
+    """Estado de admisión de una ruta: en curso, cola de espera FIFO y contadores."""
+
+    def __init__(self, ruta: str, clase: str, config: Dict[str, Any]):
+        self.ruta = ruta
+        self.clase = clase
+        self.max_concurrencia = int(config["max_concurrencia"])
+        self.max_cola = int(config["max_cola"])
+        self.espera_max_s = float(config["espera_max_s"])
+        self.retry_after_s = float(config["retry_after_s"])
+
+        self.activos = 0
+        self.cola: deque = deque()
+        self.admitidas = 0
+        self.rechazadas_cola_llena = 0   # 429
+        self.rechazadas_espera = 0       # 503
+        self.espera_total_s = 0.0
+        self.espera_max_obs_s = 0.0
+        self.servicio_medio_s = 0.0      # media móvil exponencial del tiempo en curso
+
+    def metrics(self) -> Dict[str, Any]:
+        return {
+            "clase": self.clase,
+            "activos": self.activos,
+            "en_cola": len(self.cola),
+            "max_concurrencia": self.max_concurrencia,
+            "max_cola": self.max_cola,
+            "admitidas": self.admitidas,
+            "rechazadas_429": self.rechazadas_cola_llena,
+            "rechazadas_503": self.rechazadas_espera,
+            "espera_media_ms": round(1000 * self.espera_total_s / self.admitidas, 2) if self.admitidas else 0.0,
+            "espera_max_ms": round(1000 * self.espera_max_obs_s, 2),
+            "servicio_medio_ms": round(1000 * self.servicio_medio_s, 2),
+        }
+
+
+class AdmissionController:
+    """
+    Control de admisión y descarte de carga para las rutas de la API.
+
+    Todas las rutas comparten los hilos del servidor; sin control, una ráfaga
+    de /api/balance_reaction o de lotes grandes deja sin hilos a llamadas
+    baratas como /api/profiles, que la UI necesita al instante.
+
+      - Cada ruta pertenece a una clase de prioridad (data/admission.json) con
+        un límite de peticiones en curso y una cola de espera acotada (FIFO).
+      - Cola llena: 429 inmediato. Espera agotada: 503. Ambas con Retry-After.
+      - Además hay un tope global de peticiones en curso; cada clase deja libre
+        la 'reserva' de las clases más prioritarias, así que las interactivas
+        siempre encuentran hueco aunque las pesadas estén saturadas.
+
+    Se engancha con before_request / teardown_request, por lo que cubre tanto
+    el servidor HTTP como el transporte RPC (que despacha por la misma app).
+    """
+
+    CLASS_FIELDS = ("prioridad", "max_concurrencia", "max_cola", "espera_max_s", "retry_after_s", "reserva")
+    EWMA_ALPHA = 0.2
+
+    def __init__(self, config: Dict[str, Any] | None = None, config_path: str | None = None):
+        if config is None:
+            config_path = config_path or os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "admission.json")
+            with open(config_path, "r", encoding="utf-8") as f:
+                config = json.load(f)
+
+        self.clases: Dict[str, Dict[str, Any]] = {}
+        for name, cls in (config.get("clases") or {}).items():
+            missing = [k for k in self.CLASS_FIELDS if k not in cls]
+            if missing:
+                raise ValueError(f"Clase '{name}' incompleta: falta {', '.join(missing)}")
+            self.clases[name] = dict(cls)
+        self.clase_por_defecto = config.get("clase_por_defecto", "normal")
+        if self.clase_por_defecto not in self.clases:
+            raise ValueError(f"Clase por defecto desconocida: {self.clase_por_defecto}")
+        self.max_total = int(config.get("max_concurrencia_total", 12))
+
+        # Huecos globales que cada clase debe dejar libres para las más prioritarias
+        self._reservado: Dict[str, int] = {
+            name: sum(int(o["reserva"]) for o in self.clases.values() if o["prioridad"] < cls["prioridad"])
+            for name, cls in self.clases.items()
+        }
+        if any(self.max_total - r < 1 for r in self._reservado.values()):
+            raise ValueError("Las reservas dejan sin hueco a alguna clase: sube max_concurrencia_total.")
+
+        self._route_config: Dict[str, Dict[str, Any]] = {}
+        for ruta, entry in (config.get("rutas") or {}).items():
+            entry = {"clase": entry} if isinstance(entry, str) else dict(entry)
+            if entry.get("clase") not in self.clases:
+                raise ValueError(f"Ruta '{ruta}': clase desconocida '{entry.get('clase')}'")
+            self._route_config[ruta] = entry
+
+        self._cond = threading.Condition()
+        self._gates: Dict[str, _RouteGate] = {}
+        self.activos_total = 0
+
+    # -------------------------------------------------------------------------
+    # Integración con Flask
+    # -------------------------------------------------------------------------
+    def init_app(self, app: Flask):
+        app.before_request(self._before_request)
+        app.teardown_request(self._teardown_request)
+
+    def _before_request(self):
+        if request.url_rule is None:
+            return None   # 404/405: lo responde Flask sin ocupar hueco
+        rejection = self.acquire(request.url_rule.rule)
+        if rejection is None:
+            g.admission_route = request.url_rule.rule
+            g.admission_start = time.perf_counter()
+            return None
+
+        status, retry_after, motivo = rejection
+        response = jsonify({"success": False, "error": motivo, "retry_after": retry_after})
+        response.status_code = status
+        response.headers["Retry-After"] = str(retry_after)
+        return response
+
+    def _teardown_request(self, exc=None):
+        ruta = g.pop("admission_route", None)
+        if ruta is not None:
+            self.release(ruta, time.perf_counter() - g.pop("admission_start"))
+
+    # -------------------------------------------------------------------------
+    # Admisión
+    # -------------------------------------------------------------------------
+    def _gate(self, ruta: str) -> _RouteGate:
+        gate = self._gates.get(ruta)
+        if gate is None:
+            entry = self._route_config.get(ruta, {"clase": self.clase_por_defecto})
+            config = {**self.clases[entry["clase"]], **entry}
+            gate = self._gates[ruta] = _RouteGate(ruta, entry["clase"], config)
+        return gate
+
+    def _can_enter(self, gate: _RouteGate) -> bool:
+        return (gate.activos < gate.max_concurrencia
+                and self.activos_total < self.max_total - self._reservado[gate.clase])
+
+    def _retry_after(self, gate: _RouteGate) -> int:
+        """Segundos sugeridos: lo que tardaría en vaciarse la cola al ritmo actual."""
+        drain = gate.servicio_medio_s * (len(gate.cola) + 1) / max(1, gate.max_concurrencia)
+        return max(1, math.ceil(max(gate.retry_after_s, drain)))
+
+    def _enter(self, gate: _RouteGate, waited_s: float):
+        gate.activos += 1
+        gate.admitidas += 1
+        gate.espera_total_s += waited_s
+        gate.espera_max_obs_s = max(gate.espera_max_obs_s, waited_s)
+        self.activos_total += 1
+
+    def acquire(self, ruta: str) -> Tuple[int, int, str] | None:
+        """
+        Reserva un hueco para la ruta. Devuelve None si se admite, o
+        (status, retry_after_s, motivo) si la petición se descarta.
+        """
+        t0 = time.monotonic()
+        with self._cond:
+            gate = self._gate(ruta)
+            if not gate.cola and self._can_enter(gate):
+                self._enter(gate, 0.0)
+                return None
+
+            if len(gate.cola) >= gate.max_cola:
+                gate.rechazadas_cola_llena += 1
+                return 429, self._retry_after(gate), f"Ruta saturada ({ruta}): cola de espera llena"
+
+            ticket = object()
+            gate.cola.append(ticket)
+            deadline = t0 + gate.espera_max_s
+            while True:
+                if gate.cola[0] is ticket and self._can_enter(gate):
+                    gate.cola.popleft()
+                    self._enter(gate, time.monotonic() - t0)
+                    self._cond.notify_all()   # el siguiente de la cola puede tener hueco
+                    return None
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    gate.cola.remove(ticket)
+                    gate.rechazadas_espera += 1
+                    self._cond.notify_all()
+                    return 503, self._retry_after(gate), f"Ruta saturada ({ruta}): tiempo de espera agotado"
+                self._cond.wait(remaining)
+
+    def release(self, ruta: str, service_s: float = 0.0):
+        with self._cond:
+            gate = self._gates[ruta]
+            gate.activos -= 1
+            self.activos_total -= 1
+            gate.servicio_medio_s += self.EWMA_ALPHA * (service_s - gate.servicio_medio_s)
+            self._cond.notify_all()
+
+    # -------------------------------------------------------------------------
+    # Métricas
+    # -------------------------------------------------------------------------
+    def metrics(self) -> Dict[str, Any]:
+        with self._cond:
+            rutas = {ruta: gate.metrics() for ruta, gate in sorted(self._gates.items())}
+            total_activos = self.activos_total
+
+        clases: Dict[str, Dict[str, Any]] = {
+            name: {
+                "prioridad": cls["prioridad"],
+                "reserva": cls["reserva"],
+                "tope_global": self.max_total - self._reservado[name],
+                "activos": 0, "en_cola": 0, "admitidas": 0, "rechazadas_429": 0, "rechazadas_503": 0,
+            }
+            for name, cls in self.clases.items()
+        }
+        for m in rutas.values():
+            agg = clases[m["clase"]]
+            for key in ("activos", "en_cola", "admitidas", "rechazadas_429", "rechazadas_503"):
+                agg[key] += m[key]
+
+        return {
+            "max_concurrencia_total": self.max_total,
+            "activos_total": total_activos,
+            "clases": clases,
+            "rutas": rutas,
+        }
@@ -0,0 +1,197 @@
+import gzip
+import hashlib
+import json
+import threading
+import time
+from typing import Any, Dict
+
+from sites import Site
+
+
+class BootstrapService:
+    """
+    Todo lo que la interfaz necesita al arrancar en una sola respuesta:
+    perfiles, catálogo de fertilizantes, sales y nutrientes de la calculadora
+    y síntomas del motor de diagnóstico.
+
+    Por sitio se guarda una instantánea ya serializada (bytes JSON y su
+    versión gzip) con su ETag, que es la huella del contenido. Solo se
+    reconstruye, al pedirla, cuando cambia alguna de las versiones de las
+    que sale (perfiles, fertilizantes, reglas de síntomas); esas versiones
+    se consultan como mucho una vez cada intervalo_s, salvo que notify() lo
+    adelante (las escrituras hechas por la API avisan al momento).
+
+    Los suscriptores de eventos (SSE) esperan en wait() un cambio de esas
+    versiones y reciben solo las versiones por fuente, sin reconstruir la
+    instantánea: el cliente trae los perfiles por deltas
+    (/api/profiles/changes) y vuelve a pedir /api/bootstrap solo cuando se
+    mueven fertilizantes o síntomas.
+    """
+
+    def __init__(self, chem_engine: Any = None, intervalo_s: float = 1.0,
+                 gzip_min_bytes: int = 1024, max_suscriptores: int = 32):
+        self.chem_engine = chem_engine
+        self.intervalo_s = intervalo_s
+        self.gzip_min_bytes = gzip_min_bytes
+        self.max_suscriptores = max_suscriptores
+        self.suscriptores = 0
+        self.reconstrucciones = 0
+        self._snapshots: Dict[str, Dict[str, Any]] = {}
+        self._current: Dict[str, Dict[str, int]] = {}   # últimas versiones vistas por sitio
+        self._checked: Dict[str, float] = {}
+        self._cond = threading.Condition()
+        self._check_lock = threading.Lock()   # una sola consulta de versiones a la vez
+        self._build_lock = threading.Lock()   # una sola reconstrucción a la vez
+
+    # -------------------------------------------------------------------------
+    # Instantáneas
+    # -------------------------------------------------------------------------
+    def _versions(self, site: Site) -> Dict[str, int]:
+        site.catalog.refresh()
+        deficiency = getattr(self.chem_engine, "deficiency", None)
+        return {
+            "perfiles": site.db.get_profiles_version(),
+            "fertilizantes": site.catalog.version,
+            "sintomas": deficiency.version if deficiency is not None else 0,
+        }
+
+    def _symptoms(self) -> list:
+        deficiency = getattr(self.chem_engine, "deficiency", None)
+        if deficiency is None:
+            return []
+        return [
+            {
+                "codigo": code,
+                "nutrientes": list(dict.fromkeys(
+                    nut for rule in deficiency.rules_for_symptom(code) for nut in rule.primary_nutrients
+                )),
+            }
+            for code in deficiency.symptom_codes()
+        ]
+
+    def _build(self, site: Site, versions: Dict[str, int]) -> Dict[str, Any]:
+        """Serializa el payload una vez; las peticiones solo copian los bytes."""
+        t0 = time.perf_counter()
+        deficiency = getattr(self.chem_engine, "deficiency", None)
+        payload = {
+            "success": True,
+            "site": site.id,
+            "version": versions,
+            "perfiles": site.db.get_all_profiles(),
+            "fertilizantes": site.catalog.fertilizers,
+            "calculadora": {
+                "nutrientes": list(site.calc.nutrient_order),
+                "fertilizantes": list(site.calc.selected_ferts),
+            },
+            "sintomas": self._symptoms(),
+            "rangos_solucion": deficiency.solution_ranges if deficiency is not None else {},
+            "motor_quimico": self.chem_engine is not None,
+        }
+        body = json.dumps(payload, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+        self.reconstrucciones += 1
+        return {
+            "version": versions,
+            "etag": hashlib.sha256(body).hexdigest()[:32],
+            "body": body,
+            "gzip": gzip.compress(body, 6) if len(body) >= self.gzip_min_bytes else None,
+            "construccion_ms": round((time.perf_counter() - t0) * 1000, 3),
+        }
+
+    def versions(self, site: Site) -> Dict[str, int]:
+        """Versiones por fuente del sitio (consultadas como mucho una vez cada intervalo_s)."""
+        with self._check_lock:
+            current = self._current.get(site.id)
+            if current is not None and time.monotonic() - self._checked.get(site.id, 0.0) < self.intervalo_s:
+                return current
+            fresh = self._versions(site)
+            with self._cond:
+                self._checked[site.id] = time.monotonic()
+                self._current[site.id] = fresh
+                if fresh != current:
+                    self._cond.notify_all()
+            return fresh
+
+    def get(self, site: Site) -> Dict[str, Any]:
+        """Instantánea vigente del sitio: {"version", "etag", "body", "gzip", ...}."""
+        # Versiones antes que datos: la instantánea nunca declara más de lo que contiene
+        versions = self.versions(site)
+        snapshot = self._snapshots.get(site.id)
+        if snapshot is not None and snapshot["version"] == versions:
+            return snapshot
+
+        with self._build_lock:
+            snapshot = self._snapshots.get(site.id)
+            if snapshot is not None and snapshot["version"] == versions:
+                return snapshot   # otro hilo acaba de reconstruir
+            fresh = self._build(site, versions)
+            self._snapshots[site.id] = fresh
+            return fresh
+
+    def notify(self, site_id: str) -> None:
+        """Algo cambió en el sitio: la próxima consulta lee versiones y despierta a los suscriptores."""
+        with self._cond:
+            self._checked.pop(site_id, None)
+            self._cond.notify_all()
+
+    # -------------------------------------------------------------------------
+    # Suscripciones (Server-Sent Events)
+    # -------------------------------------------------------------------------
+    def subscribe(self) -> bool:
+        """Reserva un hueco de suscriptor; False si ya hay max_suscriptores."""
+        with self._cond:
+            if self.suscriptores >= self.max_suscriptores:
+                return False
+            self.suscriptores += 1
+            return True
+
+    def unsubscribe(self) -> None:
+        with self._cond:
+            self.suscriptores -= 1
+
+    def wait(self, site: Site, versions: Dict[str, int] | None, timeout: float) -> Dict[str, int]:
+        """Espera hasta que las versiones del sitio dejen de ser 'versions' o pase timeout; las devuelve."""
+        deadline = time.monotonic() + timeout
+        while True:
+            current = self.versions(site)
+            remaining = deadline - time.monotonic()
+            if current != versions or remaining <= 0:
+                return current
+            with self._cond:
+                self._cond.wait(min(remaining, self.intervalo_s))
+
+    def events(self, site: Site, keepalive_s: float = 15.0):
+        """
+        Flujo text/event-stream: un evento 'bootstrap' al conectar y otro con
+        cada cambio ({"version": {"perfiles", "fertilizantes", "sintomas"}}),
+        y un comentario cada keepalive_s para detectar clientes desconectados.
+        El hueco reservado con subscribe() se libera al cerrar la respuesta
+        (unsubscribe).
+        """
+        yield "retry: 3000\n\n"
+        versions = None
+        while True:
+            current = self.wait(site, versions, keepalive_s)
+            if current == versions:
+                yield ": ping\n\n"
+                continue
+            versions = current
+            event_id = "-".join(str(versions[k]) for k in sorted(versions))
+            data = json.dumps({"version": versions})
+            yield f"event: bootstrap\nid: {event_id}\ndata: {data}\n\n"
+
+    def status(self) -> Dict[str, Any]:
+        return {
+            "suscriptores": self.suscriptores,
+            "reconstrucciones": self.reconstrucciones,
+            "versiones": dict(self._current),
+            "sitios": {
+                site_id: {
+                    "etag": s["etag"],
+                    "version": s["version"],
+                    "bytes": len(s["body"]),
+                    "bytes_gzip": len(s["gzip"]) if s["gzip"] is not None else None,
+                    "construccion_ms": s["construccion_ms"],
+                }
+                for site_id, s in list(self._snapshots.items())
+            },
+        }
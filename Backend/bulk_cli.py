@@ -0,0 +1,282 @@
+"""
+CLI sin servidor para calcular dosis en bloque.
+
+Lee filas (tanque, volumen, perfil) de un CSV como flujo, las agrupa en
+bloques, resuelve cada bloque en un pool de procesos y escribe el
+resultado en CSV o NDJSON a medida que los bloques terminan (en el orden
+de entrada). Los bloques viajan a los procesos en memoria compartida
+(numpy sobre SharedMemory), sin serializar arrays, y solo hay un número
+fijo de bloques en vuelo: la memoria no crece con el tamaño de la entrada.
+
+Uso:
+    python bulk_cli.py entrada.csv -o salida.csv
+    cat entrada.csv | python bulk_cli.py - --formato ndjson --procesos 8
+"""
+import argparse
+import csv
+import json
+import math
+import os
+import sys
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+from typing import Any, Dict, Iterator, List
+
+import numpy as np
+
+from calculator import NutrientCalculatorService
+
+
+# ---------------------------------------------------------------------------------------
+# PROCESOS DE TRABAJO
+# ---------------------------------------------------------------------------------------
+_worker: Dict[str, Any] = {}
+
+
+def _init_worker(matrix_A: np.ndarray, matrix_inv: np.ndarray, selected_ferts: List[str], quimica: bool):
+    _worker.update(A=matrix_A, inv=matrix_inv, ferts=selected_ferts, shm={}, equilibrium=None)
+    if quimica:
+        from chemistry_engine.equilibrium_engine import EquilibriumEngine
+        _worker["equilibrium"] = EquilibriumEngine(cache_size=0)
+
+
+def _attach(name: str) -> shared_memory.SharedMemory:
+    shm = _worker["shm"].get(name)
+    if shm is None:
+        shm = shared_memory.SharedMemory(name=name)
+        _worker["shm"][name] = shm
+    return shm
+
+
+def _solve_chunk(in_name: str, out_name: str, rows: int, n_in: int, n_out: int) -> int:
+    """Resuelve un bloque: entrada (objetivos ppm + volumen) → salida (g, ppm, factible, pH, EC)."""
+    src = np.ndarray((rows, n_in), dtype=np.float64, buffer=_attach(in_name).buf)
+    dst = np.ndarray((rows, n_out), dtype=np.float64, buffer=_attach(out_name).buf)
+
+    targets, volume = src[:, :-1], src[:, -1]
+    n_ferts = len(_worker["ferts"])
+    n_nut = targets.shape[1]
+
+    x_raw = targets @ _worker["inv"].T
+    x_gl = np.clip(x_raw, 0, None)
+    dst[:, :n_ferts] = x_gl * volume[:, None]
+    dst[:, n_ferts:n_ferts + n_nut] = x_gl @ _worker["A"].T
+    dst[:, n_ferts + n_nut] = (x_raw >= 0).all(axis=1)
+
+    if _worker["equilibrium"] is not None:
+        eq = _worker["equilibrium"].solve(x_gl, _worker["ferts"])
+        dst[:, n_ferts + n_nut + 1] = eq["ph"]
+        dst[:, n_ferts + n_nut + 2] = eq["ec"]
+    return rows
+
+
+# ---------------------------------------------------------------------------------------
+# PROCESO PRINCIPAL
+# ---------------------------------------------------------------------------------------
+class BulkDoseRunner:
+    """Orquesta lectura en flujo, reparto en memoria compartida y escritura ordenada."""
+
+    def __init__(self, calc: NutrientCalculatorService, chunk_size: int = 20_000,
+                 processes: int | None = None, quimica: bool = False):
+        self.calc = calc
+        if chunk_size <= 0:
+            raise ValueError(f"chunk_size debe ser mayor que cero (recibido {chunk_size})")
+        self.chunk_size = chunk_size
+        self.processes = processes or os.cpu_count() or 1
+        self.quimica = quimica
+        self.n_nut = len(calc.nutrient_order)
+        self.n_ferts = len(calc.selected_ferts)
+        self.n_in = self.n_nut + 1
+        self.n_out = self.n_ferts + self.n_nut + 1 + (2 if quimica else 0)
+        self._targets_cache: Dict[str, np.ndarray | None] = {}
+
+    def output_columns(self) -> List[str]:
+        cols = ["tanque", "perfil", "volumen_L"]
+        cols += [f"{f}_g" for f in self.calc.selected_ferts]
+        cols += [f"{n}_ppm" for n in self.calc.nutrient_order]
+        cols += ["factible"]
+        if self.quimica:
+            cols += ["ph_estimado", "ec_estimada"]
+        return cols + ["error"]
+
+    def _target(self, profile: str) -> np.ndarray | None:
+        if profile not in self._targets_cache:
+            try:
+                data = self.calc.get_profile_data(profile)
+                self._targets_cache[profile] = np.array([float(data[n]) for n in self.calc.nutrient_order])
+            except (ValueError, KeyError):
+                self._targets_cache[profile] = None
+        return self._targets_cache[profile]
+
+    def _fill(self, rows: List[List[str]], buf: np.ndarray, cols: Dict[str, int]) -> List[str | None]:
+        """Copia un bloque de filas al buffer de entrada; devuelve el error de cada fila."""
+        errors: List[str | None] = []
+        for r, row in enumerate(rows):
+            target = self._target(row[cols["perfil"]])
+            try:
+                volume = float(row[cols["volumen"]])
+            except ValueError:
+                volume = -1.0
+            if target is None:
+                errors.append("perfil no encontrado")
+            elif not (math.isfinite(volume) and volume > 0):
+                errors.append("volumen inválido")
+            else:
+                errors.append(None)
+                buf[r, :-1] = target
+                buf[r, -1] = volume
+                continue
+            buf[r] = 0.0
+        return errors
+
+    def _read_chunks(self, reader: Iterator[List[str]], width: int) -> Iterator[List[List[str]]]:
+        chunk: List[List[str]] = []
+        for row in reader:
+            if len(row) < width:
+                row = row + [""] * (width - len(row))
+            chunk.append(row)
+            if len(chunk) == self.chunk_size:
+                yield chunk
+                chunk = []
+        if chunk:
+            yield chunk
+
+    def _write(self, writer, fmt: str, rows, errors, out: np.ndarray, cols: Dict[str, int]):
+        header = self.output_columns()
+        values = np.round(out, 4).tolist()
+        for row, err, vals in zip(rows, errors, values):
+            ident = [row[cols["tanque"]], row[cols["perfil"]], row[cols["volumen"]]]
+            if err is not None:
+                record = ident + [""] * self.n_out + [err]
+            else:
+                fact_idx = self.n_ferts + self.n_nut
+                vals[fact_idx] = bool(vals[fact_idx])
+                record = ident + vals + [""]
+            if fmt == "csv":
+                writer.writerow(record)
+            else:
+                obj = dict(zip(header, record))
+                if err is None:
+                    obj.pop("error")
+                writer.write(json.dumps(obj, ensure_ascii=False) + "\n")
+
+    def run(self, in_stream, out_stream, fmt: str = "csv", columns: Dict[str, str] | None = None) -> int:
+        columns = {"tanque": "tanque", "volumen": "volumen_L", "perfil": "perfil", **(columns or {})}
+        reader = csv.reader(in_stream)
+        header = next(reader, None)
+        if header is None:
+            raise ValueError("El CSV de entrada está vacío (falta la cabecera).")
+        try:
+            cols = {key: header.index(name) for key, name in columns.items()}
+        except ValueError as e:
+            raise ValueError(f"Columna requerida ausente en el CSV: {e}")
+
+        if fmt == "csv":
+            writer = csv.writer(out_stream)
+            writer.writerow(self.output_columns())
+        else:
+            writer = out_stream
+
+        n_slots = self.processes + 2
+        slots = [
+            (shared_memory.SharedMemory(create=True, size=self.chunk_size * self.n_in * 8),
+             shared_memory.SharedMemory(create=True, size=self.chunk_size * self.n_out * 8))
+            for _ in range(n_slots)
+        ]
+        free = deque(range(n_slots))
+        pending = deque()
+        total = 0
+
+        def flush_oldest():
+            fut, slot, rows, errors = pending.popleft()
+            n = fut.result()
+            out = np.ndarray((n, self.n_out), dtype=np.float64, buffer=slots[slot][1].buf)
+            self._write(writer, fmt, rows, errors, out, cols)
+            free.append(slot)
+
+        try:
+            with ProcessPoolExecutor(
+                max_workers=self.processes,
+                initializer=_init_worker,
+                initargs=(self.calc.matrix_A, self.calc.inverse_matrix(), self.calc.selected_ferts, self.quimica),
+            ) as pool:
+                for rows in self._read_chunks(reader, len(header)):
+                    if not free:
+                        flush_oldest()
+                    slot = free.popleft()
+                    shm_in, shm_out = slots[slot]
+                    buf = np.ndarray((len(rows), self.n_in), dtype=np.float64, buffer=shm_in.buf)
+                    errors = self._fill(rows, buf, cols)
+                    del buf
+                    fut = pool.submit(_solve_chunk, shm_in.name, shm_out.name, len(rows), self.n_in, self.n_out)
+                    pending.append((fut, slot, rows, errors))
+                    total += len(rows)
+                while pending:
+                    flush_oldest()
+        finally:
+            for shm_in, shm_out in slots:
+                for shm in (shm_in, shm_out):
+                    shm.close()
+                    shm.unlink()
+
+        return total
+
+
+def _positive_int(text: str) -> int:
+    """Tipo argparse: entero > 0 (un bloque de 0 filas no cabe en SharedMemory)."""
+    try:
+        value = int(text)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"'{text}' no es un entero")
+    if value <= 0:
+        raise argparse.ArgumentTypeError(f"debe ser mayor que cero (recibido {value})")
+    return value
+
+
+def main(argv: List[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(description="Cálculo de dosis en bloque (CSV → CSV/NDJSON)")
+    parser.add_argument("entrada", help="CSV de entrada ('-' para stdin)")
+    parser.add_argument("-o", "--salida", default="-", help="archivo de salida ('-' para stdout)")
+    parser.add_argument("--formato", choices=["csv", "ndjson"], default="csv")
+    parser.add_argument("--procesos", type=_positive_int, default=None)
+    parser.add_argument("--bloque", type=_positive_int, default=20_000, help="filas por bloque")
+    parser.add_argument("--quimica", action="store_true", help="incluir pH y EC por especiación")
+    parser.add_argument("--col-tanque", default="tanque")
+    parser.add_argument("--col-volumen", default="volumen_L")
+    parser.add_argument("--col-perfil", default="perfil")
+    args = parser.parse_args(argv)
+
+    from database import SQLiteDatabase
+    from fertilizer_catalog import FertilizerCatalog
+    db = SQLiteDatabase()
+    calc = NutrientCalculatorService(external_profiles=db.get_all_profiles())
+    try:
+        # Mismo catálogo que el servidor (SQLite), no el JSON de arranque
+        calc.set_fertilizers(FertilizerCatalog(db).fertilizers)
+    except ValueError as e:
+        print(f"Error: {e}", file=sys.stderr)
+        return 2
+    runner = BulkDoseRunner(calc, chunk_size=args.bloque, processes=args.procesos, quimica=args.quimica)
+
+    in_stream = sys.stdin if args.entrada == "-" else open(args.entrada, newline="", encoding="utf-8")
+    out_stream = sys.stdout if args.salida == "-" else open(args.salida, "w", newline="", encoding="utf-8")
+    try:
+        total = runner.run(in_stream, out_stream, fmt=args.formato, columns={
+            "tanque": args.col_tanque, "volumen": args.col_volumen, "perfil": args.col_perfil,
+        })
+    except ValueError as e:
+        print(f"Error: {e}", file=sys.stderr)
+        return 2
+    finally:
+        if in_stream is not sys.stdin:
+            in_stream.close()
+        if out_stream is not sys.stdout:
+            out_stream.close()
+
+    print(f"{total} filas procesadas", file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
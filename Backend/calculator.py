@@ -1,16 +1,20 @@
 import json
+import math
 import numpy as np
 import os
 # IMPORTACIÓN CORRECTA DE SUS MODELOS DE PYDANTIC
 from models import DoseResult, FertilizerDose 
 from typing import Dict, List, Any
+from chemistry_engine.equilibrium_engine import EquilibriumEngine
+from columnar import to_json_ready
+from feasibility import FeasibilityIndex
 
 class NutrientCalculatorService:
     """
     Servicio central de cálculo de recetas de nutrientes basado en álgebra lineal 
     (resolviendo Ax=b).
     """
-    def __init__(self, external_profiles: list = None):
+    def __init__(self, external_profiles: list = None, cache=None):
         # Cargar datos al iniciar el servicio
         self.base_path = os.path.dirname(os.path.abspath(__file__))
         
@@ -28,6 +32,21 @@ class NutrientCalculatorService:
             "SulfatoMagnesio", "NitratoAmonio"
         ]
 
+        # Matriz A (ppm por g/L) y su inversa: se calculan una sola vez
+        self.matrix_A = self._build_matrix()
+        self._matrix_A_inv = None
+        self._inv_for = None   # matriz A a la que corresponde la inversa cacheada
+
+        # Cono de vectores alcanzables con dosis >= 0 (se reconstruye si cambia A)
+        self.feasibility = FeasibilityIndex(self, cache=cache)
+
+        # Especiación química para estimar pH y EC de la solución dosificada
+        self.equilibrium = EquilibriumEngine()
+        self.ph_objetivo = 5.8
+
+        # Límite de puntos por barrido "what-if"
+        self.max_sweep_points = 100_000
+
     def _load_json(self, path):
         """Carga un archivo JSON relativo al script."""
         full_path = os.path.join(self.base_path, path)
@@ -47,37 +66,103 @@ class NutrientCalculatorService:
         raise ValueError(f"Perfil de planta '{profile_name}' no encontrado.")
 
 
-    def calculate(self, volumen: float, perfil_nombre: str) -> DoseResult:
+    def _build_matrix(self) -> np.ndarray:
+        """Construcción de la matriz A (Coeficientes en ppm por gramo/litro)."""
+        matrix_data = []
+        for nut in self.nutrient_order:
+            row = []
+            for fert_name in self.selected_ferts:
+                percent = self.fertilizers[fert_name].get(nut, 0)
+                row.append(percent * 10) # Coeficiente en ppm por gramo/litro
+            matrix_data.append(row)
+        return np.array(matrix_data, dtype=float)
+
+    def set_fertilizers(self, fertilizers: Dict[str, Dict[str, Any]], selected: List[str] | None = None) -> None:
+        """
+        Cambia el catálogo en caliente: nueva matriz A (objeto nuevo, así el
+        índice de factibilidad y la inversa cacheada se recalculan solos).
+        """
+        selected = list(selected) if selected is not None else self.selected_ferts
+        missing = [f for f in selected if f not in fertilizers]
+        if missing:
+            raise ValueError(f"Fertilizantes sin composición: {', '.join(missing)}")
+        self.selected_ferts = selected
+        self.fertilizers = fertilizers
+        self.matrix_A = self._build_matrix()
+
+    def singular_with(self, nombre: str, composicion: Dict[str, float]) -> str | None:
+        """
+        Comprueba una edición del catálogo antes de guardarla: si 'nombre' es
+        una de las sales seleccionadas y con 'composicion' la matriz A quedaría
+        sin rango completo (Ax = b sin solución única), devuelve el motivo.
+        """
+        if nombre not in self.selected_ferts:
+            return None
+        fertilizers = {**self.fertilizers, nombre: composicion}
+        A = np.array([[float(fertilizers[f].get(nut, 0)) * 10 for f in self.selected_ferts]
+                      for nut in self.nutrient_order])
+        rank = np.linalg.matrix_rank(A)
+        if rank < min(A.shape):
+            return (f"Con esa composición de '{nombre}' las sales de la calculadora "
+                    f"({', '.join(self.selected_ferts)}) solo cubren {rank} de "
+                    f"{len(self.nutrient_order)} nutrientes independientes (matriz singular).")
+        return None
+
+    def inverse_matrix(self) -> np.ndarray:
+        """
+        A⁻¹ cacheada: la dosis es lineal en el objetivo (x = A⁻¹b). Se invalida
+        por identidad de la matriz, como FeasibilityIndex._current.
+        """
+        matrix_A = self.matrix_A
+        if self._inv_for is not matrix_A:
+            inv = np.linalg.inv(matrix_A)
+            self._matrix_A_inv, self._inv_for = inv, matrix_A
+            return inv
+        return self._matrix_A_inv
+
+    def solve_many(self, targets: np.ndarray) -> np.ndarray:
+        """
+        Resuelve Ax = b para muchas filas de objetivos (ppm) a la vez.
+        Devuelve g/L sin recortar (filas x sales); los negativos indican
+        objetivos no alcanzables con las sales seleccionadas.
+        """
+        return np.atleast_2d(np.asarray(targets, dtype=float)) @ self.inverse_matrix().T
+
+    def calculate(
+        self,
+        volumen: float,
+        perfil_nombre: str,
+        incertidumbre: Dict[str, Any] | None = None,
+        agua: Dict[str, Any] | None = None,
+    ) -> DoseResult:
         """
         Calcula las dosis de fertilizante necesarias para alcanzar el perfil target 
         en un volumen dado.
+
+        incertidumbre: configuración opcional del modo Monte Carlo
+        (ver _monte_carlo); si se indica, el resultado incluye intervalos de
+        confianza para cada dosis y cada ppm resultante.
+        agua: alcalinidad/iones del agua de riego y ácido inyectado
+        (ver EquilibriumEngine.water_components) para estimar pH y EC.
         """
         try:
             target_profile = self.get_profile_data(perfil_nombre)
             vector_b = np.array([target_profile[nut] for nut in self.nutrient_order])
 
-            # Construcción de la matriz A (Coeficientes)
-            matrix_data = []
-            for nut in self.nutrient_order:
-                row = []
-                for fert_name in self.selected_ferts:
-                    percent = self.fertilizers[fert_name].get(nut, 0)
-                    row.append(percent * 10) # Coeficiente en ppm por gramo/litro
-                matrix_data.append(row)
-            
-            matrix_A = np.array(matrix_data)
+            # Precomprobación: ¿el perfil cae dentro del cono de las sales?
+            factibilidad = self.feasibility.check(vector_b)
+
+            matrix_A = self.matrix_A
 
             # Resolver Ax = b (x = gramos por litro)
             x_concentracion = np.linalg.solve(matrix_A, vector_b)
 
             dosis_finales: List[FertilizerDose] = []
             analisis_simulado = {nut: 0.0 for nut in self.nutrient_order}
-            total_sales_g_l = 0.0
 
             for i, fert_name in enumerate(self.selected_ferts):
                 gramos_por_litro = max(0, x_concentracion[i]) 
                 dosis_total = gramos_por_litro * volumen
-                total_sales_g_l += gramos_por_litro
                 
                 # Obtener la fórmula química para la tabla
                 formula_str = self.fertilizers[fert_name].get('formula', 'Sal')
@@ -94,15 +179,46 @@ class NutrientCalculatorService:
                     analisis_simulado[nut] = round(analisis_simulado[nut] + aporte, 2)
 
 
-            ec_estimada = round(total_sales_g_l * 1.0, 2) 
+            # pH y EC por especiación de la solución dosificada
+            x_dosificado = np.clip(x_concentracion, 0, None)
+            equilibrio = self.equilibrium.solve(x_dosificado, self.selected_ferts, agua=agua)
+            ec_estimada = round(float(equilibrio["ec"][0]), 2)
+            ph_estimado = round(float(equilibrio["ph"][0]), 2)
+            acido = self.equilibrium.acid_for_ph(x_dosificado, self.selected_ferts, self.ph_objetivo, agua=agua)
+            quimica = {
+                "fuerza_ionica_M": round(float(equilibrio["ionic_strength"][0]), 5),
+                "ph_objetivo": self.ph_objetivo,
+                "acido_nitrico_mmol_L": round(float(acido[0]), 3),
+            }
+
+            intervalos = None
+            if incertidumbre is not None:
+                gramos_nominales = x_dosificado * volumen
+                intervalos = self._monte_carlo(vector_b, volumen, gramos_nominales, incertidumbre)
+
+            mensaje = "Cálculo óptimo realizado"
+            if not factibilidad["alcanzable"]:
+                # Desvío real de la solución recortada respecto al objetivo
+                tol = np.maximum(0.01 * np.abs(vector_b), 0.5)
+                final = np.array([analisis_simulado[nut] for nut in self.nutrient_order])
+                factibilidad["sobrepasados"] = [n for n, d, t in zip(self.nutrient_order, final - vector_b, tol) if d > t]
+                factibilidad["por_debajo"] = [n for n, d, t in zip(self.nutrient_order, final - vector_b, tol) if d < -t]
+                mensaje = (
+                    "Perfil no alcanzable exactamente con las sales seleccionadas; dosis negativas recortadas a cero "
+                    f"(por encima del objetivo: {', '.join(factibilidad['sobrepasados']) or '-'}; "
+                    f"por debajo: {', '.join(factibilidad['por_debajo']) or '-'})"
+                )
 
             return DoseResult(
                 exito=True,
-                mensaje="Cálculo óptimo realizado",
+                mensaje=mensaje,
                 dosis=dosis_finales,
                 ec_estimada=ec_estimada,
-                ph_estimado=5.8, # Valor ideal hardcodeado por ahora
-                analisis_final=analisis_simulado
+                ph_estimado=ph_estimado,
+                analisis_final=analisis_simulado,
+                incertidumbre=intervalos,
+                quimica=quimica,
+                factibilidad=factibilidad
             )
 
         except np.linalg.LinAlgError:
@@ -121,4 +237,260 @@ class NutrientCalculatorService:
             ec_estimada=0.0, 
             ph_estimado=0.0, 
             analisis_final={}
-        )
\ No newline at end of file
+        )
+
+    # ------------------------------------------------------------------ #
+    # PROPAGACIÓN DE INCERTIDUMBRE (MONTE CARLO)
+    # ------------------------------------------------------------------ #
+
+    @staticmethod
+    def _finite(config: Dict[str, Any], key: str, default: float, lo: float, hi: float, label: str) -> float:
+        try:
+            value = float(config.get(key, default))
+        except (TypeError, ValueError):
+            raise ValueError(f"{label} debe ser un número.")
+        if not math.isfinite(value) or not lo <= value <= hi:
+            raise ValueError(f"{label} debe estar entre {lo:g} y {hi:g}.")
+        return value
+
+    def validate_uncertainty(self, config: Any) -> Dict[str, Any]:
+        """
+        Comprueba la configuración de Monte Carlo (ver _monte_carlo) y la
+        devuelve normalizada; ValueError con el campo problemático si no vale.
+        """
+        if not isinstance(config, dict):
+            raise ValueError("'incertidumbre' debe ser un objeto.")
+        n = self._finite(config, "n_muestras", 20000, 1, 200_000, "n_muestras")
+        if n != int(n):
+            raise ValueError("n_muestras debe ser un entero.")
+        nivel = self._finite(config, "nivel_confianza", 0.95, 0.0, 1.0, "nivel_confianza")
+        if nivel in (0.0, 1.0):
+            raise ValueError("nivel_confianza debe estar entre 0 y 1 (sin incluirlos).")
+        semilla = config.get("semilla")
+        if semilla is not None and (not isinstance(semilla, int) or isinstance(semilla, bool) or semilla < 0):
+            raise ValueError("semilla debe ser un entero no negativo.")
+
+        specs = {}
+        for key in ("composicion", "volumen"):
+            spec = config.get(key)
+            if not spec:
+                specs[key] = None
+                continue
+            if not isinstance(spec, dict):
+                raise ValueError(f"'{key}' debe ser un objeto {{dist, rel_sd | rel_range}}.")
+            dist = spec.get("dist", "normal")
+            if dist == "normal":
+                specs[key] = {"dist": dist, "rel_sd": self._finite(spec, "rel_sd", 0.0, 0.0, 1.0, f"{key}.rel_sd")}
+            elif dist == "uniform":
+                specs[key] = {"dist": dist, "rel_range": self._finite(spec, "rel_range", 0.0, 0.0, 0.99, f"{key}.rel_range")}
+            else:
+                raise ValueError(f"Distribución no soportada: {dist}")
+
+        return {
+            "n_muestras": int(n),
+            "nivel_confianza": nivel,
+            "semilla": semilla,
+            **specs,
+            "pesaje_sd_g": self._finite(config, "pesaje_sd_g", 0.0, 0.0, 1e6, "pesaje_sd_g"),
+        }
+
+    def _sample_factors(self, rng: np.random.Generator, spec: Dict[str, Any] | None, shape) -> np.ndarray:
+        """
+        Factores multiplicativos alrededor de 1.0.
+
+        spec: {"dist": "normal", "rel_sd": 0.03} o {"dist": "uniform", "rel_range": 0.05}
+        """
+        if not spec:
+            return np.ones(shape)
+        dist = spec.get("dist", "normal")
+        if dist == "normal":
+            return 1.0 + rng.standard_normal(shape) * float(spec.get("rel_sd", 0.0))
+        if dist == "uniform":
+            half = float(spec.get("rel_range", 0.0))
+            return rng.uniform(1.0 - half, 1.0 + half, shape)
+        raise ValueError(f"Distribución no soportada: {dist}")
+
+    def _monte_carlo(
+        self,
+        vector_b: np.ndarray,
+        volumen: float,
+        gramos_nominales: np.ndarray,
+        config: Dict[str, Any],
+    ) -> Dict[str, Any]:
+        """
+        Muestrea pureza de cada sal, volumen real del tanque y error de la
+        balanza, y resuelve todos los sistemas perturbados en una sola llamada
+        batched a np.linalg.solve.
+
+        config:
+          - n_muestras (20000), nivel_confianza (0.95), semilla (opcional)
+          - composicion: factor de pureza por sal (ver _sample_factors)
+          - volumen: factor sobre el volumen del tanque
+          - pesaje_sd_g: desviación estándar absoluta de la balanza (g)
+
+        Devuelve, por sal, el intervalo de los gramos que realmente harían falta
+        y, por nutriente, el intervalo de ppm que se obtiene al pesar la receta
+        nominal en un tanque con la composición y el volumen muestreados.
+        """
+        config = self.validate_uncertainty(config)
+        n = config["n_muestras"]
+        nivel = config["nivel_confianza"]
+        rng = np.random.default_rng(config.get("semilla"))
+        n_ferts = len(self.selected_ferts)
+
+        pureza = np.clip(self._sample_factors(rng, config.get("composicion"), (n, n_ferts)), 1e-6, None)
+        vol = float(volumen) * np.clip(self._sample_factors(rng, config.get("volumen"), n), 1e-6, None)
+
+        # A_k = A · diag(pureza_k): pila de n matrices (n x nutrientes x sales)
+        A_k = self.matrix_A[None, :, :] * pureza[:, None, :]
+
+        # 1) Dosis necesarias con la composición/volumen reales
+        x_k = np.linalg.solve(A_k, np.broadcast_to(vector_b, (n, len(vector_b)))[..., None])[..., 0]
+        gramos_k = np.clip(x_k, 0, None) * vol[:, None]
+
+        # 2) ppm obtenidos al pesar la receta nominal (con error de balanza)
+        pesado = gramos_nominales[None, :] + rng.standard_normal((n, n_ferts)) * config["pesaje_sd_g"]
+        pesado = np.clip(pesado, 0, None)
+        ppm_k = np.einsum("knf,kf->kn", A_k, pesado / vol[:, None])
+
+        cola = (1.0 - nivel) / 2.0 * 100.0
+        q = [cola, 50.0, 100.0 - cola]
+        g_q = np.percentile(gramos_k, q, axis=0)
+        p_q = np.percentile(ppm_k, q, axis=0)
+
+        def resumen(muestras, cuantiles, j):
+            return {
+                "media": round(float(muestras[:, j].mean()), 2),
+                "sd": round(float(muestras[:, j].std()), 2),
+                "p_inf": round(float(cuantiles[0, j]), 2),
+                "mediana": round(float(cuantiles[1, j]), 2),
+                "p_sup": round(float(cuantiles[2, j]), 2),
+            }
+
+        return {
+            "n_muestras": n,
+            "nivel_confianza": nivel,
+            "dosis_gramos": {fert: resumen(gramos_k, g_q, j) for j, fert in enumerate(self.selected_ferts)},
+            "analisis_final": {nut: resumen(ppm_k, p_q, i) for i, nut in enumerate(self.nutrient_order)},
+        }
+
+    # ------------------------------------------------------------------ #
+    # ANÁLISIS "WHAT-IF" (SENSIBILIDAD Y BARRIDOS)
+    # ------------------------------------------------------------------ #
+
+    def sensitivity_matrix(self, volumen: float) -> np.ndarray:
+        """Gramos de cada sal (filas) por cada +1 ppm de cada nutriente (columnas)."""
+        return self.inverse_matrix() * float(volumen)
+
+    def _sweep_deltas(self, perturbations: List[Dict[str, float]] | None, grid: Dict[str, Any] | None):
+        """
+        Construye la matriz de perturbaciones (filas x nutrientes).
+
+        grid: {"K": {"min": -20, "max": 20, "steps": 5}} o {"K": [0, 10, 20]};
+              se recorre el producto cartesiano de los ejes.
+        perturbations: lista de dicts {"K": 20, "N": -10}.
+        """
+        n_nut = len(self.nutrient_order)
+        axes: Dict[str, List[float]] = {}
+
+        if grid:
+            # Tamaño de cada eje antes de construir nada: el tope se aplica sin reservar memoria
+            lengths = []
+            for nut, spec in grid.items():
+                if nut not in self.nutrient_order:
+                    raise ValueError(f"Nutriente desconocido en el barrido: {nut}")
+                if isinstance(spec, dict):
+                    if "min" not in spec or "max" not in spec:
+                        raise ValueError(f"El eje de {nut} necesita 'min' y 'max'.")
+                    steps = spec.get("steps", 11)
+                    steps = float(steps) if isinstance(steps, (int, float)) else float("nan")
+                    if not math.isfinite(steps) or steps != int(steps) or steps < 1:
+                        raise ValueError(f"'steps' de {nut} debe ser un entero mayor o igual que 1.")
+                    lengths.append(int(steps))
+                elif isinstance(spec, list):
+                    lengths.append(len(spec))
+                else:
+                    raise ValueError(f"El eje de {nut} debe ser {{min, max, steps}} o una lista de valores.")
+
+            n_points = math.prod(lengths)
+            if n_points > self.max_sweep_points:
+                raise ValueError(f"El barrido tiene {n_points} puntos (máximo {self.max_sweep_points}).")
+
+            values = []
+            for (nut, spec), length in zip(grid.items(), lengths):
+                if isinstance(spec, dict):
+                    axis = np.linspace(float(spec["min"]), float(spec["max"]), length)
+                else:
+                    axis = np.asarray(spec, dtype=float)
+                if not np.isfinite(axis).all():
+                    raise ValueError(f"El eje de {nut} tiene valores no finitos.")
+                axes[nut] = axis.tolist()
+                values.append(axis)
+
+            mesh = np.meshgrid(*values, indexing="ij")
+            deltas = np.zeros((n_points, n_nut))
+            for nut, coords in zip(axes, mesh):
+                deltas[:, self.nutrient_order.index(nut)] = coords.ravel()
+            return deltas, axes
+
+        perturbations = perturbations or [{}]
+        if len(perturbations) > self.max_sweep_points:
+            raise ValueError(f"Demasiadas perturbaciones (máximo {self.max_sweep_points}).")
+
+        deltas = np.zeros((len(perturbations), n_nut))
+        for r, pert in enumerate(perturbations):
+            for nut, delta in pert.items():
+                if nut not in self.nutrient_order:
+                    raise ValueError(f"Nutriente desconocido en el barrido: {nut}")
+                deltas[r, self.nutrient_order.index(nut)] = float(delta)
+        return deltas, axes
+
+    def sweep(
+        self,
+        volumen: float,
+        perfil_nombre: str,
+        perturbations: List[Dict[str, float]] | None = None,
+        grid: Dict[str, Any] | None = None,
+        agua: Dict[str, Any] | None = None,
+        as_arrays: bool = False,
+    ) -> Dict[str, Any]:
+        """
+        Calcula las dosis para muchas variaciones del perfil base con un solo
+        producto matricial contra A⁻¹. Devuelve columnas (una lista por serie)
+        listas para graficar; con as_arrays=True las columnas quedan como
+        arrays numpy (respuesta binaria columnar).
+        """
+        target_profile = self.get_profile_data(perfil_nombre)
+        base_b = np.array([float(target_profile[nut]) for nut in self.nutrient_order])
+        deltas, axes = self._sweep_deltas(perturbations, grid)
+
+        targets = base_b + deltas                      # (puntos x nutrientes)
+        x_raw = self.solve_many(targets)               # g/L por sal
+        factible = self.feasibility.reachable_many(targets)
+        x_gl = np.clip(x_raw, 0, None)
+        analisis = x_gl @ self.matrix_A.T              # ppm resultantes (con recorte)
+        grams = np.round(x_gl * float(volumen), 2)
+        equilibrio = self.equilibrium.solve(x_gl, self.selected_ferts, agua=agua)
+
+        result: Dict[str, Any] = {
+            "success": True,
+            "perfil": perfil_nombre,
+            "volumen_L": volumen,
+            "n_puntos": int(targets.shape[0]),
+            "nutrientes": self.nutrient_order,
+            "fertilizantes": self.selected_ferts,
+            "objetivo": {nut: np.round(targets[:, i], 2) for i, nut in enumerate(self.nutrient_order)},
+            "dosis_gramos": {fert: grams[:, j] for j, fert in enumerate(self.selected_ferts)},
+            "analisis_final": {nut: np.round(analisis[:, i], 2) for i, nut in enumerate(self.nutrient_order)},
+            "ec_estimada": np.round(equilibrio["ec"], 2),
+            "ph_estimado": np.round(equilibrio["ph"], 2),
+            "factible": factible,
+            "sensibilidad_g_por_ppm": {
+                fert: dict(zip(self.nutrient_order, np.round(row, 4).tolist()))
+                for fert, row in zip(self.selected_ferts, self.sensitivity_matrix(volumen))
+            },
+        }
+        if axes:
+            result["ejes"] = axes
+            result["forma"] = [len(v) for v in axes.values()]
+        return result if as_arrays else to_json_ready(result)
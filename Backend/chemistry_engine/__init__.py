@@ -1,14 +1,20 @@
 # chemistry_engine/__init__.py
 
+from .compound_library import CompoundLibrary
 from .concentration_engine import ConcentrationEngine
+from .correction_engine import CorrectionEngine
 from .deficiency_engine import DeficiencyEngine
+from .equilibrium_engine import EquilibriumEngine
 from .reactions import ReactionBalancer
 from .chemical_engine import ChemicalEngine
 from .stoichiometry_engine import StoichiometryEngine
 
 __all__ = [
+    "CompoundLibrary",
     "ConcentrationEngine",
+    "CorrectionEngine",
     "DeficiencyEngine",
+    "EquilibriumEngine",
     "ReactionBalancer",
     "ChemicalEngine",
     "StoichiometryEngine"
@@ -5,9 +5,14 @@ import os
 import json
 from typing import Dict, Any, List
 
+import numpy as np
+
+from .compound_library import CompoundLibrary
 from .concentration_engine import ConcentrationEngine
+from .correction_engine import CorrectionEngine
 from .deficiency_engine import DeficiencyEngine
 from .reactions import ReactionBalancer, BalancedReaction
+from .stoichiometry_engine import StoichiometryEngine
 
 
 class ChemicalEngine:
@@ -22,21 +27,31 @@ class ChemicalEngine:
     Usa:
       - DeficiencyEngine
       - ConcentrationEngine
+      - CorrectionEngine
       - ReactionBalancer
+      - CompoundLibrary
       - fertilizers.json
     """
 
-    def __init__(self, base_path: str | None = None):
+    def __init__(self, base_path: str | None = None, cache: Any = None):
         self.base_path = base_path or os.path.dirname(os.path.abspath(__file__))
 
-        # Motores internos
+        # Motores internos (cache: WarmCache opcional para reacciones y masas molares)
         self.concentration = ConcentrationEngine()
         self.deficiency = DeficiencyEngine()
-        self.reactions = ReactionBalancer()
+        self.reactions = ReactionBalancer(cache=cache)
+
+        # Biblioteca de compuestos (masas molares precalculadas + trie de autocompletado);
+        # la estequiometría en lote toma de aquí las masas, como la ruta individual
+        self.compounds = CompoundLibrary(balancer=self.reactions, cache=cache)
+        self.stoichiometry = StoichiometryEngine(cache=cache, compounds=self.compounds)
 
         # Cargar datos de fertilizantes
         self.fertilizers: Dict[str, Dict[str, Any]] = self._load_fertilizers()
 
+        # Matriz de fertilizantes + índice nutriente → sales para las correcciones
+        self.correction = CorrectionEngine(self.fertilizers)
+
     # -------------------------------------------------------------- #
     # CARGA DE DATOS
     # -------------------------------------------------------------- #
@@ -54,86 +69,96 @@ class ChemicalEngine:
         with open(path, "r", encoding="utf-8") as f:
             return json.load(f)
 
+    def set_fertilizers(self, fertilizers: Dict[str, Dict[str, Any]]) -> None:
+        """Catálogo nuevo (p. ej. desde SQLite): rehace la matriz de correcciones."""
+        self.correction.set_fertilizers(fertilizers)
+        self.fertilizers = fertilizers
+
     # -------------------------------------------------------------- #
     # DIAGNÓSTICO + PLAN DE CORRECCIÓN
     # -------------------------------------------------------------- #
 
     def diagnose_deficiency(
         self,
-        symptom_code: str,
+        symptom_code: str | List[str] | None,
         current_profile: Dict[str, float] | None = None,
         tissue_analysis: Dict[str, float] | None = None,
+        symptom_codes: List[str] | None = None,
+        tissue_unit: str | None = None,
     ) -> Dict[str, Any]:
         return self.deficiency.diagnose(
             symptom_code=symptom_code,
             current_profile=current_profile,
             tissue_analysis=tissue_analysis,
+            symptom_codes=symptom_codes,
+            tissue_unit=tissue_unit,
         )
 
     def build_correction_plan(
         self,
-        symptom_code: str,
+        symptom_code: str | List[str] | None,
         volume_L: float,
         current_profile: Dict[str, float] | None = None,
         tissue_analysis: Dict[str, float] | None = None,
+        symptom_codes: List[str] | None = None,
+        tissue_unit: str | None = None,
     ) -> Dict[str, Any]:
+        return self.build_correction_plans([{
+            "symptom_code": symptom_code,
+            "symptom_codes": symptom_codes,
+            "volume_L": volume_L,
+            "current_profile": current_profile,
+            "tissue_analysis": tissue_analysis,
+            "tissue_unit": tissue_unit,
+        }])[0]
 
-        diag = self.diagnose_deficiency(
-            symptom_code=symptom_code,
-            current_profile=current_profile,
-            tissue_analysis=tissue_analysis,
-        )
-
-        if not diag.get("success"):
-            return diag
-
-        target_delta_ppm: Dict[str, float] = diag["target_delta_ppm"]
-        preferred_ferts: List[str] = diag["preferred_fertilizers"]
-
-        corrections: List[Dict[str, Any]] = []
-
-        for nutrient, delta_ppm in target_delta_ppm.items():
-            fert_used = None
-            fraction = None
-
-            for fert_name in preferred_ferts:
-                fert_info = self.fertilizers.get(fert_name)
-                if fert_info and nutrient in fert_info and fert_info[nutrient] > 0:
-                    fert_used = fert_name
-                    fraction = fert_info[nutrient] / 100.0
-                    break
-
-            if fert_used is None:
-                corrections.append({
-                    "nutrient": nutrient,
-                    "delta_ppm": delta_ppm,
-                    "fertilizer": None,
-                    "grams_required": None,
-                    "warning": "No fertilizer provides this nutrient."
-                })
-                continue
+    def build_correction_plans(self, requests: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """
+        Planes de corrección para muchos tanques/síntomas en una sola llamada.
 
-            grams = self.concentration.grams_of_fertilizer_for_delta_ppm(
-                delta_ppm=delta_ppm,
-                volume_L=volume_L,
-                nutrient_fraction=fraction,
+        Cada request: {"symptom_code" | "symptom_codes", "volume_L",
+        "current_profile"?, "tissue_analysis"?, "tissue_unit"?}. Todos los Δ ppm de cada
+        diagnóstico se resuelven juntos por la matriz de fertilizantes, de modo
+        que el N que aporta el Nitrato de Calcio elegido para Ca ya cuenta.
+        """
+        diagnoses = [
+            self.diagnose_deficiency(
+                symptom_code=req.get("symptom_code"),
+                current_profile=req.get("current_profile"),
+                tissue_analysis=req.get("tissue_analysis"),
+                symptom_codes=req.get("symptom_codes"),
+                tissue_unit=req.get("tissue_unit"),
             )
+            for req in requests
+        ]
 
-            corrections.append({
-                "nutrient": nutrient,
-                "delta_ppm": delta_ppm,
-                "fertilizer": fert_used,
-                "fertilizer_fraction": fraction,
-                "grams_required": round(grams, 2),
-            })
+        ok = [k for k, diag in enumerate(diagnoses) if diag.get("success")]
+        plans = self.correction.plan_many([
+            {
+                "target_delta_ppm": diagnoses[k]["target_delta_ppm"],
+                "preferred_fertilizers": diagnoses[k]["preferred_fertilizers"],
+                "volume_L": float(requests[k].get("volume_L") or 0),
+            }
+            for k in ok
+        ])
+        plan_by_request = dict(zip(ok, plans))
 
-        return {
-            "success": True,
-            "symptom": symptom_code,
-            "diagnosis": diag,
-            "volume_L": volume_L,
-            "corrections": corrections,
-        }
+        results: List[Dict[str, Any]] = []
+        for k, diag in enumerate(diagnoses):
+            if k not in plan_by_request:
+                results.append(diag)
+                continue
+            plan = plan_by_request[k]
+            results.append({
+                "success": True,
+                "symptom": diag["symptom"],
+                "diagnosis": diag,
+                "volume_L": plan["volume_L"],
+                "corrections": plan["corrections"],
+                "doses": plan["doses"],
+                "side_effects_ppm": plan["side_effects_ppm"],
+            })
+        return results
 
     # -------------------------------------------------------------- #
     # BALANCEO DE ECUACIONES
@@ -155,6 +180,11 @@ class ChemicalEngine:
     # SOLUCIONES MOLARES 1 M
     # -------------------------------------------------------------- #
 
+    def autocomplete_compound(self, prefix: str, limit: int = 8) -> Dict[str, Any]:
+        """Sugerencias de compuestos (fórmula, nombre o alias) con su masa molar."""
+        result = self.compounds.complete(prefix, limit)
+        return {"success": True, "query": prefix, **result}
+
     def prepare_molar_solution(self, formula: str, volume_L: float) -> Dict[str, Any]:
         """
         Calcula la masa de compuesto necesaria para preparar X litros de
@@ -163,7 +193,7 @@ class ChemicalEngine:
         Fórmula:
             gramos = (masa molar) * (litros)
         """
-        mm = self.reactions.molar_mass(formula)
+        mm = self.compounds.molar_mass(formula)
         grams = mm * volume_L
 
         return {
@@ -173,3 +203,65 @@ class ChemicalEngine:
             "grams": round(grams, 3),
             "molar_mass": round(mm, 4),
         }
+
+    def prepare_molar_solutions(self, items: List[Dict[str, Any]]) -> Dict[str, Any]:
+        """
+        Prepara un lote de soluciones madre en una sola llamada.
+
+        items: [{"compound": "KNO3", "volume_L": 1, "molarity_M": 1 (opcional)}]
+        Los errores son por elemento (fórmula vacía o inválida, volumen o
+        molaridad no numéricos, no finitos o <= 0) y no invalidan el resto
+        del lote.
+        """
+        n = len(items)
+        formulas = [""] * n
+        volumes = np.full(n, np.nan)
+        molarities = np.full(n, np.nan)
+        parse_errors: List[str | None] = [None] * n
+        for i, it in enumerate(items):
+            if not isinstance(it, dict):
+                parse_errors[i] = "Cada solución debe ser un objeto {compound, volume_L, molarity_M}."
+                continue
+            formulas[i] = str(it.get("compound") or "").strip()
+            molarity = it.get("molarity_M")
+            try:
+                volumes[i] = float(it.get("volume_L") or 0)
+                molarities[i] = 1.0 if molarity is None else float(molarity)
+            except (TypeError, ValueError):
+                parse_errors[i] = "El volumen y la molaridad deben ser numéricos."
+
+        with np.errstate(over="ignore", invalid="ignore"):   # los no finitos se marcan abajo
+            batch = self.stoichiometry.solution_molar_many(formulas, molarities, volumes)
+        errors = [parse_errors[i] or ("Falta la fórmula del compuesto." if not formulas[i] else batch["errors"][i])
+                  for i in range(n)]
+        for i in np.flatnonzero(~np.isfinite(volumes) | (volumes <= 0)):
+            errors[i] = errors[i] or "El volumen debe ser un número finito mayor que cero."
+        for i in np.flatnonzero(~np.isfinite(molarities) | (molarities <= 0)):
+            errors[i] = errors[i] or "La molaridad debe ser un número finito mayor que cero."
+        masses = batch["molar_mass"]
+        for i in np.flatnonzero(~np.isfinite(masses) | (masses <= 0)):
+            errors[i] = errors[i] or f"'{formulas[i]}' no tiene masa molar (¿fórmula sin elementos?)."
+        for i in np.flatnonzero(~np.isfinite(batch["grams_required"])):
+            errors[i] = errors[i] or "La masa necesaria no es un número finito."
+
+        solutions = []
+        for i, formula in enumerate(formulas):
+            if errors[i]:
+                solutions.append({"success": False, "compound": formula, "error": errors[i]})
+                continue
+            solutions.append({
+                "success": True,
+                "compound": formula,
+                "volume_L": float(volumes[i]),
+                "molarity_M": float(molarities[i]),
+                "grams": round(float(batch["grams_required"][i]), 3),
+                "molar_mass": float(batch["molar_mass"][i]),
+            })
+
+        valid = [e is None for e in errors]
+        return {
+            "success": True,
+            "solutions": solutions,
+            "total_grams": round(float(batch["grams_required"][valid].sum()), 3),
+            "errores": len(items) - sum(valid),
+        }
@@ -0,0 +1,242 @@
+# chemistry_engine/compound_library.py
+
+from __future__ import annotations
+import json
+import os
+import unicodedata
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional
+
+from .reactions import ReactionBalancer, parse_formula
+
+
+@dataclass
+class Compound:
+    formula: str
+    nombre: str
+    masa_molar: float
+    composicion: Dict[str, int]
+    composicion_pct: Dict[str, float]
+    origen: str = "biblioteca"          # "biblioteca" | "catalogo" | "calculado"
+    alias: List[str] = field(default_factory=list)
+    uso: float = 0.0                    # popularidad para ordenar sugerencias
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "formula": self.formula,
+            "nombre": self.nombre,
+            "masa_molar": self.masa_molar,
+            "composicion": self.composicion,
+            "composicion_pct": self.composicion_pct,
+            "origen": self.origen,
+            "alias": self.alias,
+        }
+
+
+class _TrieNode:
+    __slots__ = ("children", "top")
+
+    def __init__(self):
+        self.children: Dict[str, _TrieNode] = {}
+        self.top: List[int] = []        # índices de compuestos, ya ordenados por relevancia
+
+
+def _canonical(formula: str) -> str:
+    """Fórmula sin espacios y con '·' como único separador de hidrato."""
+    return formula.replace("•", "·").replace("*", "·").replace(" ", "")
+
+
+def normalize(text: str) -> str:
+    """Minúsculas, sin tildes y con '·' unificado: 'Ácido Bórico' → 'acido borico'."""
+    text = unicodedata.normalize("NFKD", text)
+    text = "".join(c for c in text if not unicodedata.combining(c))
+    return text.replace("•", "·").replace("*", "·").lower().strip()
+
+
+class CompoundLibrary:
+    """
+    Biblioteca de compuestos con masa molar y composición precalculadas.
+
+    Se construye una sola vez a partir de data/compounds.json y del catálogo
+    de fertilizantes (data/salt_ions.json, que trae la fórmula de cada sal).
+    Fórmula, nombre, cada palabra del nombre y los alias se indexan en un
+    trie por prefijo; cada nodo guarda ya ordenados los mejores TOP_PER_NODE
+    compuestos de su subárbol, así que una consulta cuesta O(len(prefijo)).
+
+    Con caché en disco, la lista de compuestos ya compilada (masas molares y
+    composiciones) se reutiliza mientras no cambien los JSON de origen ni las
+    masas atómicas; solo se rehace el trie.
+    """
+
+    TOP_PER_NODE = 20
+    ORIGIN_BONUS = {"catalogo": 1000.0, "biblioteca": 0.0}
+
+    def __init__(self, base_path: str | None = None, balancer: ReactionBalancer | None = None, cache: Any = None):
+        self.base_path = base_path or os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        self.balancer = balancer or ReactionBalancer()
+        self.cache = cache
+        self.compounds: List[Compound] = []
+        self._by_formula: Dict[str, int] = {}   # fórmula exacta (distingue Co de CO)
+        self._by_key: Dict[str, int] = {}       # fórmula normalizada (autocompletado)
+        self._root = _TrieNode()
+        self.build()
+
+    # -------------------------------------------------------------- #
+    # CONSTRUCCIÓN
+    # -------------------------------------------------------------- #
+
+    def _load_json(self, name: str) -> Any:
+        path = os.path.join(self.base_path, "data", name)
+        if not os.path.exists(path):
+            print(f"[CompoundLibrary] WARNING: {name} no encontrado")
+            return None
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+
+    def make_compound(self, formula: str, nombre: str = "", origen: str = "calculado",
+                      alias: List[str] | None = None, uso: float = 0.0) -> Compound:
+        """Calcula masa molar y composición (ValueError si hay elementos desconocidos)."""
+        composition = parse_formula(formula)
+        if not composition:
+            raise ValueError(f"Fórmula vacía o inválida: '{formula}'")
+        unknown = [e for e in composition if e not in self.balancer.atomic_masses]
+        if unknown:
+            raise ValueError(f"Elemento desconocido: {', '.join(unknown)}")
+
+        masses = {e: self.balancer.atomic_masses[e] * n for e, n in composition.items()}
+        total = sum(masses.values())
+        return Compound(
+            formula=formula,
+            nombre=nombre or formula,
+            masa_molar=round(total, 4),
+            composicion=composition,
+            composicion_pct={e: round(100.0 * m / total, 3) for e, m in masses.items()},
+            origen=origen,
+            alias=list(alias or []),
+            uso=float(uso),
+        )
+
+    def build(self):
+        cached = None
+        if self.cache is not None:
+            key = self.cache.fingerprint(
+                self.cache.file_fingerprint(*(os.path.join(self.base_path, "data", n) for n in ("salt_ions.json", "compounds.json"))),
+                self.balancer.atomic_masses,
+            )
+            cached = self.cache.section("compuestos", key)
+
+        if cached and "compuestos" in cached:
+            compounds = [Compound(**c) for c in cached["compuestos"]]
+        else:
+            compounds = self._compile()
+            if cached is not None:
+                cached["compuestos"] = [{**c.to_dict(), "uso": c.uso} for c in compounds]
+                self.cache.touch()
+        self._index(compounds)
+
+    def _compile(self) -> List[Compound]:
+        """Compuestos del catálogo y de la biblioteca, ordenados por relevancia."""
+        compounds: List[Compound] = []
+
+        catalog = self._load_json("salt_ions.json") or {}
+        for name, salt in catalog.items():
+            if salt.get("formula"):
+                compounds.append(self.make_compound(salt["formula"], name, "catalogo", alias=[name], uso=100))
+
+        seen = {normalize(c.formula): c for c in compounds}
+        library = self._load_json("compounds.json") or {}
+        for entry in library.get("compuestos", []):
+            # Misma fórmula que una sal del catálogo: se fusionan nombre y alias
+            known = seen.get(normalize(entry["formula"]))
+            if known is not None:
+                known.alias += [entry.get("nombre", "")] + list(entry.get("alias") or [])
+                continue
+            try:
+                comp = self.make_compound(
+                    entry["formula"], entry.get("nombre", ""), "biblioteca",
+                    alias=entry.get("alias"), uso=entry.get("uso", 0),
+                )
+            except ValueError as e:
+                print(f"[CompoundLibrary] WARNING: {entry.get('formula')}: {e}")
+                continue
+            compounds.append(comp)
+            seen[normalize(comp.formula)] = comp
+
+        # Orden global por relevancia: los nodos del trie heredan este orden
+        compounds.sort(key=lambda c: (-(c.uso + self.ORIGIN_BONUS.get(c.origen, 0)), len(c.formula)))
+        return compounds
+
+    def _index(self, compounds: List[Compound]):
+        self.compounds = compounds
+        self._by_formula = {}
+        self._by_key = {}
+        self._root = _TrieNode()
+
+        for idx, comp in enumerate(compounds):
+            self._by_formula.setdefault(_canonical(comp.formula), idx)
+            self._by_key.setdefault(normalize(comp.formula), idx)
+            keys = {normalize(comp.formula)}
+            for text in [comp.nombre, *comp.alias]:
+                keys.add(normalize(text))
+                keys.update(normalize(w) for w in text.split() if len(w) > 2)
+            keys.discard("")
+            for key in keys:
+                self._insert(key, idx)
+
+    def _insert(self, key: str, idx: int):
+        node = self._root
+        for ch in key:
+            node = node.children.setdefault(ch, _TrieNode())
+            # idx llega en orden de relevancia: basta con añadir al final si hay hueco
+            if len(node.top) < self.TOP_PER_NODE and (not node.top or node.top[-1] != idx):
+                node.top.append(idx)
+
+    # -------------------------------------------------------------- #
+    # CONSULTAS
+    # -------------------------------------------------------------- #
+
+    def get(self, formula: str) -> Optional[Compound]:
+        idx = self._by_formula.get(_canonical(formula))
+        return self.compounds[idx] if idx is not None else None
+
+    def molar_mass(self, formula: str) -> float:
+        """Masa molar precalculada si el compuesto está en la biblioteca; si no, se calcula."""
+        comp = self.get(formula)
+        return comp.masa_molar if comp else self.balancer.molar_mass(formula)
+
+    def complete(self, prefix: str, limit: int = 8) -> Dict[str, Any]:
+        """
+        Sugerencias para lo que el usuario lleva escrito.
+
+        Devuelve {"matches": [...], "exacto": bool, "error": str|None}. Si no hay
+        coincidencias en la biblioteca pero el texto es una fórmula válida, se
+        devuelve el compuesto calculado al vuelo; si no lo es, 'error' explica
+        el problema (elemento desconocido) antes de enviar el cálculo.
+        """
+        key = normalize(prefix)
+        limit = max(1, min(int(limit), self.TOP_PER_NODE))
+        if not key:
+            return {"matches": [c.to_dict() for c in self.compounds[:limit]], "exacto": False, "error": None}
+
+        node = self._root
+        for ch in key:
+            node = node.children.get(ch)
+            if node is None:
+                break
+
+        ranked = list(node.top) if node is not None else []
+        exact = self._by_key.get(key)
+        if exact is not None:
+            if exact in ranked:
+                ranked.remove(exact)
+            ranked.insert(0, exact)
+
+        matches = [self.compounds[i].to_dict() for i in ranked[:limit]]
+        error = None
+        if not matches:
+            try:
+                matches = [self.make_compound(prefix.strip()).to_dict()]
+            except ValueError as e:
+                error = str(e)
+
+        return {"matches": matches, "exacto": exact is not None, "error": error}
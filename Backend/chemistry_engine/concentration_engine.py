@@ -2,7 +2,32 @@
 
 from __future__ import annotations
 from dataclasses import dataclass
-from typing import Dict
+from typing import Dict, Union
+
+import numpy as np
+
+# Escalares o arrays numpy (con broadcasting entre argumentos)
+ArrayLike = Union[float, np.ndarray]
+
+
+def _as_array(x) -> np.ndarray:
+    return np.asarray(x, dtype=float)
+
+
+def _result(x: np.ndarray) -> ArrayLike:
+    """Entradas escalares devuelven float (compatibilidad); arrays devuelven ndarray."""
+    return float(x) if np.ndim(x) == 0 else x
+
+
+def _validate(invalid: np.ndarray, message: str):
+    """Aplica una validación elemento a elemento e indica las posiciones que fallan."""
+    if not np.any(invalid):
+        return
+    if np.ndim(invalid) == 0:
+        raise ValueError(message)
+    positions = [tuple(int(i) for i in idx) if len(idx) > 1 else int(idx[0])
+                 for idx in np.argwhere(invalid)[:10]]
+    raise ValueError(f"{message} (posiciones: {positions})")
 
 
 @dataclass
@@ -23,46 +48,51 @@ class ConcentrationEngine:
       - ppm <-> molaridad
       - cálculo de gramos de fertilizante necesarios para cambiar X ppm
         de un nutriente dado, respetando el % en el análisis del fertilizante.
+
+    Todas las conversiones aceptan escalares o arrays numpy (con broadcasting
+    entre argumentos, p. ej. deltas (n, 1) contra fracciones (1, m)). Las
+    validaciones se aplican elemento a elemento: si algún elemento no es
+    válido se lanza el mismo ValueError, indicando sus posiciones.
     """
 
-    def ppm_to_mg_per_L(self, ppm: float) -> float:
+    def ppm_to_mg_per_L(self, ppm: ArrayLike) -> ArrayLike:
         """
         1 ppm ~= 1 mg/L en agua.
         """
-        return ppm
+        return _result(_as_array(ppm))
 
-    def mg_per_L_to_ppm(self, mg_per_L: float) -> float:
-        return mg_per_L
+    def mg_per_L_to_ppm(self, mg_per_L: ArrayLike) -> ArrayLike:
+        return _result(_as_array(mg_per_L))
 
-    def g_per_L_to_ppm(self, g_per_L: float) -> float:
+    def g_per_L_to_ppm(self, g_per_L: ArrayLike) -> ArrayLike:
         """
         1 g/L = 1000 mg/L = 1000 ppm (agua).
         """
-        return g_per_L * 1000.0
+        return _result(_as_array(g_per_L) * 1000.0)
 
-    def ppm_to_g_per_L(self, ppm: float) -> float:
+    def ppm_to_g_per_L(self, ppm: ArrayLike) -> ArrayLike:
         """
         ppm → g/L (en agua).
         """
-        return ppm / 1000.0
+        return _result(_as_array(ppm) / 1000.0)
 
-    def molarity_to_ppm(self, molarity_M: float, molar_mass_g_mol: float) -> float:
+    def molarity_to_ppm(self, molarity_M: ArrayLike, molar_mass_g_mol: ArrayLike) -> ArrayLike:
         """
         Convierte molaridad (mol/L) a ppm asumiendo agua.
         ppm = (mol/L * g/mol * 1000 mg/g)
         """
-        mg_per_L = molarity_M * molar_mass_g_mol * 1000.0
-        return mg_per_L  # mg/L = ppm
+        mg_per_L = _as_array(molarity_M) * _as_array(molar_mass_g_mol) * 1000.0
+        return _result(mg_per_L)  # mg/L = ppm
 
-    def ppm_to_molarity(self, ppm: float, molar_mass_g_mol: float) -> float:
+    def ppm_to_molarity(self, ppm: ArrayLike, molar_mass_g_mol: ArrayLike) -> ArrayLike:
         """
         Convierte ppm a molaridad (mol/L).
         ppm ~ mg/L.
         mol/L = (mg/L) / (1000 mg/g * g/mol)
         """
-        mg_per_L = ppm
-        mol_per_L = mg_per_L / (1000.0 * molar_mass_g_mol)
-        return mol_per_L
+        mg_per_L = _as_array(ppm)
+        mol_per_L = mg_per_L / (1000.0 * _as_array(molar_mass_g_mol))
+        return _result(mol_per_L)
 
     # ------------------------------------------------------------------ #
     # CÁLCULOS DE MASA DE FERTILIZANTE
@@ -70,10 +100,10 @@ class ConcentrationEngine:
 
     def grams_of_fertilizer_for_delta_ppm(
         self,
-        delta_ppm: float,
-        volume_L: float,
-        nutrient_fraction: float,
-    ) -> float:
+        delta_ppm: ArrayLike,
+        volume_L: ArrayLike,
+        nutrient_fraction: ArrayLike,
+    ) -> ArrayLike:
         """
         Calcula cuántos gramos de una sal hay que agregar para aumentar
         delta_ppm de UN nutriente dado.
@@ -90,29 +120,29 @@ class ConcentrationEngine:
           g/L (sal) = mg/L / 1000
           gramos totales = g/L * volumen_L
         """
-        if nutrient_fraction <= 0:
-            raise ValueError("La fracción de nutriente debe ser > 0")
+        nutrient_fraction = _as_array(nutrient_fraction)
+        _validate(nutrient_fraction <= 0, "La fracción de nutriente debe ser > 0")
 
-        mg_per_L_nutrient = delta_ppm
+        mg_per_L_nutrient = _as_array(delta_ppm)
         mg_per_L_salt = mg_per_L_nutrient / nutrient_fraction
         g_per_L_salt = mg_per_L_salt / 1000.0
-        total_grams = g_per_L_salt * volume_L
-        return total_grams
+        total_grams = g_per_L_salt * _as_array(volume_L)
+        return _result(total_grams)
 
     def nutrient_ppm_from_fertilizer(
         self,
-        fertilizer_grams: float,
-        volume_L: float,
-        nutrient_fraction: float,
-    ) -> float:
+        fertilizer_grams: ArrayLike,
+        volume_L: ArrayLike,
+        nutrient_fraction: ArrayLike,
+    ) -> ArrayLike:
         """
         Dado cuántos gramos de sal agrego, devuelve a cuántos ppm equivale
         el nutriente objetivo en el tanque.
         """
-        if volume_L <= 0:
-            raise ValueError("El volumen debe ser mayor que cero.")
+        volume_L = _as_array(volume_L)
+        _validate(volume_L <= 0, "El volumen debe ser mayor que cero.")
 
-        total_nutrient_g = fertilizer_grams * nutrient_fraction
+        total_nutrient_g = _as_array(fertilizer_grams) * _as_array(nutrient_fraction)
         g_per_L_nutrient = total_nutrient_g / volume_L
         ppm = self.g_per_L_to_ppm(g_per_L_nutrient)
         return ppm
@@ -0,0 +1,275 @@
+# chemistry_engine/correction_engine.py
+
+from __future__ import annotations
+from collections import defaultdict
+from typing import Any, Dict, List, Tuple
+
+import numpy as np
+
+
+NUTRIENT_ORDER = ["N", "P", "K", "Ca", "Mg"]
+
+
+def nnls(A: np.ndarray, b: np.ndarray, max_iter: int | None = None) -> np.ndarray:
+    """
+    Mínimos cuadrados no negativos (Lawson–Hanson): min ||Ax - b|| con x >= 0.
+
+    Pensado para los sistemas pequeños de esta app (unos pocos nutrientes y
+    sales), por eso no depende de scipy.
+    """
+    A = np.asarray(A, dtype=float)
+    b = np.asarray(b, dtype=float)
+    m, n = A.shape
+    x = np.zeros(n)
+    passive = np.zeros(n, dtype=bool)
+    tol = 1e-10 * max(1.0, np.abs(A).max(initial=0.0)) * max(m, n)
+    max_iter = max_iter or 3 * n
+
+    w = A.T @ (b - A @ x)
+    for _ in range(max_iter):
+        if passive.all() or w[~passive].max(initial=-np.inf) <= tol:
+            break
+        candidates = np.where(~passive, w, -np.inf)
+        passive[int(np.argmax(candidates))] = True
+
+        while passive.any():
+            z = np.zeros(n)
+            z[passive] = np.linalg.lstsq(A[:, passive], b, rcond=None)[0]
+            if z[passive].min() > 0:
+                break
+            blocking = passive & (z <= 0)
+            alpha = np.min(x[blocking] / (x[blocking] - z[blocking]))
+            x = x + alpha * (z - x)
+            passive &= x > tol
+            x[~passive] = 0.0
+        else:
+            z = np.zeros(n)
+        x = z
+        w = A.T @ (b - A @ x)
+
+    return x
+
+
+class CorrectionEngine:
+    """
+    Resuelve planes de corrección de forma conjunta a través de la matriz de
+    fertilizantes (ppm por g/L), en lugar de dimensionar cada sal por separado.
+
+    Incluye:
+      - Índice nutriente → [(fertilizante, fracción)] ordenado por fracción
+      - Selección de sales a partir de las preferidas del diagnóstico
+      - Solución conjunta de todos los Δ ppm (NNLS)
+      - Resolución en lote: un producto matricial por grupo de sales
+    """
+
+    def __init__(self, fertilizers: Dict[str, Dict[str, Any]], nutrient_order: List[str] | None = None):
+        self.nutrient_order = nutrient_order or list(NUTRIENT_ORDER)
+        self.set_fertilizers(fertilizers)
+
+    def set_fertilizers(self, fertilizers: Dict[str, Dict[str, Any]]) -> None:
+        """Reconstruye la matriz y el índice a partir del catálogo."""
+        self.fertilizers = fertilizers
+        self.fert_names: List[str] = list(fertilizers)
+        self._fert_pos = {name: j for j, name in enumerate(self.fert_names)}
+        self._nut_pos = {nut: i for i, nut in enumerate(self.nutrient_order)}
+
+        # Fracción en masa de cada nutriente en cada sal (nutrientes x sales)
+        self.fraction_matrix = np.array([
+            [float(fertilizers[name].get(nut, 0) or 0) / 100.0 for name in self.fert_names]
+            for nut in self.nutrient_order
+        ]).reshape(len(self.nutrient_order), len(self.fert_names))
+        # ppm que aporta 1 g/L de cada sal
+        self.ppm_matrix = self.fraction_matrix * 1000.0
+
+        index: Dict[str, List[Tuple[str, float]]] = {}
+        for i, nut in enumerate(self.nutrient_order):
+            pairs = [
+                (name, float(self.fraction_matrix[i, j]))
+                for j, name in enumerate(self.fert_names)
+                if self.fraction_matrix[i, j] > 0
+            ]
+            index[nut] = sorted(pairs, key=lambda p: -p[1])
+        self.nutrient_index = index
+
+        self._pinv_cache: Dict[Tuple[Tuple[str, ...], Tuple[str, ...]], np.ndarray] = {}
+
+    # -------------------------------------------------------------- #
+    # SELECCIÓN DE SALES
+    # -------------------------------------------------------------- #
+
+    def fertilizers_for(self, nutrient: str) -> List[Tuple[str, float]]:
+        """Sales que aportan el nutriente, de mayor a menor fracción."""
+        return self.nutrient_index.get(nutrient, [])
+
+    def select_fertilizers(
+        self,
+        nutrients: List[str],
+        preferred: List[str],
+    ) -> Tuple[List[str], List[str]]:
+        """
+        Elige una sal por nutriente, empezando por el nutriente con menos
+        opciones. Se respeta el orden de las preferidas y, si ninguna sirve, se
+        usa la de mayor fracción del índice. Devuelve (sales, nutrientes sin sal).
+        """
+        options: Dict[str, List[str]] = {}
+        for nut in nutrients:
+            suppliers = {name for name, _ in self.fertilizers_for(nut)}
+            opts = [f for f in preferred if f in suppliers]
+            if not opts:
+                opts = [name for name, _ in self.fertilizers_for(nut)[:1]]
+            options[nut] = opts
+
+        selected: List[str] = []
+        uncovered: List[str] = []
+        for nut in sorted(nutrients, key=lambda n: len(options[n])):
+            opts = options[nut]
+            if not opts:
+                uncovered.append(nut)
+                continue
+            if all(f in selected for f in opts):
+                continue
+            selected.append(next(f for f in opts if f not in selected))
+
+        return selected, uncovered
+
+    # -------------------------------------------------------------- #
+    # RESOLUCIÓN
+    # -------------------------------------------------------------- #
+
+    def _submatrix(self, nutrients: Tuple[str, ...], ferts: Tuple[str, ...]) -> np.ndarray:
+        rows = [self._nut_pos[n] for n in nutrients]
+        cols = [self._fert_pos[f] for f in ferts]
+        return self.ppm_matrix[np.ix_(rows, cols)]
+
+    def _pinv(self, nutrients: Tuple[str, ...], ferts: Tuple[str, ...]) -> np.ndarray:
+        key = (nutrients, ferts)
+        pinv = self._pinv_cache.get(key)
+        if pinv is None:
+            pinv = np.linalg.pinv(self._submatrix(nutrients, ferts))
+            self._pinv_cache[key] = pinv
+        return pinv
+
+    def solve_many(
+        self,
+        nutrients: Tuple[str, ...],
+        ferts: Tuple[str, ...],
+        deltas: np.ndarray,
+    ) -> np.ndarray:
+        """
+        Resuelve g/L de cada sal para muchas filas de Δ ppm con el mismo
+        conjunto de nutrientes y sales. Una sola multiplicación por la
+        pseudo-inversa cacheada; solo las filas con dosis negativas pasan a NNLS.
+        """
+        deltas = np.atleast_2d(np.asarray(deltas, dtype=float))
+        x = deltas @ self._pinv(nutrients, ferts).T
+
+        bad = (x < -1e-12).any(axis=1)
+        if bad.any():
+            A = self._submatrix(nutrients, ferts)
+            for r in np.flatnonzero(bad):
+                x[r] = nnls(A, deltas[r])
+        return np.clip(x, 0.0, None)
+
+    def plan_many(self, items: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """
+        Construye planes para muchos tanques a la vez.
+
+        Cada item: {"target_delta_ppm": {...}, "preferred_fertilizers": [...], "volume_L": float}.
+        Los items con los mismos nutrientes y sales se resuelven juntos.
+        """
+        prepared = []
+        groups: Dict[Tuple[Tuple[str, ...], Tuple[str, ...]], List[int]] = defaultdict(list)
+
+        for k, item in enumerate(items):
+            delta = {n: float(v) for n, v in item["target_delta_ppm"].items()}
+            known = [n for n in delta if n in self._nut_pos]
+            ferts, uncovered = self.select_fertilizers(known, item.get("preferred_fertilizers") or [])
+            solved = tuple(n for n in known if n not in uncovered)
+            uncovered += [n for n in delta if n not in self._nut_pos]
+            prepared.append((delta, solved, tuple(ferts), uncovered))
+            if solved and ferts:
+                groups[(solved, tuple(ferts))].append(k)
+
+        doses_gL: Dict[int, np.ndarray] = {}
+        for (nutrients, ferts), rows in groups.items():
+            D = np.array([[prepared[k][0][n] for n in nutrients] for k in rows])
+            X = self.solve_many(nutrients, ferts, D)
+            for k, x in zip(rows, X):
+                doses_gL[k] = x
+
+        return [
+            self._format_plan(items[k], *prepared[k], doses_gL.get(k))
+            for k in range(len(items))
+        ]
+
+    def plan(self, target_delta_ppm: Dict[str, float], preferred: List[str], volume_L: float) -> Dict[str, Any]:
+        return self.plan_many([{
+            "target_delta_ppm": target_delta_ppm,
+            "preferred_fertilizers": preferred,
+            "volume_L": volume_L,
+        }])[0]
+
+    def _format_plan(
+        self,
+        item: Dict[str, Any],
+        delta: Dict[str, float],
+        nutrients: Tuple[str, ...],
+        ferts: Tuple[str, ...],
+        uncovered: List[str],
+        x_gL: np.ndarray | None,
+    ) -> Dict[str, Any]:
+        volume_L = float(item.get("volume_L") or 0)
+        x_gL = x_gL if x_gL is not None else np.zeros(len(ferts))
+
+        cols = [self._fert_pos[f] for f in ferts]
+        added_ppm = self.ppm_matrix[:, cols] @ x_gL if cols else np.zeros(len(self.nutrient_order))
+
+        doses = []
+        for f, g_per_L in zip(ferts, x_gL):
+            doses.append({
+                "fertilizer": f,
+                "grams_required": round(float(g_per_L * volume_L), 2),
+                "supplies_ppm": {
+                    nut: round(float(g_per_L * self.ppm_matrix[i, self._fert_pos[f]]), 2)
+                    for i, nut in enumerate(self.nutrient_order)
+                    if self.ppm_matrix[i, self._fert_pos[f]] > 0
+                },
+            })
+
+        corrections = []
+        for nut, delta_ppm in delta.items():
+            if nut in uncovered:
+                corrections.append({
+                    "nutrient": nut,
+                    "delta_ppm": delta_ppm,
+                    "fertilizer": None,
+                    "grams_required": None,
+                    "warning": "No fertilizer provides this nutrient.",
+                })
+                continue
+
+            i = self._nut_pos[nut]
+            contributions = [x_gL[c] * self.ppm_matrix[i, self._fert_pos[f]] for c, f in enumerate(ferts)]
+            main = int(np.argmax(contributions))
+            fert_used = ferts[main]
+            corrections.append({
+                "nutrient": nut,
+                "delta_ppm": delta_ppm,
+                "achieved_ppm": round(float(added_ppm[i]), 2),
+                "fertilizer": fert_used,
+                "fertilizer_fraction": float(self.fraction_matrix[i, self._fert_pos[fert_used]]),
+                "grams_required": round(float(x_gL[main] * volume_L), 2),
+            })
+
+        side_effects = {
+            nut: round(float(added_ppm[i]), 2)
+            for i, nut in enumerate(self.nutrient_order)
+            if nut not in delta and added_ppm[i] > 0.005
+        }
+
+        return {
+            "volume_L": volume_L,
+            "corrections": corrections,
+            "doses": doses,
+            "side_effects_ppm": side_effects,
+        }
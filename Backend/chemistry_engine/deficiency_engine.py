@@ -1,8 +1,12 @@
 # chemistry_engine/deficiency_engine.py
 
 from __future__ import annotations
-from dataclasses import dataclass
-from typing import Dict, List, Optional
+import heapq
+import json
+import os
+from collections import defaultdict
+from dataclasses import dataclass, field
+from typing import Any, Dict, Iterable, List, Optional, Tuple
 
 
 @dataclass
@@ -16,150 +20,397 @@ class DeficiencyHypothesis:
     recommendation: str               # Texto amigable para el usuario
     target_delta_ppm: Dict[str, float]  # Objetivos típicos de corrección (Δ ppm)
     preferred_fertilizers: List[str]    # IDs de fertilizantes preferidos para corregir
+    rule_id: str = ""                   # Identificador único de la regla
+    symptoms: Dict[str, float] = field(default_factory=dict)  # {symptom_code: peso}
+
+    @property
+    def total_weight(self) -> float:
+        return sum(self.symptoms.values()) or 1.0
 
 
 class DeficiencyEngine:
     """
     Motor de diagnóstico de deficiencias.
 
-    Recibe un "symptom_code" (ej: "hojas_curvadas") y devuelve:
-      - Explicación detallada
-      - Nutrientes implicados
-      - Δ ppm sugeridos para corrección
+    Las reglas se cargan desde data/deficiency_rules.json (o desde registros
+    entregados por otra fuente, p.ej. SQLite) y se indexan con dos índices
+    invertidos:
+      - síntoma  → [(regla, peso)]
+      - nutriente → [reglas]
+
+    El análisis foliar (tissue_analysis) solo cuenta como evidencia si se
+    indica su unidad (tissue_unit): "pct" (% en materia seca) o "ppm" (mg/kg
+    de materia seca). Sin unidad se devuelve tal cual, como antes, porque los
+    clientes antiguos lo mandaban en "ppm o % relativos". Con unidad, los
+    nutrientes por debajo del rango suman además, por el índice de nutrientes,
+    las reglas que los tratan aunque ningún síntoma reportado las active.
+
+    Recibe uno o varios "symptom_code" (ej: "hojas_curvadas") y devuelve:
+      - Hipótesis ordenadas por puntaje
+      - Explicación detallada y nutrientes implicados
+      - Δ ppm sugeridos para corrección (ajustados al perfil actual)
       - Sales recomendadas para aplicar dicha corrección
     """
 
-    def __init__(self):
-        self._rules: Dict[str, DeficiencyHypothesis] = self._build_rules()
+    RULES_FILE = "deficiency_rules.json"
+
+    # Peso de la evidencia externa sobre el puntaje por síntomas
+    TISSUE_WEIGHT = 0.5
+    PROFILE_WEIGHT = 0.25
+    # Un nutriente dentro de rango resta algo de credibilidad a la hipótesis
+    IN_RANGE_EVIDENCE = -0.25
+    # Hipótesis sin síntomas, solo por análisis foliar bajo: puntaje base reducido
+    TISSUE_ONLY_WEIGHT = 0.25
+    # Factor a % en materia seca por unidad de tissue_analysis
+    TISSUE_UNITS = {"pct": 1.0, "ppm": 1e-4}
+
+    def __init__(
+        self,
+        rules_path: str | None = None,
+        records: Iterable[Dict[str, Any]] | None = None,
+    ):
+        self._rules: Dict[str, DeficiencyHypothesis] = {}
+        self._symptom_index: Dict[str, List[Tuple[str, float]]] = {}
+        self._nutrient_index: Dict[str, List[str]] = {}
+        self._primary_index: Dict[str, Dict[Tuple[str, ...], List[str]]] = {}
+        self.solution_ranges: Dict[str, Dict[str, float]] = {}
+        self.tissue_ranges: Dict[str, Dict[str, float]] = {}
+        self.version = 0
+
+        if records is not None:
+            self.load_rules(records)
+        else:
+            self._load_rules_file(rules_path)
 
     # ------------------------------------------------------------------ #
-    # REGLAS BASE
+    # CARGA E INDEXADO DE REGLAS
     # ------------------------------------------------------------------ #
 
-    def _build_rules(self) -> Dict[str, DeficiencyHypothesis]:
+    def _resolve_rules_path(self, rules_path: str | None) -> str | None:
+        if rules_path:
+            return rules_path
+        base_path = os.path.dirname(os.path.abspath(__file__))
+        for candidate in (
+            os.path.join(base_path, "data", self.RULES_FILE),
+            os.path.join(os.path.dirname(base_path), "data", self.RULES_FILE),
+        ):
+            if os.path.exists(candidate):
+                return candidate
+        return None
+
+    def _load_rules_file(self, rules_path: str | None) -> None:
+        path = self._resolve_rules_path(rules_path)
+        if path is None:
+            print(f"[DeficiencyEngine] WARNING: {self.RULES_FILE} no encontrado")
+            return
+
+        with open(path, "r", encoding="utf-8") as f:
+            doc = json.load(f)
+
+        self.load_rules(
+            doc.get("rules", []),
+            solution_ranges=doc.get("solution_ranges_ppm"),
+            tissue_ranges=doc.get("tissue_sufficiency_pct"),
+        )
+
+    def load_rules(
+        self,
+        records: Iterable[Dict[str, Any]],
+        solution_ranges: Dict[str, Dict[str, float]] | None = None,
+        tissue_ranges: Dict[str, Dict[str, float]] | None = None,
+    ) -> None:
         """
-        Aquí defines todos los síntomas y sus interpretaciones.
-        Puedes ir afinando esto con el tiempo.
+        Reemplaza las reglas actuales y reconstruye los índices invertidos.
+
+        Cada registro necesita "id" y "symptoms" ({código: peso} o lista de
+        códigos con peso 1.0); el resto de campos son los de DeficiencyHypothesis.
         """
         rules: Dict[str, DeficiencyHypothesis] = {}
+        symptom_index: Dict[str, List[Tuple[str, float]]] = defaultdict(list)
+        nutrient_index: Dict[str, List[str]] = defaultdict(list)
+        primary_index: Dict[str, Dict[Tuple[str, ...], List[str]]] = defaultdict(lambda: defaultdict(list))
 
-        # 1) Clorosis en hojas viejas → deficiencia de N (y a veces Mg)
-        rules["clorosis_hojas_viejas"] = DeficiencyHypothesis(
-            primary_nutrients=["N"],
-            secondary_nutrients=["Mg"],
-            description=(
-                "La clorosis en hojas viejas suele indicar deficiencia de nitrógeno (N), "
-                "pues es un nutriente móvil que se redistribuye hacia tejidos nuevos. "
-                "En algunos casos puede coexistir con baja disponibilidad de Magnesio (Mg)."
-            ),
-            recommendation=(
-                "Aumenta ligeramente la concentración de N (p.ej. +20–40 ppm) usando una fuente "
-                "rica en nitratos (Nitrato de Calcio o Nitrato de Potasio) y revisa que el pH "
-                "se mantenga en el rango 5.5–6.0 para evitar bloqueos."
-            ),
-            target_delta_ppm={"N": 30.0},  # valor típico sugerido
-            preferred_fertilizers=["NitratoCalcio", "NitratoPotasio", "NitratoAmonio"],
-        )
+        for rec in records:
+            symptoms = rec.get("symptoms") or {rec["id"]: 1.0}
+            if not isinstance(symptoms, dict):
+                symptoms = {code: 1.0 for code in symptoms}
 
-        # 2) Necrosis bordes hojas nuevas → K o Ca (exceso de sales también)
-        rules["necrosis_bordes"] = DeficiencyHypothesis(
-            primary_nutrients=["K", "Ca"],
-            secondary_nutrients=["Mg"],
-            description=(
-                "La necrosis o 'quemadura' en bordes de hojas nuevas puede indicar problemas "
-                "con el Potasio (K) o con el Calcio (Ca). También puede deberse a toxicidad "
-                "por exceso de sales (EC demasiado alta)."
-            ),
-            recommendation=(
-                "Verifica la EC de la solución. Si es muy alta, considera diluir o hacer un "
-                "flush. Si la EC es correcta, aumenta ligeramente K (ej. +20 ppm) o revisa "
-                "que el aporte de Ca sea suficiente a través de Nitrato de Calcio."
-            ),
-            target_delta_ppm={"K": 20.0},
-            preferred_fertilizers=["NitratoPotasio"],
-        )
+            rule = DeficiencyHypothesis(
+                primary_nutrients=list(rec.get("primary_nutrients", [])),
+                secondary_nutrients=list(rec.get("secondary_nutrients", [])),
+                description=rec.get("description", ""),
+                recommendation=rec.get("recommendation", ""),
+                target_delta_ppm={k: float(v) for k, v in rec.get("target_delta_ppm", {}).items()},
+                preferred_fertilizers=list(rec.get("preferred_fertilizers", [])),
+                rule_id=rec["id"],
+                symptoms={k: float(v) for k, v in symptoms.items()},
+            )
+            rules[rule.rule_id] = rule
 
-        # 3) Hojas nuevas pequeñas/curvadas → Ca o B con explicación completa
-        rules["hojas_curvadas"] = DeficiencyHypothesis(
-            primary_nutrients=["Ca"],
-            secondary_nutrients=["B"],
-            description=(
-                "Hojas nuevas deformadas, pequeñas o curvadas suelen indicar problemas de "
-                "movilidad de Calcio (Ca) o deficiencia de Boro (B). El Calcio tiene "
-                "movilidad muy limitada en la planta, por lo que depende fuertemente del "
-                "flujo transpiratorio y de la concentración en la solución nutritiva."
-            ),
-            recommendation=(
-                "Asegúrate de que tu solución aporte suficiente Calcio mediante Nitrato de Calcio. "
-                "Mantén el pH en 5.5–6.0 para favorecer la absorción. Evita EC excesiva que "
-                "pueda estresar las raíces. Si el problema persiste, evalúa un aporte foliar "
-                "suave de Ca o B formulado específicamente para ello."
-            ),
-            target_delta_ppm={"Ca": 30.0},
-            preferred_fertilizers=["NitratoCalcio"],
-        )
+            for code, weight in rule.symptoms.items():
+                symptom_index[code].append((rule.rule_id, weight))
+            for nut in dict.fromkeys(rule.primary_nutrients + rule.secondary_nutrients):
+                nutrient_index[nut].append(rule.rule_id)
+            for nut in dict.fromkeys(rule.primary_nutrients):
+                primary_index[nut][tuple(rule.primary_nutrients)].append(rule.rule_id)
 
-        # 4) Tallos púrpura → P bajo + temperaturas bajas
-        rules["tallos_púrpura"] = DeficiencyHypothesis(
-            primary_nutrients=["P"],
-            secondary_nutrients=[],
-            description=(
-                "Coloración púrpura en tallos o envés de hojas suele asociarse a deficiencia "
-                "de Fósforo (P), especialmente bajo condiciones de baja temperatura. "
-                "El fósforo es clave en energía (ATP) y en el desarrollo radicular."
-            ),
-            recommendation=(
-                "Incrementa la dosis de Fósforo usando Fosfato Monopotásico, añadiendo "
-                "unos +15–25 ppm de P. Asegúrate de que la temperatura de la solución no "
-                "sea demasiado baja y que el pH esté en rango adecuado (5.5–6.2)."
-            ),
-            target_delta_ppm={"P": 20.0},
-            preferred_fertilizers=["FosfatoMonopot"],
-        )
+        self._rules = rules
+        self._symptom_index = dict(symptom_index)
+        self._nutrient_index = dict(nutrient_index)
+        # nutriente primario → {nutrientes primarios de la regla: ids de mayor a menor}
+        self._primary_index = {
+            nut: {key: sorted(rids, reverse=True) for key, rids in groups.items()}
+            for nut, groups in primary_index.items()
+        }
+        if solution_ranges is not None:
+            self.solution_ranges = solution_ranges
+        if tissue_ranges is not None:
+            self.tissue_ranges = tissue_ranges
+        self.version += 1
+
+    # ------------------------------------------------------------------ #
+    # CONSULTAS SOBRE LOS ÍNDICES
+    # ------------------------------------------------------------------ #
 
-        return rules
+    def symptom_codes(self) -> List[str]:
+        return sorted(self._symptom_index)
+
+    def rules_for_symptom(self, symptom_code: str) -> List[DeficiencyHypothesis]:
+        return [self._rules[rid] for rid, _ in self._symptom_index.get(symptom_code, [])]
+
+    def rules_for_nutrient(self, nutrient: str) -> List[DeficiencyHypothesis]:
+        return [self._rules[rid] for rid in self._nutrient_index.get(nutrient, [])]
+
+    # ------------------------------------------------------------------ #
+    # EVIDENCIA (ANÁLISIS FOLIAR / PERFIL ACTUAL)
+    # ------------------------------------------------------------------ #
+
+    def _range_evidence(
+        self,
+        nutrients: List[str],
+        values: Dict[str, float] | None,
+        ranges: Dict[str, Dict[str, float]],
+    ) -> Tuple[float, Dict[str, str]]:
+        """
+        Evidencia en [-1, 1] a favor de una deficiencia de los nutrientes dados:
+        positiva si están por debajo del rango, negativa si están en rango o por encima.
+        """
+        if not values:
+            return 0.0, {}
+
+        total = 0.0
+        count = 0
+        status: Dict[str, str] = {}
+        for nut in nutrients:
+            rng = ranges.get(nut)
+            if rng is None or values.get(nut) is None:
+                continue
+            value = float(values[nut])
+            lo, hi = float(rng["min"]), float(rng["max"])
+            if value < lo:
+                total += min(1.0, (lo - value) / lo) if lo > 0 else 1.0
+                status[nut] = "bajo"
+            elif value > hi:
+                total -= min(1.0, (value - hi) / hi) if hi > 0 else 1.0
+                status[nut] = "alto"
+            else:
+                total += self.IN_RANGE_EVIDENCE
+                status[nut] = "normal"
+            count += 1
+
+        return (total / count if count else 0.0), status
+
+    def _adjust_delta(
+        self,
+        target_delta_ppm: Dict[str, float],
+        current_profile: Dict[str, float] | None,
+    ) -> Dict[str, float]:
+        """
+        Ajusta el Δ ppm de la regla al perfil actual: lo eleva hasta el mínimo
+        recomendado si la solución está por debajo y lo recorta para no superar
+        el máximo.
+        """
+        if not current_profile:
+            return dict(target_delta_ppm)
+
+        adjusted: Dict[str, float] = {}
+        for nut, delta in target_delta_ppm.items():
+            rng = self.solution_ranges.get(nut)
+            current = current_profile.get(nut)
+            if rng is None or current is None:
+                adjusted[nut] = delta
+                continue
+            current = float(current)
+            delta = max(delta, float(rng["min"]) - current)
+            delta = min(delta, float(rng["max"]) - current)
+            adjusted[nut] = round(max(0.0, delta), 2)
+        return adjusted
+
+    def _tissue_pct(
+        self,
+        tissue_analysis: Dict[str, float] | None,
+        tissue_unit: str | None,
+    ) -> Dict[str, float] | None:
+        """Análisis foliar en % de materia seca, o None si no hay unidad (solo se devuelve)."""
+        if not tissue_analysis or tissue_unit is None:
+            return None
+        if tissue_unit not in self.TISSUE_UNITS:
+            raise ValueError(f"tissue_unit debe ser uno de: {', '.join(self.TISSUE_UNITS)}")
+        factor = self.TISSUE_UNITS[tissue_unit]
+        return {nut: float(v) * factor for nut, v in tissue_analysis.items() if v is not None}
 
     # ------------------------------------------------------------------ #
     # API PÚBLICA
     # ------------------------------------------------------------------ #
 
+    def rank(
+        self,
+        symptom_codes: List[str],
+        current_profile: Optional[Dict[str, float]] = None,
+        tissue_analysis: Optional[Dict[str, float]] = None,
+        top_k: int = 5,
+    ) -> List[Dict[str, Any]]:
+        """
+        Puntúa y ordena las hipótesis para un conjunto de síntomas.
+
+        tissue_analysis va ya en % de materia seca (ver _tissue_pct). Solo se
+        visitan las reglas alcanzadas desde el índice de síntomas y, para los
+        nutrientes foliares bajo rango, desde el índice de nutrientes primarios
+        (acotado a top_k por grupo), por lo que el costo no depende del tamaño
+        total de la base de reglas.
+        """
+        reported = list(dict.fromkeys(symptom_codes))
+        matched_weight: Dict[str, float] = defaultdict(float)
+        matched_symptoms: Dict[str, List[str]] = defaultdict(list)
+
+        for code in reported:
+            for rid, weight in self._symptom_index.get(code, ()):
+                matched_weight[rid] += weight
+                matched_symptoms[rid].append(code)
+
+        # Nutrientes foliares bajo rango: sus reglas entran como candidatas aunque
+        # ningún síntoma las active. Sin síntomas, las reglas con los mismos
+        # nutrientes primarios puntúan igual y empatan por id, así que de cada
+        # grupo basta con las top_k de mayor id.
+        low = [
+            nut for nut, value in (tissue_analysis or {}).items()
+            if nut in self.tissue_ranges and value < float(self.tissue_ranges[nut]["min"])
+        ]
+        candidates = dict.fromkeys(matched_weight)
+        for nut in low:
+            for rids in self._primary_index.get(nut, {}).values():
+                taken = 0
+                for rid in rids:
+                    if taken >= top_k:
+                        break
+                    if rid not in matched_weight:
+                        candidates.setdefault(rid)
+                        taken += 1
+
+        # La evidencia solo depende de los nutrientes primarios: una vez por combinación
+        evidence: Dict[Tuple[str, ...], Tuple] = {}
+        scored = []
+        for rid in candidates:
+            rule = self._rules[rid]
+            key = tuple(rule.primary_nutrients)
+            if key not in evidence:
+                evidence[key] = (
+                    self._range_evidence(rule.primary_nutrients, tissue_analysis, self.tissue_ranges)
+                    + self._range_evidence(rule.primary_nutrients, current_profile, self.solution_ranges)
+                )
+            tissue_ev, tissue_status, profile_ev, profile_status = evidence[key]
+
+            if rid in matched_weight:
+                coverage = matched_weight[rid] / rule.total_weight
+                explained = len(matched_symptoms[rid]) / len(reported) if reported else 0.0
+                base_score = coverage * (0.5 + 0.5 * explained)
+            elif tissue_ev > 0:
+                base_score = self.TISSUE_ONLY_WEIGHT * tissue_ev
+            else:
+                continue   # nutriente secundario bajo, pero los primarios de la regla están bien
+            score = base_score * (1.0 + self.TISSUE_WEIGHT * tissue_ev + self.PROFILE_WEIGHT * profile_ev)
+            scored.append((max(0.0, score), rid, tissue_status, profile_status))
+
+        best = heapq.nlargest(top_k, scored, key=lambda item: (item[0], item[1]))
+
+        hypotheses = []
+        for score, rid, tissue_status, profile_status in best:
+            rule = self._rules[rid]
+            hypotheses.append({
+                "rule_id": rid,
+                "score": round(score, 4),
+                "matched_symptoms": matched_symptoms.get(rid, []),
+                "primary_nutrients": rule.primary_nutrients,
+                "secondary_nutrients": rule.secondary_nutrients,
+                "description": rule.description,
+                "recommendation": rule.recommendation,
+                "target_delta_ppm": self._adjust_delta(rule.target_delta_ppm, current_profile),
+                "preferred_fertilizers": rule.preferred_fertilizers,
+                "evidence": {"tissue": tissue_status, "profile": profile_status},
+            })
+        return hypotheses
+
     def diagnose(
         self,
-        symptom_code: str,
+        symptom_code: str | List[str] | None = None,
         current_profile: Optional[Dict[str, float]] = None,
         tissue_analysis: Optional[Dict[str, float]] = None,
+        symptom_codes: Optional[List[str]] = None,
+        top_k: int = 5,
+        tissue_unit: Optional[str] = None,
     ) -> Dict:
         """
-        Devuelve un diagnóstico estructurado para un síntoma.
+        Devuelve un diagnóstico estructurado para uno o varios síntomas.
+
+        Los campos de primer nivel corresponden a la hipótesis mejor puntuada
+        (compatibles con el diagnóstico de un solo síntoma); "hypotheses" trae
+        el ranking completo.
 
         current_profile: PPM objetivo (N, P, K, Ca, Mg) que usas en el tanque.
-        tissue_analysis: Análisis foliar opcional (ppm o % relativos).
+        tissue_analysis: Análisis foliar opcional. Sin tissue_unit solo se
+        devuelve (compatibilidad: "ppm o % relativos"); con tissue_unit "pct"
+        (% en materia seca) o "ppm" (mg/kg de materia seca) se usa como evidencia.
         """
-        if symptom_code not in self._rules:
+        codes: List[str] = list(symptom_codes or [])
+        if isinstance(symptom_code, str):
+            codes.insert(0, symptom_code)
+        elif symptom_code:
+            codes = list(symptom_code) + codes
+
+        symptom = symptom_code if isinstance(symptom_code, str) and not symptom_codes else codes
+        unknown = [c for c in codes if c not in self._symptom_index]
+
+        tissue_pct = self._tissue_pct(tissue_analysis, tissue_unit)
+        hypotheses = self.rank(codes, current_profile, tissue_pct, top_k) if codes or tissue_pct else []
+        if not hypotheses:
             return {
                 "success": False,
-                "symptom": symptom_code,
+                "symptom": symptom,
+                "unknown_symptoms": unknown,
                 "message": "Síntoma no registrado en las reglas internas.",
             }
 
-        rule = self._rules[symptom_code]
-
+        top = hypotheses[0]
         base = {
             "success": True,
-            "symptom": symptom_code,
-            "primary_nutrients": rule.primary_nutrients,
-            "secondary_nutrients": rule.secondary_nutrients,
-            "description": rule.description,
-            "recommendation": rule.recommendation,
-            "target_delta_ppm": rule.target_delta_ppm,
-            "preferred_fertilizers": rule.preferred_fertilizers,
+            "symptom": symptom,
+            "rule_id": top["rule_id"],
+            "score": top["score"],
+            "primary_nutrients": top["primary_nutrients"],
+            "secondary_nutrients": top["secondary_nutrients"],
+            "description": top["description"],
+            "recommendation": top["recommendation"],
+            "target_delta_ppm": top["target_delta_ppm"],
+            "preferred_fertilizers": top["preferred_fertilizers"],
+            "hypotheses": hypotheses,
+            "unknown_symptoms": unknown,
         }
 
-        # Opcional: enriquecer con contexto de perfil actual
         if current_profile:
             base["current_profile"] = current_profile
 
         if tissue_analysis:
             base["tissue_analysis"] = tissue_analysis
+            base["tissue_unit"] = tissue_unit
 
         return base
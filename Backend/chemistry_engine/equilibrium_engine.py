@@ -0,0 +1,296 @@
+# chemistry_engine/equilibrium_engine.py
+
+from __future__ import annotations
+import json
+import os
+from collections import OrderedDict
+from typing import Any, Dict, List, Tuple
+
+import numpy as np
+
+
+# Componentes totales (mol/L) que se siguen en la solución
+COMPONENTS = ["Ca", "Mg", "K", "Na", "NO3", "SO4", "Cl", "NH4_T", "PO4_T", "CO3_T"]
+
+# Constantes de equilibrio a 25 °C (pKa termodinámicos)
+PKW = 14.0
+PKA_NH4 = 9.25
+PKA_PO4 = (2.15, 7.20, 12.35)
+PKA_CO3 = (6.35, 10.33)
+
+# Conductividades molares límite a 25 °C (S·cm²/mol)
+LAMBDA0 = {
+    "H": 349.8, "OH": 198.6,
+    "Ca": 119.0, "Mg": 106.0, "K": 73.5, "Na": 50.1, "NH4": 73.5,
+    "NO3": 71.4, "SO4": 160.0, "Cl": 76.3,
+    "H2PO4": 36.0, "HPO4": 114.0, "PO4": 207.0,
+    "HCO3": 44.5, "CO3": 138.6,
+}
+
+# Carga de los iones fuertes
+STRONG_CHARGE = {"Ca": 2, "Mg": 2, "K": 1, "Na": 1, "NO3": -1, "SO4": -2, "Cl": -1}
+
+# Carga de todas las especies que entran en el balance de carga
+SPECIES_CHARGE = {
+    **STRONG_CHARGE,
+    "H": 1, "OH": -1, "NH4": 1,
+    "H2PO4": -1, "HPO4": -2, "PO4": -3,
+    "HCO3": -1, "CO3": -2,
+}
+
+
+def davies_gamma(ionic_strength: np.ndarray, charge: int) -> np.ndarray:
+    """Coeficiente de actividad de Davies (válido hasta I ~ 0.5 M)."""
+    sqrt_i = np.sqrt(ionic_strength)
+    log_g = -0.509 * charge ** 2 * (sqrt_i / (1.0 + sqrt_i) - 0.3 * ionic_strength)
+    return 10.0 ** log_g
+
+
+def polyprotic_fractions(h: np.ndarray, pkas: Tuple[float, ...], gammas: List[np.ndarray]) -> np.ndarray:
+    """
+    Fracciones de cada especie de un ácido poliprótico neutro H_nA, de la
+    forma más protonada (carga 0) a la más desprotonada (carga -n).
+
+    h: actividad de H+; gammas[z]: coeficiente de actividad para |carga| = z.
+    """
+    ratios = [np.ones_like(h)]
+    for step, pka in enumerate(pkas):
+        # [A^-(z+1)] / [A^-z] = Ka · γ_z / (a_H · γ_(z+1))
+        ratio = 10.0 ** -pka * gammas[step] / (h * gammas[step + 1])
+        ratios.append(ratios[-1] * ratio)
+    stacked = np.stack(ratios, axis=-1)
+    return stacked / stacked.sum(axis=-1, keepdims=True)
+
+
+class EquilibriumEngine:
+    """
+    Motor de especiación química para estimar pH y EC de una solución dosificada.
+
+    Incluye:
+      - Equilibrios carbonato, fosfato, amonio/amoníaco y agua
+      - Nitrato, sulfato y cationes principales totalmente disociados
+      - Fuerza iónica y actividades (Davies)
+      - Newton sobre el balance de carga en log(a_H), vectorizado por receta
+      - EC a partir de conductividades iónicas corregidas por fuerza iónica
+      - Caché LRU de estados convergidos
+
+    El sistema carbonato se trata como cerrado: el carbono inorgánico total
+    viene de la alcalinidad del agua de riego.
+    """
+
+    SALTS_FILE = "salt_ions.json"
+
+    def __init__(self, salts: Dict[str, Dict[str, Any]] | None = None, cache_size: int = 4096):
+        self.salts = salts if salts is not None else self._load_salts()
+        self.components = list(COMPONENTS)
+        self._comp_pos = {c: i for i, c in enumerate(self.components)}
+        self._cache: "OrderedDict[Tuple, Dict[str, float]]" = OrderedDict()
+        self.cache_size = cache_size
+
+    # -------------------------------------------------------------- #
+    # CARGA DE DATOS
+    # -------------------------------------------------------------- #
+
+    def _load_salts(self) -> Dict[str, Dict[str, Any]]:
+        base_path = os.path.dirname(os.path.abspath(__file__))
+        for path in (
+            os.path.join(base_path, "data", self.SALTS_FILE),
+            os.path.join(os.path.dirname(base_path), "data", self.SALTS_FILE),
+        ):
+            if os.path.exists(path):
+                with open(path, "r", encoding="utf-8") as f:
+                    return json.load(f)
+        print(f"[EquilibriumEngine] WARNING: {self.SALTS_FILE} no encontrado")
+        return {}
+
+    def ion_matrix(self, salt_names: List[str]) -> np.ndarray:
+        """mol de cada componente por gramo de sal (componentes x sales)."""
+        M = np.zeros((len(self.components), len(salt_names)))
+        for j, name in enumerate(salt_names):
+            info = self.salts.get(name)
+            if info is None:
+                raise ValueError(f"Sal sin composición iónica registrada: {name}")
+            for comp, stoich in info["iones"].items():
+                M[self._comp_pos[comp], j] = float(stoich) / float(info["masa_molar"])
+        return M
+
+    def water_components(self, agua: Dict[str, Any] | None) -> np.ndarray:
+        """
+        Componentes aportados por el agua de riego y el ácido inyectado (mol/L).
+
+        agua: {"alcalinidad_mg_L_HCO3": 0, "iones_mmol_L": {"Ca": 0.5, ...},
+               "acido_nitrico_mmol_L": 0, "acido_fosforico_mmol_L": 0}
+        """
+        agua = agua or {}
+        comp = np.zeros(len(self.components))
+        for name, mmol in (agua.get("iones_mmol_L") or {}).items():
+            comp[self._comp_pos[name]] += float(mmol) / 1000.0
+
+        # La alcalinidad llega como bicarbonato con un catión acompañante genérico (Na)
+        alk = float(agua.get("alcalinidad_mg_L_HCO3", 0.0)) / 61.02 / 1000.0
+        comp[self._comp_pos["CO3_T"]] += alk
+        comp[self._comp_pos["Na"]] += alk
+
+        comp[self._comp_pos["NO3"]] += float(agua.get("acido_nitrico_mmol_L", 0.0)) / 1000.0
+        comp[self._comp_pos["PO4_T"]] += float(agua.get("acido_fosforico_mmol_L", 0.0)) / 1000.0
+        return comp
+
+    # -------------------------------------------------------------- #
+    # ESPECIACIÓN
+    # -------------------------------------------------------------- #
+
+    def _species(self, totals: np.ndarray, ph: np.ndarray, ionic_strength: np.ndarray) -> Dict[str, np.ndarray]:
+        """Concentraciones (mol/L) de cada especie cargada para un pH dado."""
+        g = [np.ones_like(ph)] + [davies_gamma(ionic_strength, z) for z in (1, 2, 3)]
+        h = 10.0 ** -ph
+        col = self._comp_pos
+
+        nh4_frac = 1.0 / (1.0 + 10.0 ** -PKA_NH4 * g[1] / h)
+        po4 = polyprotic_fractions(h, PKA_PO4, g) * totals[:, col["PO4_T"], None]
+        co3 = polyprotic_fractions(h, PKA_CO3, g) * totals[:, col["CO3_T"], None]
+
+        species = {name: totals[:, col[name]] for name in STRONG_CHARGE}
+        species.update({
+            "H": h / g[1],
+            "OH": 10.0 ** -PKW / (h * g[1]),
+            "NH4": totals[:, col["NH4_T"]] * nh4_frac,
+            "H2PO4": po4[:, 1], "HPO4": po4[:, 2], "PO4": po4[:, 3],
+            "HCO3": co3[:, 1], "CO3": co3[:, 2],
+        })
+        return species
+
+    def _charge_balance(self, totals, ph, ionic_strength) -> np.ndarray:
+        sp = self._species(totals, ph, ionic_strength)
+        return sum(SPECIES_CHARGE[name] * conc for name, conc in sp.items())
+
+    def _ionic_strength(self, species: Dict[str, np.ndarray]) -> np.ndarray:
+        return 0.5 * sum(SPECIES_CHARGE[name] ** 2 * conc for name, conc in species.items())
+
+    def _solve_ph(self, totals: np.ndarray, ionic_strength: np.ndarray, ph0: np.ndarray,
+                  tol: float = 1e-10, max_iter: int = 50) -> np.ndarray:
+        """
+        Newton amortiguado sobre el balance de carga, con derivada numérica y
+        un intervalo [0, 14] que se va acotando (bisección de respaldo).
+        """
+        ph = ph0.copy()
+        lo = np.zeros_like(ph)
+        hi = np.full_like(ph, 14.0)
+        eps = 1e-6
+
+        for _ in range(max_iter):
+            f = self._charge_balance(totals, ph, ionic_strength)
+            # El balance decrece con el pH: f > 0 → falta subir el pH
+            lo = np.where(f > 0, ph, lo)
+            hi = np.where(f <= 0, ph, hi)
+
+            df = (self._charge_balance(totals, ph + eps, ionic_strength) - f) / eps
+            step = np.where(df != 0, -f / np.where(df != 0, df, 1.0), 0.0)
+            new_ph = ph + np.clip(step, -2.0, 2.0)
+
+            outside = (new_ph <= lo) | (new_ph >= hi) | ~np.isfinite(new_ph)
+            new_ph = np.where(outside, 0.5 * (lo + hi), new_ph)
+
+            done = np.abs(new_ph - ph) < 1e-9
+            ph = new_ph
+            if done.all() or (np.abs(f) < tol).all():
+                break
+        return ph
+
+    def _equilibrate(self, totals: np.ndarray, outer_iter: int = 4) -> Dict[str, np.ndarray]:
+        n = totals.shape[0]
+        ionic_strength = np.zeros(n)
+        ph = np.full(n, 7.0)
+        for _ in range(outer_iter):
+            ph = self._solve_ph(totals, ionic_strength, ph)
+            species = self._species(totals, ph, ionic_strength)
+            ionic_strength = self._ionic_strength(species)
+
+        ec = np.zeros(n)
+        for name, conc in species.items():
+            z = abs(SPECIES_CHARGE[name])
+            # Corrección empírica de la conductividad por fuerza iónica
+            ec += LAMBDA0[name] * conc * np.sqrt(davies_gamma(ionic_strength, z))
+        return {"ph": ph, "ec": ec, "ionic_strength": ionic_strength, "species": species}
+
+    # -------------------------------------------------------------- #
+    # API PÚBLICA
+    # -------------------------------------------------------------- #
+
+    def solve(
+        self,
+        salts_g_per_L: np.ndarray,
+        salt_names: List[str],
+        agua: Dict[str, Any] | None = None,
+    ) -> Dict[str, np.ndarray]:
+        """
+        pH, EC (mS/cm) y fuerza iónica (mol/L) para muchas recetas a la vez.
+
+        salts_g_per_L: (recetas x sales) en g/L, en el orden de salt_names.
+        Las recetas ya resueltas se sirven desde la caché (lotes de hasta
+        cache_size recetas; los mayores se resuelven directamente).
+        """
+        X = np.atleast_2d(np.asarray(salts_g_per_L, dtype=float))
+        n = X.shape[0]
+        water = self.water_components(agua)
+        water_key = tuple(np.round(water, 9))
+        names_key = tuple(salt_names)
+
+        ion_matrix = self.ion_matrix(salt_names)
+
+        # Lotes grandes: se resuelven directo, la caché solo los desalojaría
+        if n > self.cache_size:
+            state = self._equilibrate(X @ ion_matrix.T + water[None, :])
+            return {field: state[field] for field in ("ph", "ec", "ionic_strength")}
+
+        out = {"ph": np.zeros(n), "ec": np.zeros(n), "ionic_strength": np.zeros(n)}
+        keys = [(names_key, water_key, row.tobytes()) for row in np.round(X, 6)]
+        missing = []
+        for r, key in enumerate(keys):
+            hit = self._cache.get(key)
+            if hit is None:
+                missing.append(r)
+                continue
+            self._cache.move_to_end(key)
+            for field in out:
+                out[field][r] = hit[field]
+
+        if missing:
+            totals = X[missing] @ ion_matrix.T + water[None, :]
+            state = self._equilibrate(totals)
+            for i, r in enumerate(missing):
+                for field in out:
+                    out[field][r] = state[field][i]
+                self._cache[keys[r]] = {field: float(state[field][i]) for field in out}
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+
+        return out
+
+    def acid_for_ph(
+        self,
+        salts_g_per_L: np.ndarray,
+        salt_names: List[str],
+        target_ph: float,
+        agua: Dict[str, Any] | None = None,
+    ) -> np.ndarray:
+        """
+        mmol/L de ácido nítrico necesarios para llevar cada receta al pH
+        objetivo (valores negativos: haría falta una base).
+
+        A pH fijo el balance de carga es lineal en el ácido fuerte añadido, así
+        que solo se itera la fuerza iónica.
+        """
+        X = np.atleast_2d(np.asarray(salts_g_per_L, dtype=float))
+        totals = X @ self.ion_matrix(salt_names).T + self.water_components(agua)[None, :]
+        ph = np.full(X.shape[0], float(target_ph))
+        acid = np.zeros(X.shape[0])
+        ionic_strength = np.zeros(X.shape[0])
+        no3 = self._comp_pos["NO3"]
+
+        for _ in range(4):
+            with_acid = totals.copy()
+            with_acid[:, no3] += acid
+            species = self._species(with_acid, ph, ionic_strength)
+            ionic_strength = self._ionic_strength(species)
+            acid = acid + self._charge_balance(with_acid, ph, ionic_strength)
+        return acid * 1000.0
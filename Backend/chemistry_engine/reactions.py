@@ -1,11 +1,14 @@
 # chemistry_engine/reactions.py
 
 from __future__ import annotations
+import re
+import threading
 from collections import defaultdict
 from dataclasses import dataclass
-from typing import Dict, List, Tuple
+from typing import Any, Dict, List, Tuple
 
-import sympy as sp
+
+HYDRATE_SEPARATORS = re.compile(r"[·•*]")
 
 
 def parse_formula(formula: str) -> Dict[str, int]:
@@ -17,7 +20,19 @@ def parse_formula(formula: str) -> Dict[str, int]:
       - "K2SO4"
       - "Mg(OH)2"
       - con paréntesis anidados tipo "Ca3(PO4)2"
+      - hidratos y aductos con coeficiente: "MgSO4·7H2O", "5Ca(NO3)2·NH4NO3·10H2O"
     """
+    total = defaultdict(int)
+    for part in HYDRATE_SEPARATORS.split(formula):
+        part = part.strip()
+        coef = re.match(r"\d*", part).group()
+        for elem, cnt in _parse_simple_formula(part[len(coef):]).items():
+            total[elem] += cnt * (int(coef) if coef else 1)
+    return dict(total)
+
+
+def _parse_simple_formula(formula: str) -> Dict[str, int]:
+    """Parsea una fórmula sin separadores de hidrato."""
 
     i = 0
     n = len(formula)
@@ -97,9 +112,16 @@ class ReactionBalancer:
         balancer = ReactionBalancer()
         result = balancer.balance(["NH3", "O2"], ["NO", "H2O"])
         print(result.to_string())  # ej: "4 NH3 + 5 O2 -> 4 NO + 6 H2O"
+
+    Con una caché en disco (WarmCache) las reacciones ya balanceadas se
+    reutilizan entre arranques y Sympy solo se importa para reacciones nuevas.
+    La sección guarda como mucho MAX_CACHED reacciones (se descartan las más
+    antiguas) y se escribe al salir, no en cada petición.
     """
 
-    def __init__(self):
+    MAX_CACHED = 512   # reacciones distintas guardadas en la caché en disco
+
+    def __init__(self, cache: Any = None):
         self.atomic_masses = {
             "H": 1.008, "He": 4.003, "Li": 6.94, "Be": 9.012,
             "B": 10.81, "C": 12.01, "N": 14.01, "O": 16.00,
@@ -108,6 +130,10 @@ class ReactionBalancer:
             "K": 39.10, "Ca": 40.08, "Mn": 54.94, "Fe": 55.85,
             "Cu": 63.55, "Zn": 65.38, "Mo": 95.95
         }
+        # Coeficientes por reacción ("A + B -> C + D"), persistidos en la caché
+        self._cache = cache
+        self._balanced: Dict[str, List[int]] = cache.section("reacciones", "v1") if cache is not None else {}
+        self._lock = threading.Lock()
 
     def molar_mass(self, formula: str) -> float:
         d = parse_formula(formula)
@@ -128,6 +154,26 @@ class ReactionBalancer:
         Devuelve una reacción balanceada con coeficientes enteros mínimos.
         Lanza ValueError si no se puede balancear.
         """
+        key = f"{' + '.join(reactants)} -> {' + '.join(products)}"
+        coeffs = self._balanced.get(key)
+        if coeffs is None:
+            coeffs = self._solve_coefficients(reactants, products)
+            with self._lock:
+                self._balanced[key] = coeffs
+                while len(self._balanced) > self.MAX_CACHED:
+                    self._balanced.pop(next(iter(self._balanced)))
+            if self._cache is not None:
+                self._cache.touch()
+
+        return BalancedReaction(
+            reactants=list(zip(reactants, coeffs[:len(reactants)])),
+            products=list(zip(products, coeffs[len(reactants):])),
+        )
+
+    def _solve_coefficients(self, reactants: List[str], products: List[str]) -> List[int]:
+        """Coeficientes enteros mínimos (reactivos y luego productos) por el espacio nulo."""
+        import sympy as sp   # importación diferida: ~0.4 s que un arranque en caliente se ahorra
+
         compounds = reactants + products
         compounds_parsed = [parse_formula(f) for f in compounds]
 
@@ -171,14 +217,5 @@ class ReactionBalancer:
         if all(c < 0 for c in integer_coeffs):
             integer_coeffs = [-c for c in integer_coeffs]
 
-        # 4. Separar lados
-        reactant_coeffs = integer_coeffs[:len(reactants)]
-        product_coeffs = integer_coeffs[len(reactants):]
-
-        balanced_reactants = list(zip(reactants, reactant_coeffs))
-        balanced_products = list(zip(products, product_coeffs))
-
-        return BalancedReaction(
-            reactants=balanced_reactants,
-            products=balanced_products
-        )
+        # int nativo: los sp.Integer no se serializan a JSON
+        return [int(c) for c in integer_coeffs]
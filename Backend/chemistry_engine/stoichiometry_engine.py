@@ -1,16 +1,23 @@
 # chemistry_engine/stoichiometry_engine.py
 
 from __future__ import annotations
-from typing import Dict
+from typing import Any, Dict, List, Sequence
 import json
 import os
 
+import numpy as np
+
+from .concentration_engine import ArrayLike, _as_array, _result
+
 class StoichiometryEngine:
     """
     Cálculos estequiométricos:
       - g ↔ mol
       - Preparación de soluciones molares
       - Macronutrientes requeridos para plantas
+
+    Las conversiones aceptan escalares o arrays numpy (broadcasting);
+    solution_molar_many prepara muchas soluciones en una sola llamada.
     """
 
     # Masa molar de elementos principales usados en hidroponía
@@ -25,20 +32,62 @@ class StoichiometryEngine:
         "Ca": 40.08,
         "Mg": 24.31,
         "B": 10.81,
-        "F": 19.00
+        "F": 19.00,
+        "Na": 22.99,
+        "Cl": 35.45,
+        "Mn": 54.94,
+        "Fe": 55.85,
+        "Cu": 63.55,
+        "Zn": 65.38,
+        "Mo": 95.95
     }
 
-    def __init__(self):
-        pass
+    def __init__(self, cache: Any = None, compounds: Any = None):
+        # compounds: CompoundLibrary opcional. Si está, las masas molares salen
+        # de ella (precalculadas, con las masas atómicas del ReactionBalancer),
+        # igual que en prepare_molar_solution; MOLAR_MASS queda para el uso suelto.
+        self.compounds = compounds
+        self._atomic = compounds.balancer.atomic_masses if compounds is not None else self.MOLAR_MASS
+
+        # Masa molar por fórmula fuera de la biblioteca: cada compuesto se parsea
+        # una sola vez (y, con caché en disco, una sola vez entre arranques
+        # mientras no cambien las masas atómicas)
+        self._cache = cache
+        self._molar_mass_cache: Dict[str, float] = (
+            cache.section("masas_molares", cache.fingerprint(self._atomic)) if cache is not None else {}
+        )
 
     # -----------------------------
     # Conversiones básicas
     # -----------------------------
-    def grams_to_moles(self, grams: float, molar_mass: float) -> float:
-        return grams / molar_mass
+    def grams_to_moles(self, grams: ArrayLike, molar_mass: ArrayLike) -> ArrayLike:
+        return _result(_as_array(grams) / _as_array(molar_mass))
+
+    def moles_to_grams(self, moles: ArrayLike, molar_mass: ArrayLike) -> ArrayLike:
+        return _result(_as_array(moles) * _as_array(molar_mass))
+
+    def molar_mass(self, formula: str) -> float:
+        """Masa molar del compuesto (g/mol); ValueError si hay elementos desconocidos."""
+        if self.compounds is not None:
+            comp = self.compounds.get(formula)
+            if comp is not None:
+                return comp.masa_molar
+        if formula in self._molar_mass_cache:
+            return self._molar_mass_cache[formula]
+
+        from .reactions import parse_formula  # reutilizamos tu parser avanzado
+        counts = parse_formula(formula)
 
-    def moles_to_grams(self, moles: float, molar_mass: float) -> float:
-        return moles * molar_mass
+        M = 0
+        for elem, qty in counts.items():
+            if elem not in self._atomic:
+                raise ValueError(f"Masa molar desconocida para el elemento {elem}")
+            M += qty * self._atomic[elem]
+
+        self._molar_mass_cache[formula] = M
+        if self._cache is not None:
+            self._cache.touch()
+        return M
 
     # -----------------------------
     # SOLUCIÓN MOLAR DE UN COMPUESTO
@@ -49,15 +98,7 @@ class StoichiometryEngine:
           gramos = molaridad * volumen * masa molar del compuesto
         """
 
-        from .reactions import parse_formula  # reutilizamos tu parser avanzado
-        counts = parse_formula(formula)
-
-        # Calcular masa molar del compuesto
-        M = 0
-        for elem, qty in counts.items():
-            if elem not in self.MOLAR_MASS:
-                raise ValueError(f"Masa molar desconocida para el elemento {elem}")
-            M += qty * self.MOLAR_MASS[elem]
+        M = self.molar_mass(formula)
 
         grams_needed = molarity_M * volume_L * M
 
@@ -69,3 +110,39 @@ class StoichiometryEngine:
             "volume_L": volume_L,
             "grams_required": round(grams_needed, 4),
         }
+
+    def solution_molar_many(
+        self,
+        formulas: Sequence[str],
+        molarity_M: ArrayLike,
+        volume_L: ArrayLike,
+    ) -> Dict:
+        """
+        Versión en lote de solution_molar: una fila por fórmula, con molaridad
+        y volumen escalares o arrays del mismo largo (broadcasting).
+
+        Las fórmulas con elementos desconocidos no abortan el lote: su fila
+        queda en NaN y el mensaje de error va en 'errors' (None si es válida).
+        """
+        n = len(formulas)
+        masses = np.full(n, np.nan)
+        errors: List[str | None] = [None] * n
+        for i, formula in enumerate(formulas):
+            try:
+                masses[i] = self.molar_mass(formula)
+            except ValueError as e:
+                errors[i] = str(e)
+
+        molarity = np.broadcast_to(_as_array(molarity_M), (n,))
+        volume = np.broadcast_to(_as_array(volume_L), (n,))
+        grams_needed = molarity * volume * masses
+
+        return {
+            "success": True,
+            "formula": list(formulas),
+            "molar_mass": np.round(masses, 4),
+            "molarity": molarity.copy(),
+            "volume_L": volume.copy(),
+            "grams_required": np.round(grams_needed, 4),
+            "errors": errors,
+        }
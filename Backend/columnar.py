@@ -0,0 +1,204 @@
+"""
+Formato binario columnar para respuestas numéricas grandes.
+
+Opt-in por cabecera Accept:
+    Accept: application/x-hydrosynapse-columnar             (float64)
+    Accept: application/x-hydrosynapse-columnar; dtype=f4   (float32)
+
+Disposición (todo little-endian):
+    0   4 bytes  magia "HSC1"
+    4   uint32   longitud N de la cabecera JSON (UTF-8)
+    8   N bytes  cabecera: {"version", "meta", "columns": [{name, dtype, shape, offset, count}]}
+    ... relleno hasta múltiplo de 8
+    ... buffers de cada columna, cada uno alineado a 8 bytes
+
+'offset' es absoluto desde el inicio del cuerpo, así que en el renderer
+basta con `new Float64Array(buf, col.offset, col.count)` (sin copias).
+Los arrays se escriben directamente desde numpy; lo que no es array
+(escalares, textos, listas de eventos) viaja en "meta" como JSON.
+
+Uso:
+    python columnar.py --bench     # tamaño y latencia frente a JSON
+"""
+import argparse
+import json
+import struct
+import time
+from typing import Any, Dict, List, Tuple
+
+import numpy as np
+from flask import Response
+
+MIME = "application/x-hydrosynapse-columnar"
+MAGIC = b"HSC1"
+VERSION = 1
+ALIGN = 8
+FLOAT_DTYPES = {"f8": "<f8", "f4": "<f4"}
+
+
+def negotiate(accept_header) -> str | None:
+    """
+    dtype pedido ('f8' | 'f4') si el cliente acepta el formato columnar de
+    forma explícita; None para seguir con JSON (un '*/*' no cuenta).
+    """
+    for value, quality in accept_header or []:
+        mime, _, params = value.partition(";")
+        if mime.strip().lower() != MIME or quality <= 0:
+            continue
+        dtype = "f8"
+        for param in params.split(";"):
+            key, _, val = param.partition("=")
+            if key.strip().lower() == "dtype" and val.strip():
+                dtype = val.strip().lower()
+        if dtype not in FLOAT_DTYPES:
+            raise ValueError(f"dtype no soportado: {dtype} (usa f8 o f4)")
+        return dtype
+    return None
+
+
+def _split(obj: Any, path: str, columns: List[Tuple[str, np.ndarray]]) -> Any:
+    """Separa los arrays numpy (columnas, con nombre 'a.b.c') del resto (meta JSON)."""
+    if isinstance(obj, np.ndarray):
+        columns.append((path, obj))
+        return None
+    if isinstance(obj, dict):
+        meta = {}
+        for key, value in obj.items():
+            sub = _split(value, f"{path}.{key}" if path else str(key), columns)
+            if isinstance(value, np.ndarray) or (isinstance(value, dict) and value and not sub):
+                continue   # ya viaja entero como columnas
+            meta[key] = sub
+        return meta
+    if isinstance(obj, np.generic):
+        return obj.item()
+    return obj
+
+
+def _column_dtype(arr: np.ndarray, float_dtype: str) -> Tuple[str, np.dtype]:
+    if arr.dtype == np.bool_:
+        return "u1", np.dtype("u1")
+    if np.issubdtype(arr.dtype, np.integer):
+        # Enteros (p. ej. ms epoch) siempre en float64: exactos hasta 2^53 y sin BigInt en JS
+        return "f8", np.dtype("<f8")
+    if np.issubdtype(arr.dtype, np.floating):
+        return float_dtype, np.dtype(FLOAT_DTYPES[float_dtype])
+    raise ValueError(f"Tipo de columna no numérico: {arr.dtype}")
+
+
+def encode(payload: Dict[str, Any], dtype: str = "f8") -> bytes:
+    """Serializa un dict con arrays numpy en el formato columnar."""
+    if dtype not in FLOAT_DTYPES:
+        raise ValueError(f"dtype no soportado: {dtype}")
+    columns: List[Tuple[str, np.ndarray]] = []
+    meta = _split(payload, "", columns)
+
+    prepared, descriptors = [], []
+    for name, arr in columns:
+        code, np_dtype = _column_dtype(arr, dtype)
+        data = np.ascontiguousarray(arr, dtype=np_dtype)
+        prepared.append(data)
+        descriptors.append({"name": name, "dtype": code, "shape": list(data.shape), "count": int(data.size)})
+
+    # La cabecera incluye los offsets, que dependen de su propia longitud: se
+    # reserva con offsets provisionales y se ajusta hasta que no cambie
+    data_start = 0
+    for _ in range(4):
+        offset = data_start
+        for desc, data in zip(descriptors, prepared):
+            desc["offset"] = offset
+            offset += -(-data.nbytes // ALIGN) * ALIGN
+        header = json.dumps(
+            {"version": VERSION, "meta": meta, "columns": descriptors},
+            separators=(",", ":"), ensure_ascii=False,
+        ).encode("utf-8")
+        needed = -(-(8 + len(header)) // ALIGN) * ALIGN
+        if needed == data_start:
+            break
+        data_start = needed
+
+    out = bytearray(offset)
+    out[0:4] = MAGIC
+    struct.pack_into("<I", out, 4, len(header))
+    out[8:8 + len(header)] = header
+    out[8 + len(header):data_start] = b" " * (data_start - 8 - len(header))   # JSON admite espacios finales
+    for desc, data in zip(descriptors, prepared):
+        out[desc["offset"]:desc["offset"] + data.nbytes] = memoryview(data).cast("B")
+    return bytes(out)
+
+
+def decode(body: bytes) -> Dict[str, Any]:
+    """Inverso de encode (clientes Python, pruebas y benchmark): meta + columnas numpy."""
+    if body[:4] != MAGIC:
+        raise ValueError("No es un cuerpo columnar (magia incorrecta).")
+    (length,) = struct.unpack_from("<I", body, 4)
+    header = json.loads(body[8:8 + length])
+    dtypes = {"f8": "<f8", "f4": "<f4", "u1": "u1"}
+    columns = {
+        col["name"]: np.frombuffer(body, dtype=dtypes[col["dtype"]], count=col["count"],
+                                   offset=col["offset"]).reshape(col["shape"])
+        for col in header["columns"]
+    }
+    return {"meta": header["meta"], "columns": columns}
+
+
+def response(payload: Dict[str, Any], dtype: str = "f8"):
+    """Respuesta Flask con el cuerpo columnar."""
+    return Response(encode(payload, dtype), mimetype=MIME, headers={"Vary": "Accept"})
+
+
+def to_json_ready(obj: Any) -> Any:
+    """Misma estructura con los arrays convertidos a listas (respuesta JSON)."""
+    if isinstance(obj, np.ndarray):
+        return obj.tolist()
+    if isinstance(obj, dict):
+        return {k: to_json_ready(v) for k, v in obj.items()}
+    if isinstance(obj, list):
+        return [to_json_ready(v) for v in obj]
+    if isinstance(obj, np.generic):
+        return obj.item()
+    return obj
+
+
+# ---------------------------------------------------------------------------------------
+# COMPARACIÓN DE TAMAÑO Y LATENCIA (JSON vs COLUMNAR)
+# ---------------------------------------------------------------------------------------
+def benchmark(repeat: int = 5) -> None:
+    from calculator import NutrientCalculatorService
+
+    calc = NutrientCalculatorService()
+    grid = {nut: {"min": -30, "max": 30, "steps": 15} for nut in ("N", "K", "Ca", "Mg")}
+    cases = {
+        "what_if 15^4": calc.sweep(100.0, "lechuga", grid=grid, as_arrays=True),
+        "serie 100k": {
+            "series": {"ec": {"t": np.arange(100_000, dtype=np.int64) * 60_000 + 1_700_000_000_000,
+                              "y": np.round(np.random.default_rng(0).normal(1.8, 0.2, 100_000), 4)}},
+        },
+    }
+
+    def best_of(fn):
+        times = []
+        for _ in range(repeat):
+            t0 = time.perf_counter()
+            out = fn()
+            times.append(time.perf_counter() - t0)
+        return out, min(times) * 1000
+
+    print(f"{'caso':<14}{'formato':<10}{'bytes':>12}{'codificar ms':>15}{'decodificar ms':>16}")
+    for name, payload in cases.items():
+        body, enc = best_of(lambda: json.dumps(to_json_ready(payload)).encode("utf-8"))
+        _, dec = best_of(lambda: json.loads(body))
+        print(f"{name:<14}{'json':<10}{len(body):>12,}{enc:>15.2f}{dec:>16.2f}")
+        for dtype in ("f8", "f4"):
+            body, enc = best_of(lambda: encode(payload, dtype))
+            _, dec = best_of(lambda: decode(body))
+            print(f"{'':<14}{'col/' + dtype:<10}{len(body):>12,}{enc:>15.2f}{dec:>16.2f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Formato columnar binario de HydroSynapse")
+    parser.add_argument("--bench", action="store_true", help="compara tamaño y latencia frente a JSON")
+    args = parser.parse_args()
+    if args.bench:
+        benchmark()
+    else:
+        parser.print_help()
@@ -1,11 +1,22 @@
+import json
 import sqlite3
 import os
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Iterable, Iterator, Tuple
+
+PROFILE_COLUMNS = "nombre, N, P, K, Ca, Mg"
+
+# Alta en el índice FTS por cada perfil nuevo (la importación masiva la sustituye por un INSERT ... SELECT)
+FTS_INSERT_TRIGGER = """
+    CREATE TRIGGER IF NOT EXISTS profiles_fts_ai AFTER INSERT ON profiles BEGIN
+        INSERT INTO profiles_fts(rowid, nombre) VALUES (new.id, new.nombre);
+    END;
+"""
 
 class SQLiteDatabase:
     """
     Gestor de Base de Datos SQLite para HydroSynapse.
-    Almacena perfiles de planta personalizados y el historial de recetas.
+    Almacena perfiles de planta personalizados, el historial de recetas y el
+    catálogo de fertilizantes.
     """
     def __init__(self, db_name="hidrosynapse.db"):
         # La base de datos se guarda en la misma carpeta que el script
@@ -17,6 +28,9 @@ class SQLiteDatabase:
         conn = self._get_connection()
         cursor = conn.cursor()
 
+        # En una base nueva (sin tablas) fija el modo que usa la retención; en una existente no hace nada
+        cursor.execute("PRAGMA auto_vacuum = INCREMENTAL")
+
         # Tabla 1: Perfiles Personalizados (Objetivos de PPM)
         cursor.execute("""
             CREATE TABLE IF NOT EXISTS profiles (
@@ -42,8 +56,37 @@ class SQLiteDatabase:
             );
         """)
         
+        # Tabla 3: Agregados del historial (retención: días y semanas por perfil)
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS history_rollups (
+                granularidad TEXT NOT NULL,
+                perfil_usado TEXT NOT NULL,
+                periodo TEXT NOT NULL,
+                n INTEGER NOT NULL,
+                volumen_total_L REAL NOT NULL,
+                ec_suma REAL NOT NULL,
+                ec_min REAL NOT NULL,
+                ec_max REAL NOT NULL,
+                dosis_gramos_json TEXT NOT NULL,
+                PRIMARY KEY (granularidad, perfil_usado, periodo)
+            );
+        """)
+        # Índices "de cobertura" por rango de fechas: las series de EC/volumen se leen
+        # sin tocar las filas (que llevan el blob dosis_json)
+        cursor.execute("DROP INDEX IF EXISTS idx_history_timestamp")
+        cursor.execute("DROP INDEX IF EXISTS idx_history_perfil_ts")
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_history_ts_cover ON history(timestamp, ec_final, volumen_L)")
+        cursor.execute(
+            "CREATE INDEX IF NOT EXISTS idx_history_perfil_ts_cover "
+            "ON history(perfil_usado, timestamp, ec_final, volumen_L)"
+        )
+
+        self._migrate_profiles(cursor)
+
         # Insertar perfiles predeterminados si la base de datos está vacía
         self._insert_default_profiles(cursor)
+
+        self._migrate_fertilizers(cursor)
         
         conn.commit()
         conn.close()
@@ -52,6 +95,54 @@ class SQLiteDatabase:
         """Retorna una conexión a la base de datos."""
         return sqlite3.connect(self.db_path)
 
+    def _migrate_profiles(self, cursor: sqlite3.Cursor):
+        """
+        Columnas e índices del catálogo de perfiles:
+          - version: número monótono de la última modificación (sincronización delta)
+          - deleted: lápida para que los clientes se enteren de los borrados
+          - índice (nombre NOCASE, nombre) para búsqueda por prefijo y paginación
+            por clave: el nombre binario desempata "Tomate" / "tomate"
+          - tabla FTS5 de contenido externo, mantenida con triggers
+        """
+        columns = {row[1] for row in cursor.execute("PRAGMA table_info(profiles)")}
+        if "version" not in columns:
+            cursor.execute("ALTER TABLE profiles ADD COLUMN version INTEGER NOT NULL DEFAULT 0")
+            cursor.execute("UPDATE profiles SET version = id")
+        if "deleted" not in columns:
+            cursor.execute("ALTER TABLE profiles ADD COLUMN deleted INTEGER NOT NULL DEFAULT 0")
+
+        cursor.execute("DROP INDEX IF EXISTS idx_profiles_nombre_nocase")
+        cursor.execute(
+            "CREATE INDEX IF NOT EXISTS idx_profiles_nombre_orden ON profiles(nombre COLLATE NOCASE, nombre)"
+        )
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_profiles_version ON profiles(version)")
+
+        try:
+            exists = cursor.execute(
+                "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'profiles_fts'"
+            ).fetchone()
+            cursor.execute("""
+                CREATE VIRTUAL TABLE IF NOT EXISTS profiles_fts USING fts5(
+                    nombre, content='profiles', content_rowid='id',
+                    tokenize='unicode61 remove_diacritics 2'
+                );
+            """)
+            cursor.executescript(FTS_INSERT_TRIGGER + """
+                CREATE TRIGGER IF NOT EXISTS profiles_fts_ad AFTER DELETE ON profiles BEGIN
+                    INSERT INTO profiles_fts(profiles_fts, rowid, nombre) VALUES ('delete', old.id, old.nombre);
+                END;
+                CREATE TRIGGER IF NOT EXISTS profiles_fts_au AFTER UPDATE OF nombre ON profiles BEGIN
+                    INSERT INTO profiles_fts(profiles_fts, rowid, nombre) VALUES ('delete', old.id, old.nombre);
+                    INSERT INTO profiles_fts(rowid, nombre) VALUES (new.id, new.nombre);
+                END;
+            """)
+            if not exists:
+                cursor.execute("INSERT INTO profiles_fts(profiles_fts) VALUES ('rebuild')")
+            self.fts_enabled = True
+        except sqlite3.OperationalError:
+            # SQLite compilado sin FTS5: la búsqueda de texto cae a LIKE
+            self.fts_enabled = False
+
     def _insert_default_profiles(self, cursor: sqlite3.Cursor):
         """Inserta perfiles base para que el software tenga datos de inicio."""
         default_profiles = [
@@ -64,37 +155,282 @@ class SQLiteDatabase:
         for profile in default_profiles:
             try:
                 cursor.execute(
-                    "INSERT INTO profiles (nombre, N, P, K, Ca, Mg) VALUES (?, ?, ?, ?, ?, ?)", 
+                    "INSERT INTO profiles (nombre, N, P, K, Ca, Mg, version) "
+                    "VALUES (?, ?, ?, ?, ?, ?, (SELECT COALESCE(MAX(version), 0) + 1 FROM profiles))",
                     profile
                 )
             except sqlite3.IntegrityError:
                 # El perfil ya existe, ignorar.
                 pass
 
+    def _migrate_fertilizers(self, cursor: sqlite3.Cursor):
+        """
+        Catálogo de fertilizantes: una fila por sal (con version/deleted como los
+        perfiles) y su composición en % por nutriente en una tabla aparte.
+        El índice (nutriente, porcentaje) resuelve "qué sales aportan Mg por
+        encima del 9 %" como un rango, sin recorrer el catálogo.
+        Si el catálogo está vacío se siembra con data/fertilizers.json.
+        """
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS fertilizers (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                nombre TEXT UNIQUE NOT NULL,
+                formula TEXT,
+                version INTEGER NOT NULL DEFAULT 0,
+                deleted INTEGER NOT NULL DEFAULT 0
+            );
+        """)
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS fertilizer_composition (
+                fertilizer_id INTEGER NOT NULL REFERENCES fertilizers(id),
+                nutriente TEXT NOT NULL,
+                porcentaje REAL NOT NULL,
+                PRIMARY KEY (fertilizer_id, nutriente)
+            ) WITHOUT ROWID;
+        """)
+        cursor.execute(
+            "CREATE INDEX IF NOT EXISTS idx_fert_comp_nutriente "
+            "ON fertilizer_composition(nutriente, porcentaje, fertilizer_id)"
+        )
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_fertilizers_version ON fertilizers(version)")
+
+        if cursor.execute("SELECT 1 FROM fertilizers LIMIT 1").fetchone():
+            return
+        base = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data")
+        try:
+            with open(os.path.join(base, "fertilizers.json"), "r", encoding="utf-8") as f:
+                seed = json.load(f)
+        except (OSError, ValueError) as e:
+            print(f"[SQLiteDatabase] Catálogo de fertilizantes sin semilla: {e}")
+            return
+        try:
+            with open(os.path.join(base, "salt_ions.json"), "r", encoding="utf-8") as f:
+                formulas = {name: salt.get("formula") for name, salt in json.load(f).items()}
+        except (OSError, ValueError):
+            formulas = {}
+        for nombre, composicion in seed.items():
+            self._write_fertilizer(cursor, nombre, composicion.get("formula") or formulas.get(nombre), {
+                nut: pct for nut, pct in composicion.items() if nut != "formula"
+            })
+
     def get_all_profiles(self) -> List[Dict[str, Any]]:
         """Recupera todos los perfiles de planta."""
         conn = self._get_connection()
         cursor = conn.cursor()
         
-        cursor.execute("SELECT nombre, N, P, K, Ca, Mg FROM profiles ORDER BY nombre")
+        cursor.execute(f"SELECT {PROFILE_COLUMNS} FROM profiles WHERE deleted = 0 ORDER BY nombre")
         rows = cursor.fetchall()
         
         profiles = []
         for row in rows:
-            profiles.append({
-                "nombre": row[0], "N": row[1], "P": row[2], "K": row[3], 
-                "Ca": row[4], "Mg": row[5]
-            })
+            profiles.append(self._profile_row(row))
         
         conn.close()
         return profiles
 
+    @staticmethod
+    def _profile_row(row) -> Dict[str, Any]:
+        return {"nombre": row[0], "N": row[1], "P": row[2], "K": row[3], "Ca": row[4], "Mg": row[5]}
+
+    @staticmethod
+    def _fts_query(text: str) -> str:
+        """Convierte texto libre en una consulta FTS5: cada palabra como prefijo, todas requeridas."""
+        terms = [t.replace('"', '""') for t in text.split()]
+        return " ".join(f'"{t}"*' for t in terms)
+
+    def get_profiles_version(self) -> int:
+        """Versión actual del catálogo (la mayor versión de perfil, incluidas lápidas)."""
+        conn = self._get_connection()
+        (version,) = conn.execute("SELECT COALESCE(MAX(version), 0) FROM profiles").fetchone()
+        conn.close()
+        return version
+
+    def search_profiles(
+        self, prefix: str | None = None, text: str | None = None,
+        after: str | None = None, limit: int = 100
+    ) -> Tuple[List[Dict[str, Any]], str | None]:
+        """
+        Página de perfiles ordenada por nombre (sin distinguir mayúsculas y,
+        a igualdad, por el nombre exacto, que es único).
+
+        prefix: nombres que empiezan por el texto (rango sobre el índice NOCASE).
+        text:   búsqueda de texto completo por palabras (FTS5; LIKE si no hay FTS5).
+        after:  cursor de paginación por clave: último nombre de la página
+                anterior; la clave compuesta (NOCASE, binario) sale de él.
+        Devuelve (perfiles, siguiente_cursor); el cursor es None en la última página.
+        """
+        limit = max(1, min(int(limit), 1000))
+        where, params = ["p.deleted = 0"], []
+
+        if prefix:
+            # [prefix, prefix + U+10FFFF) recorre el índice en vez de escanear la tabla
+            where.append("p.nombre >= ? COLLATE NOCASE AND p.nombre < ? COLLATE NOCASE")
+            params += [prefix, prefix + "\U0010ffff"]
+        if after is not None:
+            # El primer término posiciona en el índice; el segundo descarta los empates ya vistos
+            where.append("p.nombre >= ? COLLATE NOCASE AND (p.nombre COLLATE NOCASE, p.nombre) > (?, ?)")
+            params += [after, after, after]
+
+        source = "profiles p"
+        if text and text.strip():
+            if self.fts_enabled:
+                source = "profiles_fts f JOIN profiles p ON p.id = f.rowid"
+                where.append("profiles_fts MATCH ?")
+                params.append(self._fts_query(text))
+            else:
+                where.append("p.nombre LIKE ?")
+                params.append(f"%{text.strip()}%")
+
+        conn = self._get_connection()
+        rows = conn.execute(
+            f"SELECT p.nombre, p.N, p.P, p.K, p.Ca, p.Mg FROM {source} "
+            f"WHERE {' AND '.join(where)} ORDER BY p.nombre COLLATE NOCASE, p.nombre LIMIT ?",
+            (*params, limit + 1),
+        ).fetchall()
+        conn.close()
+
+        profiles = [self._profile_row(r) for r in rows[:limit]]
+        next_cursor = profiles[-1]["nombre"] if len(rows) > limit else None
+        return profiles, next_cursor
+
+    def get_profile_changes(self, since: int = 0, limit: int = 1000) -> Tuple[List[Dict[str, Any]], bool, int]:
+        """
+        Perfiles modificados o borrados con version > since, en orden de versión.
+        Devuelve (cambios, hay_mas, version); cada cambio lleva 'version' y
+        'deleted'. version es hasta dónde queda sincronizado el cliente: la del
+        último cambio si hay más páginas y, si no, la del catálogo, leída en la
+        misma transacción que los cambios (un guardado concurrente no se salta).
+        """
+        limit = max(1, min(int(limit), 10000))
+        conn = self._get_connection()
+        try:
+            conn.execute("BEGIN")
+            rows = conn.execute(
+                f"SELECT {PROFILE_COLUMNS}, version, deleted FROM profiles "
+                "WHERE version > ? ORDER BY version LIMIT ?",
+                (int(since), limit + 1),
+            ).fetchall()
+            (version,) = conn.execute("SELECT COALESCE(MAX(version), 0) FROM profiles").fetchone()
+            conn.commit()
+        finally:
+            conn.close()
+
+        changes = []
+        for row in rows[:limit]:
+            change = self._profile_row(row)
+            change["version"] = row[6]
+            change["deleted"] = bool(row[7])
+            changes.append(change)
+        has_more = len(rows) > limit
+        return changes, has_more, changes[-1]["version"] if has_more else version
+
+    def save_profile(self, profile: Dict[str, Any]) -> int:
+        """Crea o actualiza un perfil (revive lápidas) y devuelve su nueva versión."""
+        conn = self._get_connection()
+        cursor = conn.cursor()
+        cursor.execute("""
+            INSERT INTO profiles (nombre, N, P, K, Ca, Mg, version, deleted)
+            VALUES (?, ?, ?, ?, ?, ?, (SELECT COALESCE(MAX(version), 0) + 1 FROM profiles), 0)
+            ON CONFLICT(nombre) DO UPDATE SET
+                N = excluded.N,
+                P = excluded.P,
+                K = excluded.K,
+                Ca = excluded.Ca,
+                Mg = excluded.Mg,
+                version = excluded.version,
+                deleted = 0;
+        """, (
+            profile["nombre"], profile["N"], profile["P"], profile["K"], profile["Ca"], profile["Mg"]
+        ))
+        (version,) = cursor.execute(
+            "SELECT version FROM profiles WHERE nombre = ?", (profile["nombre"],)
+        ).fetchone()
+        conn.commit()
+        conn.close()
+        return version
+
+    def delete_profile(self, name: str) -> int | None:
+        """Marca un perfil como borrado (lápida); devuelve la nueva versión o None si no existe."""
+        conn = self._get_connection()
+        cursor = conn.cursor()
+        cursor.execute(
+            "UPDATE profiles SET deleted = 1, "
+            "version = (SELECT COALESCE(MAX(version), 0) + 1 FROM profiles) "
+            "WHERE nombre = ? AND deleted = 0",
+            (name,),
+        )
+        version = None
+        if cursor.rowcount:
+            (version,) = cursor.execute("SELECT version FROM profiles WHERE nombre = ?", (name,)).fetchone()
+        conn.commit()
+        conn.close()
+        return version
+
+    def upsert_profiles(self, chunks: Iterable[List[Tuple]]) -> Tuple[int, int]:
+        """
+        Importación masiva: inserta o actualiza filas (nombre, N, P, K, Ca, Mg)
+        llegadas por lotes, todas en UNA transacción (executemany por lote).
+        Si el iterador lanza una excepción no se guarda nada.
+        Devuelve (filas escritas, versión del catálogo tras la importación).
+        """
+        conn = self._get_connection()
+        try:
+            cursor = conn.cursor()
+            cursor.execute("BEGIN IMMEDIATE")
+            (max_id,) = cursor.execute("SELECT COALESCE(MAX(id), 0) FROM profiles").fetchone()
+            if self.fts_enabled:
+                # El trigger por fila domina el coste: se desactiva dentro de la transacción
+                cursor.execute("DROP TRIGGER IF EXISTS profiles_fts_ai")
+            written = 0
+            for rows in chunks:
+                cursor.executemany("""
+                    INSERT INTO profiles (nombre, N, P, K, Ca, Mg, version, deleted)
+                    VALUES (?, ?, ?, ?, ?, ?, (SELECT COALESCE(MAX(version), 0) + 1 FROM profiles), 0)
+                    ON CONFLICT(nombre) DO UPDATE SET
+                        N = excluded.N,
+                        P = excluded.P,
+                        K = excluded.K,
+                        Ca = excluded.Ca,
+                        Mg = excluded.Mg,
+                        version = excluded.version,
+                        deleted = 0;
+                """, rows)
+                written += len(rows)
+            if self.fts_enabled:
+                # Los nombres actualizados no cambian: solo se indexan las filas nuevas
+                cursor.execute(
+                    "INSERT INTO profiles_fts(rowid, nombre) SELECT id, nombre FROM profiles WHERE id > ?",
+                    (max_id,),
+                )
+                cursor.execute(FTS_INSERT_TRIGGER)
+            (version,) = cursor.execute("SELECT COALESCE(MAX(version), 0) FROM profiles").fetchone()
+            conn.commit()
+            return written, version
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            conn.close()
+
+    def iter_profiles(self, batch_size: int = 5000) -> Iterator[Tuple]:
+        """Recorre los perfiles activos en lotes, ordenados por nombre: (nombre, N, P, K, Ca, Mg)."""
+        conn = self._get_connection()
+        try:
+            cursor = conn.execute(f"SELECT {PROFILE_COLUMNS} FROM profiles WHERE deleted = 0 ORDER BY nombre")
+            while True:
+                rows = cursor.fetchmany(batch_size)
+                if not rows:
+                    break
+                yield from rows
+        finally:
+            conn.close()
+
     def get_profile_by_name(self, name: str) -> Dict[str, Any] | None:
         """Recupera un perfil específico por nombre."""
         conn = self._get_connection()
         cursor = conn.cursor()
         
-        cursor.execute("SELECT N, P, K, Ca, Mg FROM profiles WHERE nombre = ?", (name,))
+        cursor.execute("SELECT N, P, K, Ca, Mg FROM profiles WHERE nombre = ? AND deleted = 0", (name,))
         row = cursor.fetchone()
         conn.close()
         
@@ -102,8 +438,8 @@ class SQLiteDatabase:
             return {"nombre": name, "N": row[0], "P": row[1], "K": row[2], "Ca": row[3], "Mg": row[4]}
         return None
 
-    def save_new_recipe_history(self, volumen_L: float, perfil_usado: str, ec_final: float, dosis_json: str):
-        """Guarda una receta calculada en el historial."""
+    def save_new_recipe_history(self, volumen_L: float, perfil_usado: str, ec_final: float, dosis_json: str) -> int:
+        """Guarda una receta calculada en el historial y devuelve su id."""
         conn = self._get_connection()
         cursor = conn.cursor()
         
@@ -113,9 +449,153 @@ class SQLiteDatabase:
             "INSERT INTO history (timestamp, volumen_L, perfil_usado, ec_final, dosis_json) VALUES (?, ?, ?, ?, ?)",
             (timestamp, volumen_L, perfil_usado, ec_final, dosis_json)
         )
+        history_id = cursor.lastrowid
         
         conn.commit()
         conn.close()
+        return history_id
+
+    def iter_history(self, batch_size: int = 5000) -> Iterator[Tuple]:
+        """Recorre el historial en lotes: (id, timestamp, volumen_L, perfil_usado, ec_final, dosis_json)."""
+        conn = self._get_connection()
+        try:
+            cursor = conn.execute(
+                "SELECT id, timestamp, volumen_L, perfil_usado, ec_final, dosis_json FROM history ORDER BY id"
+            )
+            while True:
+                rows = cursor.fetchmany(batch_size)
+                if not rows:
+                    break
+                yield from rows
+        finally:
+            conn.close()
+
+    # -------------------------------------------------------------------------
+    # Catálogo de fertilizantes
+    # -------------------------------------------------------------------------
+    @staticmethod
+    def _write_fertilizer(cursor: sqlite3.Cursor, nombre: str, formula: str | None,
+                          composicion: Dict[str, float]) -> int:
+        cursor.execute("""
+            INSERT INTO fertilizers (nombre, formula, version, deleted)
+            VALUES (?, ?, (SELECT COALESCE(MAX(version), 0) + 1 FROM fertilizers), 0)
+            ON CONFLICT(nombre) DO UPDATE SET
+                formula = COALESCE(excluded.formula, fertilizers.formula),
+                version = excluded.version,
+                deleted = 0;
+        """, (nombre, formula))
+        fert_id, version = cursor.execute(
+            "SELECT id, version FROM fertilizers WHERE nombre = ?", (nombre,)
+        ).fetchone()
+        cursor.execute("DELETE FROM fertilizer_composition WHERE fertilizer_id = ?", (fert_id,))
+        cursor.executemany(
+            "INSERT INTO fertilizer_composition (fertilizer_id, nutriente, porcentaje) VALUES (?, ?, ?)",
+            [(fert_id, nut, float(pct)) for nut, pct in composicion.items() if pct and float(pct) > 0],
+        )
+        return version
+
+    def get_fertilizers_version(self) -> int:
+        """Versión del catálogo de fertilizantes (monótona: incluye lápidas)."""
+        conn = self._get_connection()
+        (version,) = conn.execute("SELECT COALESCE(MAX(version), 0) FROM fertilizers").fetchone()
+        conn.close()
+        return version
+
+    def get_fertilizers(
+        self, nutriente: str | None = None, minimo: float | None = None,
+        maximo: float | None = None, since: int | None = None,
+    ) -> List[Dict[str, Any]]:
+        """
+        Sales con su composición {nutriente: %}.
+
+        nutriente/minimo/maximo: solo las que aportan ese nutriente en el rango
+        (rango sobre idx_fert_comp_nutriente), ordenadas de mayor a menor %.
+        since: cambios con version > since, lápidas incluidas (con 'deleted').
+        """
+        where, params = [], []
+        if since is None:
+            where.append("f.deleted = 0")
+        else:
+            where.append("f.version > ?")
+            params.append(int(since))
+        order = "f.nombre"
+        source = "fertilizers f"
+        if nutriente:
+            source = "fertilizer_composition c JOIN fertilizers f ON f.id = c.fertilizer_id"
+            where.append("c.nutriente = ?")
+            params.append(nutriente)
+            if minimo is not None:
+                where.append("c.porcentaje >= ?")
+                params.append(float(minimo))
+            if maximo is not None:
+                where.append("c.porcentaje <= ?")
+                params.append(float(maximo))
+            order = "c.porcentaje DESC, f.nombre"
+
+        conn = self._get_connection()
+        try:
+            rows = conn.execute(
+                f"SELECT f.id, f.nombre, f.formula, f.version, f.deleted FROM {source} "
+                f"WHERE {' AND '.join(where)} ORDER BY {order}",
+                params,
+            ).fetchall()
+            composition: Dict[int, Dict[str, float]] = {r[0]: {} for r in rows}
+            if composition:
+                marks = ",".join("?" * len(composition))
+                for fert_id, nut, pct in conn.execute(
+                    "SELECT fertilizer_id, nutriente, porcentaje FROM fertilizer_composition "
+                    f"WHERE fertilizer_id IN ({marks})",
+                    list(composition),
+                ):
+                    composition[fert_id][nut] = pct
+        finally:
+            conn.close()
+
+        result = []
+        for fert_id, nombre, formula, version, deleted in rows:
+            item = {"nombre": nombre, "formula": formula, "version": version, "composicion": composition[fert_id]}
+            if since is not None:
+                item["deleted"] = bool(deleted)
+            result.append(item)
+        return result
+
+    def save_fertilizer(self, nombre: str, formula: str | None, composicion: Dict[str, float]) -> int:
+        """
+        Crea o reemplaza una sal y su composición (revive lápidas); con
+        formula=None conserva la fórmula guardada. Devuelve la nueva versión.
+        """
+        conn = self._get_connection()
+        try:
+            cursor = conn.cursor()
+            cursor.execute("BEGIN IMMEDIATE")
+            version = self._write_fertilizer(cursor, nombre, formula, composicion)
+            conn.commit()
+            return version
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            conn.close()
+
+    def delete_fertilizer(self, nombre: str) -> int | None:
+        """Marca una sal como borrada (lápida); devuelve la nueva versión o None si no existe."""
+        conn = self._get_connection()
+        cursor = conn.cursor()
+        cursor.execute(
+            "UPDATE fertilizers SET deleted = 1, "
+            "version = (SELECT COALESCE(MAX(version), 0) + 1 FROM fertilizers) "
+            "WHERE nombre = ? AND deleted = 0",
+            (nombre,),
+        )
+        version = None
+        if cursor.rowcount:
+            (fert_id, version) = cursor.execute(
+                "SELECT id, version FROM fertilizers WHERE nombre = ?", (nombre,)
+            ).fetchone()
+            cursor.execute("DELETE FROM fertilizer_composition WHERE fertilizer_id = ?", (fert_id,))
+        conn.commit()
+        conn.close()
+        return version
 
 # Necesario para el guardado de historial
 from datetime import datetime
\ No newline at end of file
@@ -0,0 +1,272 @@
+import heapq
+import itertools
+import time
+from typing import Any, Dict, List
+
+import numpy as np
+
+from calculator import NutrientCalculatorService
+from stock_optimizer import box_qp
+
+
+class DiscreteDosingService:
+    """
+    Dosis en múltiplos enteros del incremento de cada sal (resolución de la
+    báscula, o sacos enteros), lo más cerca posible del perfil objetivo.
+
+    Con k_j unidades de la sal j (g_j = k_j · incremento_j) se minimiza el
+    error relativo ponderado Σ_i (w_i / b_i)² ((A g / V)_i − b_i)², una
+    cuadrática entera con k_j ≥ 0. Ramificación y acotación:
+
+      - cota de cada nodo: la relajación continua con las cotas del nodo,
+        resuelta con el conjunto activo de box_qp (exacta para una cuadrática
+        convexa en caja, así que nunca poda de más);
+      - incumbente inicial: mejor redondeo suelo/techo del óptimo continuo
+        más búsqueda local ±1, que suele ser ya el óptimo;
+      - se ramifica por la variable más fraccional, primero el mejor nodo;
+      - límite de tiempo y de nodos: devuelve la mejor solución con su gap.
+    """
+
+    def __init__(self, calc: NutrientCalculatorService, limite_ms: float = 50.0, max_nodos: int = 20000,
+                 max_limite_ms: float = 2000.0, max_recetas: int = 200):
+        self.calc = calc
+        self.limite_ms = limite_ms
+        self.max_nodos = max_nodos
+        self.max_limite_ms = max_limite_ms   # tope del límite de tiempo pedido por receta
+        self.max_recetas = max_recetas       # recetas por lote
+
+    # -------------------------------------------------------------------------
+    # Problema
+    # -------------------------------------------------------------------------
+    def _target(self, objetivo: Any) -> np.ndarray:
+        if isinstance(objetivo, str):
+            objetivo = self.calc.get_profile_data(objetivo)
+        if not isinstance(objetivo, dict):
+            raise ValueError("'objetivo' debe ser un nombre de perfil o un dict de ppm.")
+        b = np.array([float(objetivo.get(nut, 0.0)) for nut in self.calc.nutrient_order])
+        if (b < 0).any() or not np.isfinite(b).all():
+            raise ValueError("Los ppm objetivo deben ser números no negativos.")
+        return b
+
+    def _increments(self, resolucion_g: float, incrementos_g: Dict[str, float] | None) -> np.ndarray:
+        incrementos_g = incrementos_g or {}
+        unknown = set(incrementos_g) - set(self.calc.selected_ferts)
+        if unknown:
+            raise ValueError(f"Fertilizantes desconocidos en 'incrementos_g': {', '.join(sorted(unknown))}")
+        step = np.array([float(incrementos_g.get(f, resolucion_g)) for f in self.calc.selected_ferts])
+        if (step <= 0).any() or not np.isfinite(step).all():
+            raise ValueError("Los incrementos (resolución o tamaño de saco) deben ser mayores que cero.")
+        return step
+
+    def _limit_ms(self, limite_ms: float | None) -> float:
+        """Límite de tiempo por receta, recortado a [0, max_limite_ms]."""
+        if limite_ms is None:
+            return self.limite_ms
+        limite_ms = float(limite_ms)
+        if np.isnan(limite_ms):
+            raise ValueError("'limite_ms' debe ser un número.")
+        return min(max(limite_ms, 0.0), self.max_limite_ms)
+
+    # -------------------------------------------------------------------------
+    # Resolución
+    # -------------------------------------------------------------------------
+    def solve(
+        self,
+        volumen: float,
+        objetivo: Any,
+        resolucion_g: float = 1.0,
+        incrementos_g: Dict[str, float] | None = None,
+        max_unidades: Dict[str, int] | None = None,
+        pesos: Dict[str, float] | None = None,
+        limite_ms: float | None = None,
+    ) -> Dict[str, Any]:
+        """
+        objetivo: nombre de perfil o {N, P, K, Ca, Mg} en ppm.
+        resolucion_g: incremento por defecto (báscula); incrementos_g lo
+        sustituye por sal (p. ej. {"NitratoCalcio": 25000} para sacos de 25 kg).
+        max_unidades: tope de unidades por sal (existencias).
+        """
+        t0 = time.perf_counter()
+        volumen = float(volumen)
+        if not volumen > 0:
+            raise ValueError("El volumen debe ser mayor que cero.")
+        b = self._target(objetivo)
+        step = self._increments(float(resolucion_g), incrementos_g)
+        nutrients, ferts = self.calc.nutrient_order, self.calc.selected_ferts
+
+        # Error relativo ponderado: filas escaladas por w_i / b_i (mín. 1 ppm)
+        w = np.array([float((pesos or {}).get(nut, 1.0)) for nut in nutrients])
+        scale = w / np.maximum(b, 1.0)
+        M = (self.calc.matrix_A * step / volumen) * scale[:, None]   # ppm escalados por unidad
+        t = b * scale
+        G, h, const = M.T @ M, M.T @ t, float(t @ t)
+
+        # Cota superior válida por sal: pasarse de un nutriente más de lo que
+        # cuesta no dosificar nada (const) nunca puede ser óptimo
+        with np.errstate(divide="ignore"):
+            reach = np.where(M > 0, (t[:, None] + np.sqrt(const)) / M, np.inf).min(axis=0)
+        hi = np.floor(np.where(np.isfinite(reach), reach, 0.0))
+        for fert, cap in (max_unidades or {}).items():
+            if fert not in ferts:
+                raise ValueError(f"Fertilizante desconocido en 'max_unidades': {fert}")
+            j = ferts.index(fert)
+            hi[j] = min(hi[j], max(0, int(cap)))
+
+        result = self._branch_and_bound(G, h, const, hi, self._limit_ms(limite_ms) / 1000)
+        k = result["k"]
+
+        def rms(x_units):
+            r = M @ x_units - t
+            return float(np.sqrt(np.mean(r * r)))
+
+        grams = k * step
+        ppm = self.calc.matrix_A @ (grams / volumen)
+        naive = np.clip(np.round(result["continuo"]), 0, hi)   # redondeo ingenuo, para comparar
+
+        return {
+            "success": True,
+            "volumen_L": volumen,
+            "perfil": objetivo if isinstance(objetivo, str) else None,
+            "dosis": [
+                {
+                    "nombre": fert,
+                    "formula": self.calc.fertilizers[fert].get("formula", "Sal"),
+                    "incremento_g": float(step[j]),
+                    "unidades": int(k[j]),
+                    "dosis_gramos": round(float(grams[j]), 2),
+                    "continuo_gramos": round(float(result["continuo"][j] * step[j]), 2),
+                }
+                for j, fert in enumerate(ferts)
+            ],
+            "objetivo": dict(zip(nutrients, np.round(b, 2).tolist())),
+            "analisis_final": dict(zip(nutrients, np.round(ppm, 2).tolist())),
+            "error_rel": {
+                nut: round(float((ppm[i] - b[i]) / b[i]), 4) if b[i] > 0 else None
+                for i, nut in enumerate(nutrients)
+            },
+            "error_rms_rel": round(rms(k), 5),
+            "error_rms_rel_continuo": round(rms(result["continuo"]), 5),
+            "error_rms_rel_redondeo": round(rms(naive), 5),
+            "optimo": result["optimo"],
+            "gap": round(result["gap"], 6),
+            "nodos": result["nodos"],
+            "tiempo_ms": round((time.perf_counter() - t0) * 1000, 3),
+        }
+
+    def solve_many(self, items: List[Dict[str, Any]], **defaults) -> List[Dict[str, Any]]:
+        """
+        Lote de recetas; los errores son por elemento. Cada item:
+        {volumen_tanque, perfil_seleccionado | objetivo, resolucion_g?, incrementos_g?, ...}.
+        """
+        if not isinstance(items, list):
+            raise ValueError("'recetas' debe ser una lista.")
+        if len(items) > self.max_recetas:
+            raise ValueError(f"Demasiadas recetas en el lote: {len(items)} (máximo {self.max_recetas}).")
+        results = []
+        for item in items:
+            try:
+                if not isinstance(item, dict):
+                    raise ValueError("Cada receta debe ser un objeto.")
+                params = {**defaults, **{k: item[k] for k in ("resolucion_g", "incrementos_g", "max_unidades",
+                                                              "pesos", "limite_ms") if item.get(k) is not None}}
+                objetivo = item.get("objetivo") or item.get("perfil_seleccionado")
+                if item.get("volumen_tanque") is None or not objetivo:
+                    raise ValueError("Faltan 'volumen_tanque' y 'perfil_seleccionado' u 'objetivo'")
+                results.append(self.solve(item["volumen_tanque"], objetivo, **params))
+            except (TypeError, ValueError) as e:
+                results.append({"success": False, "error": str(e)})
+        return results
+
+    # -------------------------------------------------------------------------
+    # Ramificación y acotación
+    # -------------------------------------------------------------------------
+    @staticmethod
+    def _relax(G, h, lo, hi, x0):
+        """Óptimo continuo con lo ≤ x ≤ hi (desplazado a 0 ≤ y ≤ hi − lo) y su valor xᵀGx − 2hᵀx."""
+        y = box_qp(G, h - G @ lo, hi - lo, np.clip(x0, lo, hi) - lo)
+        x = lo + y
+        return x, float(x @ G @ x - 2 * h @ x)
+
+    @staticmethod
+    def _values(K: np.ndarray, G: np.ndarray, h: np.ndarray) -> np.ndarray:
+        """xᵀGx − 2hᵀx para cada fila de K."""
+        return np.einsum("ki,ij,kj->k", K, G, K) - 2 * K @ h
+
+    def _round(self, x, lo, hi, G, h):
+        """Mejor combinación suelo/techo (todas si hay pocas sales) + búsqueda local ±1."""
+        n = len(x)
+        floor = np.clip(np.floor(x), lo, hi)
+        if n <= 10:
+            bits = np.array(list(itertools.product((0.0, 1.0), repeat=n)))
+            K = np.clip(floor + bits, lo, hi)
+        else:
+            K = np.clip(np.round(x), lo, hi)[None, :]
+        vals = self._values(K, G, h)
+        best = K[int(np.argmin(vals))].copy()
+        best_val = float(vals.min())
+
+        moves = np.vstack([np.eye(n), -np.eye(n)])
+        for _ in range(100):
+            cand = np.clip(best + moves, lo, hi)
+            vals = self._values(cand, G, h)
+            i = int(np.argmin(vals))
+            if vals[i] >= best_val - 1e-12 * max(1.0, abs(best_val)):
+                break
+            best, best_val = cand[i].copy(), float(vals[i])
+        return best, best_val
+
+    def _branch_and_bound(self, G, h, const, hi, limit_s) -> Dict[str, Any]:
+        t0 = time.perf_counter()
+        n = len(h)
+        lo = np.zeros(n)
+        x, bound = self._relax(G, h, lo, hi, np.zeros(n))
+        continuous = x
+        best, best_val = self._round(x, lo, hi, G, h)
+
+        eps = 1e-9 * max(1.0, const)
+        heap = [(bound, 0, lo, hi.copy(), x)]
+        counter, nodes = 1, 1
+        while heap:
+            if nodes >= self.max_nodos or time.perf_counter() - t0 > limit_s:
+                break
+            bound, _, nlo, nhi, x = heapq.heappop(heap)
+            if bound >= best_val - eps:
+                continue
+
+            frac = np.abs(x - np.round(x))
+            j = int(np.argmax(frac))
+            if frac[j] < 1e-6:
+                k = np.round(x)
+                val = float(self._values(k[None, :], G, h)[0])
+                if val < best_val:
+                    best, best_val = k, val
+                continue
+
+            # Redondeo del nodo: mejora barata del incumbente
+            k, val = self._round(x, nlo, nhi, G, h)
+            if val < best_val:
+                best, best_val = k, val
+
+            for child_lo, child_hi in (
+                (nlo, np.where(np.arange(n) == j, np.floor(x[j]), nhi)),
+                (np.where(np.arange(n) == j, np.ceil(x[j]), nlo), nhi),
+            ):
+                if (child_lo > child_hi).any():
+                    continue
+                cx, cb = self._relax(G, h, child_lo, child_hi, x)
+                nodes += 1
+                if cb < best_val - eps:
+                    heapq.heappush(heap, (cb, counter, child_lo, child_hi, cx))
+                    counter += 1
+
+        # Gap relativo sobre el error total (const + valor) con la mejor cota pendiente
+        pending = [node[0] for node in heap if node[0] < best_val - eps]
+        lower = min(pending) if pending else best_val
+        total = best_val + const
+        return {
+            "k": best,
+            "continuo": continuous,
+            "optimo": not pending,
+            "gap": float((best_val - lower) / total) if pending and total > 0 else 0.0,
+            "nodos": nodes,
+        }
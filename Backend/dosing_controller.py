@@ -0,0 +1,388 @@
+import math
+import threading
+import time
+import numpy as np
+from typing import Any, Dict, List
+
+from calculator import NutrientCalculatorService
+
+
+# ---------------------------------------------------------------------------------------
+# DRIVERS DE BOMBAS
+# ---------------------------------------------------------------------------------------
+class PumpDriver:
+    """
+    Interfaz de un driver de bombas dosificadoras.
+
+    Un driver real (serie, Modbus, GPIO...) implementa read_all() para las
+    lecturas de los sensores y dispense() para ejecutar los comandos.
+    """
+
+    nombre = "base"
+
+    def read_all(self, tank_ids: List[Any], nutrient_order: List[str]) -> tuple:
+        """Devuelve (ppm medidas n x nutrientes, EC medida n) con NaN donde no hay lectura."""
+        raise NotImplementedError
+
+    def dispense(self, commands: List[Dict[str, Any]]) -> None:
+        """commands: [{"tanque", "dosis_gramos": {fertilizante: g}}]."""
+        raise NotImplementedError
+
+
+class SimulatedPumpDriver(PumpDriver):
+    """
+    Driver local para pruebas: mantiene el estado de tanques simulados.
+
+    Cada lectura aplica el consumo del cultivo desde la anterior (ppm/h) y
+    ruido de sensor; cada dosis suma A·(g/L) a las ppm del tanque.
+    """
+
+    nombre = "simulado"
+
+    def __init__(self, calc: NutrientCalculatorService, consumo_ppm_h: float = 2.0,
+                 ruido_ppm: float = 0.5, semilla: int | None = None):
+        self.calc = calc
+        self.consumo_ppm_h = consumo_ppm_h
+        self.ruido_ppm = ruido_ppm
+        self.rng = np.random.default_rng(semilla)
+        self.ppm: Dict[Any, np.ndarray] = {}
+        self.volumen: Dict[Any, float] = {}
+        self._last_read = time.monotonic()
+        self.dispensed_g = np.zeros(len(calc.selected_ferts))
+        self._lock = threading.Lock()
+
+    def add_tank(self, tank_id: Any, volumen_L: float, ppm_inicial: np.ndarray):
+        with self._lock:
+            self.ppm[tank_id] = np.array(ppm_inicial, dtype=float)
+            self.volumen[tank_id] = float(volumen_L)
+
+    def read_all(self, tank_ids, nutrient_order):
+        now = time.monotonic()
+        with self._lock:
+            dt_h = (now - self._last_read) / 3600.0
+            self._last_read = now
+            measured = np.full((len(tank_ids), len(nutrient_order)), np.nan)
+            for r, tid in enumerate(tank_ids):
+                state = self.ppm.get(tid)
+                if state is None:
+                    continue
+                state -= self.consumo_ppm_h * dt_h
+                np.maximum(state, 0, out=state)
+                measured[r] = state
+        measured += self.rng.normal(0, self.ruido_ppm, measured.shape)
+        # EC aproximada por la suma de ppm (mismo criterio que la calculadora)
+        ec = np.nansum(measured, axis=1) / 500.0
+        return measured, ec
+
+    def dispense(self, commands):
+        ferts = self.calc.selected_ferts
+        with self._lock:
+            for cmd in commands:
+                tid = cmd["tanque"]
+                if tid not in self.ppm:
+                    continue
+                grams = np.array([cmd["dosis_gramos"].get(f, 0.0) for f in ferts])
+                self.ppm[tid] += (grams / self.volumen[tid]) @ self.calc.matrix_A.T
+                self.dispensed_g += grams
+
+
+DRIVERS = {"simulado": SimulatedPumpDriver}
+
+
+# ---------------------------------------------------------------------------------------
+# CONTROLADOR
+# ---------------------------------------------------------------------------------------
+class DosingController:
+    """
+    Controlador de lazo cerrado para la dosificación de muchos tanques.
+
+    En cada tick, para todos los tanques a la vez (arrays n x nutrientes):
+      1. error = objetivo - medido; se ignora lo que cae dentro de la banda muerta
+      2. dosis = ganancia · A⁻¹ · déficit  (inversa cacheada de la calculadora),
+         recortada a >= 0 (las sales no se pueden quitar)
+      3. límites de seguridad: subida máxima de ppm por tick, gramos máximos
+         por dosis, presupuesto de gramos por hora (cubeta de tokens) e
+         intervalo mínimo entre dosis del mismo tanque
+      4. bloqueo (alarma) si algún nutriente o la EC superan el máximo seguro
+    Solo se envían al driver los tanques con algo que dosificar.
+
+    El cálculo del tick es O(n) en numpy; tick_stats registra el tiempo de
+    cómputo frente al presupuesto 'presupuesto_ms'.
+    """
+
+    DEFAULTS = {
+        "ganancia": 0.6,               # fracción del déficit corregida por tick
+        "banda_muerta_ppm": 3.0,
+        "max_subida_ppm": 20.0,        # por tick y nutriente
+        "max_g_por_dosis": 200.0,      # por fertilizante y tick
+        "max_g_por_hora": 2000.0,      # por tanque (todas las sales)
+        "intervalo_min_s": 30.0,
+        "max_exceso": 0.25,            # bloqueo si medido > objetivo · (1 + max_exceso)
+        "ec_max": 4.0,
+        "min_g": 0.01,
+        "periodo_s": 5.0,
+        "presupuesto_ms": 1.0,
+    }
+    # Límites de seguridad que con 0 (o menos) bloquearían o anularían el control
+    POSITIVOS = ("max_subida_ppm", "max_g_por_dosis", "max_g_por_hora", "max_exceso", "ec_max", "periodo_s")
+
+    def __init__(self, calc: NutrientCalculatorService, driver: PumpDriver | None = None, **config):
+        self.calc = calc
+        self.driver = driver
+        self.config = {**self.DEFAULTS, **self._validate_config(config)}
+        self.nutrient_order = calc.nutrient_order
+        self.ferts = calc.selected_ferts
+
+        self.tank_ids: List[Any] = []
+        self._rows: Dict[Any, int] = {}
+        self.perfiles: List[str] = []
+        self.targets = np.zeros((0, len(self.nutrient_order)))
+        self.volumes = np.zeros(0)
+        self.last_dose = np.zeros(0)
+        self.tokens = np.zeros(0)
+        self.locked = np.zeros(0, dtype=bool)
+        self._last_tick = time.monotonic()
+
+        self._lock = threading.RLock()
+        self._stop = threading.Event()
+        self._thread: threading.Thread | None = None
+        self.tick_stats = {"ticks": 0, "ultimo_ms": 0.0, "max_ms": 0.0, "excesos": 0}
+        self.ultimo_tick: Dict[str, Any] | None = None
+
+    @classmethod
+    def _validate_config(cls, config: Dict[str, Any]) -> Dict[str, float]:
+        """Valores numéricos finitos; los límites de POSITIVOS, además, mayores que cero."""
+        unknown = set(config) - set(cls.DEFAULTS)
+        if unknown:
+            raise ValueError(f"Parámetros desconocidos: {', '.join(sorted(unknown))}")
+        clean = {}
+        for key, value in config.items():
+            try:
+                value = float(value)
+            except (TypeError, ValueError):
+                raise ValueError(f"'{key}' debe ser un número.")
+            if not math.isfinite(value) or value < 0 or (value == 0 and key in cls.POSITIVOS):
+                cond = "mayor que cero" if key in cls.POSITIVOS else "mayor o igual que cero"
+                raise ValueError(f"'{key}' debe ser un número finito {cond}.")
+            clean[key] = value
+        return clean
+
+    def configure(self, driver: PumpDriver | None = None, **config):
+        """
+        Cambia parámetros y/o driver sin perder el estado de los tanques
+        (bloqueos, último instante de dosis y presupuesto de gramos).
+        """
+        config = self._validate_config(config)
+        with self._lock:
+            self.config = {**self.config, **config}
+            np.minimum(self.tokens, self.config["max_g_por_hora"], out=self.tokens)
+            if driver is not None:
+                self.driver = driver
+
+    # -------------------------------------------------------------------------
+    # Tanques
+    # -------------------------------------------------------------------------
+    def set_tanks(self, tanks: List[Dict[str, Any]]):
+        """
+        tanks: [{"id", "perfil", "volumen_L"}]. Sustituye la lista completa.
+        Un tanque que ya estaba registrado (mismo id) conserva su estado de
+        seguridad: el bloqueo solo lo quita reset_alarm() y volver a
+        registrarlo no rellena el presupuesto ni reinicia el intervalo.
+        """
+        ids, perfiles, targets, volumes = [], [], [], []
+        for k, tank in enumerate(tanks):
+            profile = self.calc.get_profile_data(tank["perfil"])
+            volumen = float(tank["volumen_L"])
+            if volumen <= 0:
+                raise ValueError("El volumen de cada tanque debe ser mayor que cero.")
+            ids.append(tank.get("id", k))
+            perfiles.append(tank["perfil"])
+            targets.append([float(profile[n]) for n in self.nutrient_order])
+            volumes.append(volumen)
+        if len(set(ids)) != len(ids):
+            raise ValueError("Los ids de tanque deben ser únicos.")
+
+        n = len(ids)
+        with self._lock:
+            last_dose = np.full(n, -np.inf)
+            tokens = np.full(n, self.config["max_g_por_hora"])
+            locked = np.zeros(n, dtype=bool)
+            for r, tid in enumerate(ids):
+                old = self._rows.get(tid)
+                if old is not None:
+                    last_dose[r] = self.last_dose[old]
+                    tokens[r] = self.tokens[old]
+                    locked[r] = self.locked[old]
+
+            self.tank_ids = ids
+            self._rows = {tid: r for r, tid in enumerate(ids)}
+            self.perfiles = perfiles
+            self.targets = np.array(targets).reshape(n, len(self.nutrient_order))
+            self.volumes = np.array(volumes)
+            self.last_dose = last_dose
+            self.tokens = tokens
+            self.locked = locked
+
+    def reset_alarm(self, tank_id: Any) -> bool:
+        with self._lock:
+            row = self._rows.get(tank_id)
+            if row is None:
+                return False
+            self.locked[row] = False
+            return True
+
+    # -------------------------------------------------------------------------
+    # Tick de control
+    # -------------------------------------------------------------------------
+    def compute(self, measured: np.ndarray, ec: np.ndarray | None = None,
+                now: float | None = None) -> Dict[str, np.ndarray]:
+        """
+        Cálculo puro (sin E/S) de un tick. measured: n x nutrientes (NaN = sin lectura).
+        Devuelve arrays: gramos (n x fertilizantes), dosificar (n), alarma (n).
+        """
+        cfg = self.config
+        now = time.monotonic() if now is None else now
+        dt_h = max(now - self._last_tick, 0.0) / 3600.0
+        self._last_tick = now
+
+        valid = ~np.isnan(measured).any(axis=1)
+        m = np.where(valid[:, None], measured, self.targets)
+
+        # Seguridad: exceso de algún nutriente o de EC → bloqueo hasta revisión manual
+        over = (m > self.targets * (1.0 + cfg["max_exceso"])).any(axis=1)
+        if ec is not None:
+            over |= np.nan_to_num(ec, nan=0.0) > cfg["ec_max"]
+        alarm = valid & over & ~self.locked
+        self.locked |= valid & over
+
+        # Déficit con banda muerta y ganancia proporcional
+        deficit = self.targets - m
+        deficit[deficit < cfg["banda_muerta_ppm"]] = 0.0
+        delta = cfg["ganancia"] * deficit
+
+        x_gl = np.clip(delta @ self.calc.inverse_matrix().T, 0, None)
+
+        # Subida máxima por tick: escala la dosis completa para no cambiar la proporción
+        rise = x_gl @ self.calc.matrix_A.T
+        peak = rise.max(axis=1)
+        scale = np.where(peak > cfg["max_subida_ppm"], cfg["max_subida_ppm"] / np.maximum(peak, 1e-12), 1.0)
+        grams = x_gl * (scale * self.volumes)[:, None]
+        np.minimum(grams, cfg["max_g_por_dosis"], out=grams)
+
+        # Presupuesto por hora (cubeta de tokens) e intervalo mínimo entre dosis
+        self.tokens = np.minimum(self.tokens + cfg["max_g_por_hora"] * dt_h, cfg["max_g_por_hora"])
+        total = grams.sum(axis=1)
+        budget = np.where(total > self.tokens, self.tokens / np.maximum(total, 1e-12), 1.0)
+        grams *= budget[:, None]
+        grams[grams < cfg["min_g"]] = 0.0
+
+        dose = valid & ~self.locked & ((now - self.last_dose) >= cfg["intervalo_min_s"]) & (grams.sum(axis=1) > 0)
+        grams[~dose] = 0.0
+        self.tokens -= grams.sum(axis=1)
+        self.last_dose[dose] = now
+
+        return {"gramos": grams, "dosificar": dose, "alarma": alarm, "valido": valid}
+
+    def tick(self, measured: np.ndarray | None = None, ec: np.ndarray | None = None) -> Dict[str, Any]:
+        """Un ciclo completo: lectura (driver o argumento) → cálculo → comandos al driver."""
+        with self._lock:
+            if measured is None:
+                if self.driver is None:
+                    raise ValueError("No hay driver de bombas configurado.")
+                measured, ec = self.driver.read_all(self.tank_ids, self.nutrient_order)
+
+            t0 = time.perf_counter()
+            out = self.compute(np.asarray(measured, dtype=float), ec)
+            compute_ms = (time.perf_counter() - t0) * 1000.0
+
+            stats = self.tick_stats
+            stats["ticks"] += 1
+            stats["ultimo_ms"] = round(compute_ms, 4)
+            stats["max_ms"] = round(max(stats["max_ms"], compute_ms), 4)
+            stats["excesos"] += int(compute_ms > self.config["presupuesto_ms"])
+
+            commands = []
+            for r in np.flatnonzero(out["dosificar"]):
+                commands.append({
+                    "tanque": self.tank_ids[r],
+                    "dosis_gramos": {
+                        f: round(float(g), 3) for f, g in zip(self.ferts, out["gramos"][r]) if g > 0
+                    },
+                })
+            alarms = [self.tank_ids[r] for r in np.flatnonzero(out["alarma"])]
+
+        if commands and self.driver is not None:
+            self.driver.dispense(commands)
+
+        self.ultimo_tick = {
+            "comandos": commands,
+            "alarmas": alarms,
+            "sin_lectura": int((~out["valido"]).sum()),
+            "computo_ms": round(compute_ms, 4),
+        }
+        return self.ultimo_tick
+
+    def tick_from_readings(self, lecturas: Dict[str, Dict[str, float]]) -> Dict[str, Any]:
+        """Tick con lecturas externas: {tanque: {"N": .., ..., "ec"?: ..}}; tanques sin lectura no se dosifican."""
+        with self._lock:
+            measured = np.full((len(self.tank_ids), len(self.nutrient_order)), np.nan)
+            ec = np.full(len(self.tank_ids), np.nan)
+            for tid, reading in lecturas.items():
+                row = self._rows.get(tid)
+                if row is None:
+                    row = self._rows.get(_coerce_id(tid, self._rows))
+                if row is None:
+                    raise ValueError(f"Tanque desconocido: {tid}")
+                measured[row] = [float(reading.get(n, np.nan)) for n in self.nutrient_order]
+                if reading.get("ec") is not None:
+                    ec[row] = float(reading["ec"])
+            return self.tick(measured, ec)
+
+    # -------------------------------------------------------------------------
+    # Lazo en segundo plano
+    # -------------------------------------------------------------------------
+    def start(self):
+        if self.driver is None:
+            raise ValueError("No hay driver de bombas configurado.")
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._loop, name="dosing-controller", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread:
+            self._thread.join()
+
+    def _loop(self):
+        while not self._stop.is_set():
+            try:
+                if self.tank_ids:
+                    self.tick()
+            except Exception as e:
+                print(f"[DosingController] Error en el tick: {e}")
+            self._stop.wait(self.config["periodo_s"])
+
+    def status(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "activo": bool(self._thread and self._thread.is_alive()),
+                "driver": getattr(self.driver, "nombre", None),
+                "tanques": [
+                    {"id": tid, "perfil": p, "volumen_L": float(v), "bloqueado": bool(lk)}
+                    for tid, p, v, lk in zip(self.tank_ids, self.perfiles, self.volumes, self.locked)
+                ],
+                "config": self.config,
+                "estadisticas": dict(self.tick_stats),
+                "ultimo_tick": self.ultimo_tick,
+            }
+
+
+def _coerce_id(tid: Any, rows: Dict[Any, int]) -> Any:
+    """Los ids llegan como texto en JSON: '3' → 3 si el tanque se registró con id numérico."""
+    try:
+        as_int = int(tid)
+    except (TypeError, ValueError):
+        return tid
+    return as_int if as_int in rows else tid
@@ -0,0 +1,228 @@
+import itertools
+import time
+from typing import Any, Dict, List, Sequence
+
+import numpy as np
+
+
+class FeasibilityIndex:
+    """
+    Catálogo de fertilizantes precompilado para saber, antes de resolver, si un
+    perfil objetivo es alcanzable con dosis no negativas.
+
+    Lo alcanzable es el cono {A x : x >= 0} generado por las columnas de la
+    matriz A (ppm por g/L). Se guarda en forma de desigualdades:
+
+        E b = 0     (el objetivo debe estar en el subespacio de las sales)
+        F b >= 0    (una fila por faceta del cono, normales unitarias)
+
+    así que clasificar un objetivo son dos productos matriz-vector. Además se
+    precalculan las cotas de cada razón b_i / b_j (sus extremos se alcanzan en
+    las sales individuales), que explican en términos agronómicos por qué un
+    perfil queda fuera ("Ca/N pedido 1.5, máximo 1.23").
+
+    El índice se reconstruye solo cuando cambia la matriz de la calculadora
+    (otro objeto A u otra lista de sales). Con caché en disco, los índices ya
+    compilados se guardan por huella de la matriz y no se recalculan al arrancar.
+    """
+
+    MAX_CACHED = 16   # catálogos distintos guardados en la caché en disco
+
+    def __init__(self, calc, tol: float = 1e-9, rtol: float = 1e-6, cache: Any = None):
+        self.calc = calc
+        self.cache = cache
+        self.tol = tol      # rango numérico y generadores degenerados
+        self.rtol = rtol    # holgura de pertenencia, relativa a |b|
+        self._matrix = None
+        self._ferts: tuple = ()
+        self.rebuilds = 0
+        self.build_ms = 0.0
+
+    # -------------------------------------------------------------------------
+    # Construcción
+    # -------------------------------------------------------------------------
+    def _current(self) -> "FeasibilityIndex":
+        """Reconstruye si el catálogo de la calculadora cambió desde la última vez."""
+        if self.calc.matrix_A is not self._matrix or tuple(self.calc.selected_ferts) != self._ferts:
+            self._build(self.calc.matrix_A, self.calc.selected_ferts)
+        return self
+
+    def _build(self, matrix_A: np.ndarray, ferts: Sequence[str]) -> None:
+        t0 = time.perf_counter()
+        A = np.asarray(matrix_A, dtype=float)
+        m = A.shape[0]
+
+        stored, key = None, None
+        if self.cache is not None:
+            stored = self.cache.section("factibilidad", "v1")
+            key = self.cache.fingerprint(A.tolist(), list(ferts), self.tol)
+
+        if stored is not None and key in stored:
+            entry = stored[key]
+            rank = entry["rango"]
+            self.facets = np.array(entry["facetas"], dtype=float).reshape(-1, m)
+            self.equalities = np.array(entry["igualdades"], dtype=float).reshape(-1, m)
+            self.ratio_min = np.array(entry["razon_min"], dtype=float)
+            self.ratio_max = np.array(entry["razon_max"], dtype=float)
+        else:
+            # Subespacio generado por las sales: U_r (base) y E (complemento ortogonal)
+            U, s, _ = np.linalg.svd(A) if A.size else (np.eye(m), np.zeros(0), None)
+            rank = int(np.sum(s > self.tol * max(1.0, s.max(initial=0.0))))
+            basis, equalities = U[:, :rank], U[:, rank:].T
+
+            self.facets = self._facets(basis.T @ A, rank) @ basis.T if rank else np.zeros((0, m))
+            self.equalities = equalities
+            self.ratio_min, self.ratio_max = self._ratio_bounds(A)
+
+            if stored is not None:
+                stored[key] = {
+                    "rango": rank,
+                    "facetas": self.facets.tolist(),
+                    "igualdades": self.equalities.tolist(),
+                    "razon_min": self.ratio_min.tolist(),
+                    "razon_max": self.ratio_max.tolist(),
+                }
+                while len(stored) > self.MAX_CACHED:
+                    stored.pop(next(iter(stored)))
+                self.cache.touch()
+
+        self._matrix = matrix_A
+        self._ferts = tuple(ferts)
+        self.rank = rank
+        self.rebuilds += 1
+        self.build_ms = (time.perf_counter() - t0) * 1000
+
+    def _facets(self, G: np.ndarray, r: int) -> np.ndarray:
+        """
+        Normales (unitarias, hacia dentro) de las facetas del cono generado por
+        las columnas de G (r x n, rango r). Cada faceta la fijan r-1 generadores
+        independientes y deja a todos los demás del mismo lado.
+        """
+        norms = np.linalg.norm(G, axis=0)
+        gens = G[:, norms > self.tol] / norms[norms > self.tol]
+        if r == 1:
+            return np.sign(gens[:, :1].T)
+
+        found: Dict[tuple, np.ndarray] = {}
+        for combo in itertools.combinations(range(gens.shape[1]), r - 1):
+            sub = gens[:, combo].T
+            _, sv, vt = np.linalg.svd(sub)
+            if sv[-1] < self.tol:   # generadores dependientes: no fijan un hiperplano
+                continue
+            normal = vt[-1]
+            side = normal @ gens
+            if np.all(side <= self.tol):
+                normal, side = -normal, -side
+            if not np.all(side >= -self.tol):
+                continue
+            key = tuple(np.round(normal, 9))
+            found.setdefault(key, normal)
+        return np.array(list(found.values())) if found else np.zeros((0, r))
+
+    @staticmethod
+    def _ratio_bounds(A: np.ndarray):
+        """
+        Cotas de b_i / b_j sobre el cono: el cociente de dos combinaciones
+        lineales no negativas está entre los cocientes de los generadores.
+        Una sal con b_j = 0 y b_i > 0 deja la razón sin cota superior.
+        """
+        m = A.shape[0]
+        lo = np.full((m, m), np.nan)
+        hi = np.full((m, m), np.nan)
+        for j in range(m):
+            carriers = A[j] > 0
+            if not carriers.any():
+                continue
+            ratios = A[:, carriers] / A[j, carriers]
+            lo[:, j] = ratios.min(axis=1)
+            hi[:, j] = np.where((A[:, ~carriers] > 0).any(axis=1), np.inf, ratios.max(axis=1))
+        return lo, hi
+
+    # -------------------------------------------------------------------------
+    # Consultas
+    # -------------------------------------------------------------------------
+    def reachable_many(self, targets: np.ndarray) -> np.ndarray:
+        """Vector booleano: qué filas de objetivos (ppm) están dentro del cono."""
+        self._current()
+        B = np.atleast_2d(np.asarray(targets, dtype=float))
+        eps = self.rtol * np.maximum(np.linalg.norm(B, axis=1), 1.0)[:, None]
+        ok = np.all(B @ self.facets.T >= -eps, axis=1) & np.all(B >= 0, axis=1)
+        if len(self.equalities):
+            ok &= np.all(np.abs(B @ self.equalities.T) <= eps, axis=1)
+        return ok
+
+    def check(self, target: Sequence[float]) -> Dict[str, Any]:
+        """
+        Clasifica un objetivo (ppm en el orden de calc.nutrient_order).
+
+        Por cada faceta violada (normal f hacia dentro, f·b < 0):
+          restrictivos: nutrientes pedidos en exceso respecto al resto (f_i < 0)
+                        o que ninguna sal aporta; bajándolos, el perfil se
+                        acercaría a lo alcanzable.
+          pedidos_bajos: nutrientes pedidos en cantidad demasiado baja para
+                        acompañar al resto (f_i > 0); subiéndolos, el perfil se
+                        acercaría a lo alcanzable.
+        Qué nutrientes acaban por encima o por debajo del objetivo depende de
+        cómo se recorte la solución: lo calcula la calculadora con sus dosis.
+        """
+        self._current()
+        nutrients = self.calc.nutrient_order
+        b = np.asarray(target, dtype=float)
+        eps = self.rtol * max(float(np.linalg.norm(b)), 1.0)
+
+        margins = self.facets @ b
+        violated = self.facets[margins < -eps]
+        off_span = len(self.equalities) and np.any(np.abs(self.equalities @ b) > eps)
+        negative = [n for n, v in zip(nutrients, b) if v < 0]
+
+        too_low, too_high = set(), set()
+        for f in violated:
+            big = np.abs(f) > 1e-6
+            too_low.update(n for n, c, k in zip(nutrients, f, big) if k and c > 0)
+            too_high.update(n for n, c, k in zip(nutrients, f, big) if k and c < 0)
+
+        ratios: List[Dict[str, Any]] = []
+        with np.errstate(divide="ignore", invalid="ignore"):
+            value = b[:, None] / b[None, :]
+            out = (value < self.ratio_min * (1 - self.rtol)) | (value > self.ratio_max * (1 + self.rtol))
+        out &= (b[None, :] > 0) & ~np.eye(len(b), dtype=bool)
+        for i, j in zip(*np.nonzero(out)):
+            hi = self.ratio_max[i, j]
+            ratios.append({
+                "razon": f"{nutrients[i]}/{nutrients[j]}",
+                "valor": round(float(value[i, j]), 4),
+                "min": round(float(self.ratio_min[i, j]), 4),
+                "max": None if np.isinf(hi) else round(float(hi), 4),
+            })
+        # Nutrientes pedidos que ninguna sal aporta
+        missing = [n for j, n in enumerate(nutrients) if b[j] > 0 and np.isnan(self.ratio_min[j, j])]
+
+        return {
+            "alcanzable": not (len(violated) or off_span or negative),
+            "restrictivos": [n for n in nutrients if n in too_high or n in missing],
+            "pedidos_bajos": [n for n in nutrients if n in too_low and n not in missing],
+            "sin_aporte": missing,
+            "razones_fuera_de_rango": ratios,
+            "facetas_violadas": int(len(violated)),
+        }
+
+    def summary(self) -> Dict[str, Any]:
+        """Descripción del índice vigente (para diagnóstico y el frontend)."""
+        self._current()
+        nutrients = self.calc.nutrient_order
+
+        def bound(v):
+            return None if np.isnan(v) or np.isinf(v) else round(float(v), 4)
+
+        return {
+            "fertilizantes": list(self._ferts),
+            "rango": self.rank,
+            "facetas": int(len(self.facets)),
+            "reconstrucciones": self.rebuilds,
+            "construccion_ms": round(self.build_ms, 3),
+            "razones": {
+                f"{nutrients[i]}/{nutrients[j]}": {"min": bound(self.ratio_min[i, j]), "max": bound(self.ratio_max[i, j])}
+                for i, j in itertools.product(range(len(nutrients)), repeat=2)
+                if i != j and not np.isnan(self.ratio_min[i, j])
+            },
+        }
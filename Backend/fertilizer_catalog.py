@@ -0,0 +1,109 @@
+import math
+import threading
+import time
+from typing import Any, Callable, Dict, List
+
+from database import SQLiteDatabase
+
+NUTRIENTS = ["N", "P", "K", "Ca", "Mg", "S", "Fe", "Mn", "Zn", "Cu", "B", "Mo", "Cl", "Na"]
+
+
+class FertilizerCatalog:
+    """
+    Catálogo de fertilizantes en SQLite con versión monótona.
+
+    Guarda en memoria una instantánea {nombre: {nutriente: %, "formula": ...}}
+    (el mismo formato que data/fertilizers.json) y la versión de la que salió.
+    refresh() compara esa versión con la de la base, como mucho una vez cada
+    intervalo_s (las escrituras por este servicio refrescan al momento), y si
+    cambió avisa a los suscriptores: la calculadora rehace su matriz A y el
+    motor químico su matriz de correcciones, sin reiniciar. Los avisos salen
+    bajo el mismo candado que la recarga, así que ningún suscriptor recibe
+    una instantánea más vieja después de una más nueva.
+    """
+
+    def __init__(self, db: SQLiteDatabase, intervalo_s: float = 1.0):
+        self.db = db
+        self.intervalo_s = intervalo_s
+        self.version = -1
+        self.fertilizers: Dict[str, Dict[str, Any]] = {}
+        self._listeners: List[Callable[[Dict[str, Dict[str, Any]]], None]] = []
+        self._lock = threading.RLock()   # reentrante: un suscriptor puede consultar el catálogo
+        self._checked = 0.0
+        self.refresh(force=True)
+
+    def subscribe(self, listener: Callable[[Dict[str, Dict[str, Any]]], None]) -> None:
+        """listener(fertilizantes) en cada cambio de versión (y ahora, con la instantánea actual)."""
+        with self._lock:
+            self._listeners.append(listener)
+            self._notify(listener, self.fertilizers)
+
+    @staticmethod
+    def _notify(listener, fertilizers):
+        try:
+            listener(fertilizers)
+        except Exception as e:
+            print(f"[FertilizerCatalog] Suscriptor rechazó el catálogo: {e}")
+
+    def refresh(self, force: bool = False) -> bool:
+        """Recarga la instantánea si la versión de la base cambió; True si hubo cambio."""
+        now = time.monotonic()
+        if not force and now - self._checked < self.intervalo_s:
+            return False
+        with self._lock:
+            self._checked = now
+            version = self.db.get_fertilizers_version()
+            if version == self.version:
+                return False
+            fertilizers = {
+                f["nombre"]: {**f["composicion"], "formula": f["formula"] or "Sal"}
+                for f in self.db.get_fertilizers()
+            }
+            self.fertilizers, self.version = fertilizers, version
+            for listener in self._listeners:
+                self._notify(listener, fertilizers)
+        return True
+
+    # -------------------------------------------------------------------------
+    # Consultas y escritura
+    # -------------------------------------------------------------------------
+    def search(self, nutriente: str | None = None, minimo: float | None = None,
+               maximo: float | None = None, since: int | None = None) -> List[Dict[str, Any]]:
+        if nutriente is not None and nutriente not in NUTRIENTS:
+            raise ValueError(f"Nutriente desconocido: {nutriente}")
+        return self.db.get_fertilizers(nutriente=nutriente, minimo=minimo, maximo=maximo, since=since)
+
+    @staticmethod
+    def validate(data: Dict[str, Any]) -> tuple:
+        nombre = str(data.get("nombre") or "").strip()
+        if not nombre or len(nombre) > 100:
+            raise ValueError("'nombre' es obligatorio (máx. 100 caracteres).")
+        composicion = data.get("composicion")
+        if not isinstance(composicion, dict) or not composicion:
+            raise ValueError("'composicion' debe ser un dict {nutriente: %} no vacío.")
+
+        clean = {}
+        for nut, pct in composicion.items():
+            if nut not in NUTRIENTS:
+                raise ValueError(f"Nutriente desconocido: {nut}")
+            pct = float(pct)
+            if not math.isfinite(pct) or not 0 <= pct <= 100:
+                raise ValueError(f"Porcentaje de {nut} fuera de rango (0-100): {pct}")
+            clean[nut] = pct
+        if sum(clean.values()) > 100:
+            raise ValueError("La suma de porcentajes supera el 100 %.")
+        formula = data.get("formula")
+        return nombre, (str(formula).strip() or None) if formula else None, clean
+
+    def save(self, data: Dict[str, Any]) -> int:
+        """Crea o reemplaza una sal; sin 'formula' se conserva la que tuviera."""
+        nombre, formula, composicion = self.validate(data)
+        version = self.db.save_fertilizer(nombre, formula, composicion)
+        self.refresh(force=True)
+        return version
+
+    def delete(self, nombre: str) -> int | None:
+        version = self.db.delete_fertilizer(nombre)
+        if version is not None:
+            self.refresh(force=True)
+        return version
@@ -0,0 +1,333 @@
+import argparse
+import json
+import threading
+import time
+from collections import defaultdict
+from datetime import datetime, timedelta
+from typing import Any, Callable, Dict, List, Tuple
+
+from database import SQLiteDatabase
+
+
+class HistoryRetentionService:
+    """
+    Política de retención del historial de recetas.
+
+      - Las filas crudas se conservan 'dias_crudos' días.
+      - Las más antiguas se resumen en agregados diarios y semanales por
+        perfil (history_rollups) y se borran, en lotes acotados: cada lote
+        es una transacción corta, así que los INSERT de /api/calculate_doses
+        nunca esperan más que un lote.
+      - Los agregados diarios se conservan 'dias_diarios' días; los semanales
+        se guardan siempre (ya contienen esos días, no hay doble conteo).
+      - El espacio liberado se devuelve al sistema con PRAGMA incremental_vacuum,
+        también por tramos de páginas. Requiere auto_vacuum=INCREMENTAL: las
+        bases nuevas ya nacen así; una base antigua se convierte sin servicio
+        corriendo (python history_retention.py --vacuum), porque el VACUUM
+        completo bloquea la base entera.
+
+    Se ejecuta en un hilo en segundo plano cada 'intervalo_s' segundos, o a
+    demanda con run_once().
+    """
+
+    def __init__(
+        self,
+        db: SQLiteDatabase,
+        dias_crudos: int = 90,
+        dias_diarios: int = 365,
+        tamano_lote: int = 500,
+        pausa_lote_s: float = 0.05,
+        paginas_vacuum: int = 1000,
+        intervalo_s: float = 3600.0,
+        on_deleted: Callable[[List[int]], None] | None = None,
+    ):
+        if dias_crudos < 0 or dias_diarios < 0 or tamano_lote <= 0:
+            raise ValueError("Parámetros de retención inválidos.")
+        self.db = db
+        self.dias_crudos = dias_crudos
+        self.dias_diarios = dias_diarios
+        self.tamano_lote = tamano_lote
+        self.pausa_lote_s = pausa_lote_s
+        self.paginas_vacuum = paginas_vacuum
+        self.intervalo_s = intervalo_s
+        self.on_deleted = on_deleted     # p. ej. quitar las recetas del índice de similitud
+
+        self._stop = threading.Event()
+        self._run_lock = threading.Lock()
+        self._thread: threading.Thread | None = None
+        self.last_run: Dict[str, Any] | None = None
+        self.vacuum_incremental: bool | None = None
+
+    # -------------------------------------------------------------------------
+    # Ciclo en segundo plano
+    # -------------------------------------------------------------------------
+    def start(self):
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._loop, name="history-retention", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread:
+            self._thread.join()
+
+    def _loop(self):
+        try:
+            if not self.ensure_incremental_vacuum():
+                print(f"[HistoryRetention] {self.db.db_path} no tiene auto_vacuum incremental: el espacio "
+                      "liberado no se devuelve al sistema hasta ejecutar, con el servicio parado, "
+                      "'python history_retention.py --vacuum'.")
+        except Exception as e:
+            print(f"[HistoryRetention] No se pudo comprobar auto_vacuum: {e}")
+        while not self._stop.is_set():
+            try:
+                self.run_once()
+            except Exception as e:
+                print(f"[HistoryRetention] Error en la retención: {e}")
+            self._stop.wait(self.intervalo_s)
+
+    def status(self) -> Dict[str, Any]:
+        return {
+            "activo": bool(self._thread and self._thread.is_alive()),
+            "dias_crudos": self.dias_crudos,
+            "dias_diarios": self.dias_diarios,
+            "tamano_lote": self.tamano_lote,
+            "intervalo_s": self.intervalo_s,
+            "vacuum_incremental": self.vacuum_incremental,
+            "ultima_ejecucion": self.last_run,
+        }
+
+    # -------------------------------------------------------------------------
+    # Vacuum incremental
+    # -------------------------------------------------------------------------
+    def ensure_incremental_vacuum(self, vacuum_completo: bool = False) -> bool:
+        """
+        True si la base está en auto_vacuum=INCREMENTAL. En una base ya creada
+        el cambio solo surte efecto tras un VACUUM completo, que reescribe el
+        archivo con un bloqueo exclusivo: solo se hace con vacuum_completo=True
+        (mantenimiento sin servicio, ver __main__), nunca desde el hilo.
+        """
+        conn = self.db._get_connection()
+        try:
+            (mode,) = conn.execute("PRAGMA auto_vacuum").fetchone()
+            if mode != 2 and vacuum_completo:
+                conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+                conn.execute("VACUUM")
+                (mode,) = conn.execute("PRAGMA auto_vacuum").fetchone()
+        finally:
+            conn.close()
+        self.vacuum_incremental = mode == 2
+        return self.vacuum_incremental
+
+    def _incremental_vacuum(self) -> int:
+        """Libera como mucho 'paginas_vacuum' páginas por tramo; devuelve las liberadas."""
+        freed = 0
+        conn = self.db._get_connection()
+        try:
+            while not self._stop.is_set():
+                (free_pages,) = conn.execute("PRAGMA freelist_count").fetchone()
+                if free_pages == 0:
+                    break
+                step = min(free_pages, self.paginas_vacuum)
+                conn.execute(f"PRAGMA incremental_vacuum({int(step)})").fetchall()
+                (remaining,) = conn.execute("PRAGMA freelist_count").fetchone()
+                if remaining >= free_pages:
+                    break   # auto_vacuum no está en modo incremental
+                freed += free_pages - remaining
+                time.sleep(self.pausa_lote_s)
+        finally:
+            conn.close()
+        return freed
+
+    # -------------------------------------------------------------------------
+    # Agregación y borrado por lotes
+    # -------------------------------------------------------------------------
+    @staticmethod
+    def _periods(timestamp: str) -> Tuple[str, str]:
+        """Día (YYYY-MM-DD) y semana (lunes ISO, YYYY-MM-DD) de una marca de tiempo."""
+        day = datetime.fromisoformat(timestamp).date()
+        monday = day - timedelta(days=day.weekday())
+        return day.isoformat(), monday.isoformat()
+
+    def _aggregate(self, rows: List[Tuple]) -> Dict[Tuple[str, str, str], Dict[str, Any]]:
+        groups: Dict[Tuple[str, str, str], Dict[str, Any]] = {}
+        for _, timestamp, volumen_L, perfil, ec, dosis_json in rows:
+            try:
+                dosis = json.loads(dosis_json)
+            except (TypeError, ValueError):
+                dosis = []
+            day, week = self._periods(timestamp)
+            for key in (("dia", perfil, day), ("semana", perfil, week)):
+                agg = groups.get(key)
+                if agg is None:
+                    agg = groups[key] = {
+                        "n": 0, "volumen_total_L": 0.0, "ec_suma": 0.0,
+                        "ec_min": float("inf"), "ec_max": float("-inf"),
+                        "dosis": defaultdict(float),
+                    }
+                agg["n"] += 1
+                agg["volumen_total_L"] += float(volumen_L)
+                agg["ec_suma"] += float(ec)
+                agg["ec_min"] = min(agg["ec_min"], float(ec))
+                agg["ec_max"] = max(agg["ec_max"], float(ec))
+                for d in dosis:
+                    agg["dosis"][d.get("nombre", "?")] += float(d.get("dosis_gramos", 0))
+        return groups
+
+    def _merge_and_store(self, cursor, groups: Dict[Tuple[str, str, str], Dict[str, Any]]):
+        for (gran, perfil, periodo), agg in groups.items():
+            existing = cursor.execute(
+                "SELECT n, volumen_total_L, ec_suma, ec_min, ec_max, dosis_gramos_json FROM history_rollups "
+                "WHERE granularidad = ? AND perfil_usado = ? AND periodo = ?",
+                (gran, perfil, periodo),
+            ).fetchone()
+            if existing:
+                agg["n"] += existing[0]
+                agg["volumen_total_L"] += existing[1]
+                agg["ec_suma"] += existing[2]
+                agg["ec_min"] = min(agg["ec_min"], existing[3])
+                agg["ec_max"] = max(agg["ec_max"], existing[4])
+                for fert, g in json.loads(existing[5]).items():
+                    agg["dosis"][fert] += g
+
+            cursor.execute(
+                "INSERT OR REPLACE INTO history_rollups "
+                "(granularidad, perfil_usado, periodo, n, volumen_total_L, ec_suma, ec_min, ec_max, dosis_gramos_json) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (gran, perfil, periodo, agg["n"], agg["volumen_total_L"], agg["ec_suma"],
+                 agg["ec_min"], agg["ec_max"],
+                 json.dumps({f: round(g, 3) for f, g in agg["dosis"].items()})),
+            )
+
+    def _roll_raw_batch(self, cutoff: str) -> List[int]:
+        """Resume y borra un lote de filas crudas anteriores a 'cutoff'; devuelve sus ids."""
+        conn = self.db._get_connection()
+        try:
+            cursor = conn.cursor()
+            cursor.execute("BEGIN IMMEDIATE")
+            rows = cursor.execute(
+                "SELECT id, timestamp, volumen_L, perfil_usado, ec_final, dosis_json FROM history "
+                "WHERE timestamp < ? ORDER BY timestamp LIMIT ?",
+                (cutoff, self.tamano_lote),
+            ).fetchall()
+            if not rows:
+                conn.rollback()
+                return []
+
+            self._merge_and_store(cursor, self._aggregate(rows))
+            ids = [r[0] for r in rows]
+            cursor.executemany("DELETE FROM history WHERE id = ?", [(i,) for i in ids])
+            conn.commit()
+            return ids
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            conn.close()
+
+    def _prune_daily_batch(self, cutoff_day: str) -> int:
+        conn = self.db._get_connection()
+        try:
+            cursor = conn.execute(
+                "DELETE FROM history_rollups WHERE rowid IN ("
+                "  SELECT rowid FROM history_rollups WHERE granularidad = 'dia' AND periodo < ? LIMIT ?)",
+                (cutoff_day, self.tamano_lote),
+            )
+            conn.commit()
+            return cursor.rowcount
+        finally:
+            conn.close()
+
+    def run_once(self, now: datetime | None = None) -> Dict[str, Any]:
+        """Una pasada completa de retención; devuelve estadísticas."""
+        if not self._run_lock.acquire(blocking=False):
+            return {"omitido": "retención ya en curso"}
+        try:
+            t0 = time.perf_counter()
+            now = now or datetime.now()
+            raw_cutoff = (now - timedelta(days=self.dias_crudos)).isoformat()
+            daily_cutoff = (now.date() - timedelta(days=self.dias_diarios)).isoformat()
+
+            rolled, batches = 0, 0
+            while not self._stop.is_set():
+                ids = self._roll_raw_batch(raw_cutoff)
+                if not ids:
+                    break
+                rolled += len(ids)
+                batches += 1
+                if self.on_deleted:
+                    self.on_deleted(ids)
+                time.sleep(self.pausa_lote_s)   # deja pasar a los escritores entre lotes
+
+            pruned = 0
+            while not self._stop.is_set():
+                n = self._prune_daily_batch(daily_cutoff)
+                pruned += n
+                if n < self.tamano_lote:
+                    break
+                time.sleep(self.pausa_lote_s)
+
+            freed = self._incremental_vacuum()
+
+            self.last_run = {
+                "fecha": now.isoformat(),
+                "filas_resumidas": rolled,
+                "lotes": batches,
+                "agregados_diarios_borrados": pruned,
+                "paginas_liberadas": freed,
+                "duracion_s": round(time.perf_counter() - t0, 3),
+            }
+            return self.last_run
+        finally:
+            self._run_lock.release()
+
+    def rollups(self, granularidad: str = "dia", perfil: str | None = None,
+                desde: str | None = None, hasta: str | None = None) -> List[Dict[str, Any]]:
+        """Lee agregados (con la EC media ya calculada)."""
+        if granularidad not in ("dia", "semana"):
+            raise ValueError("granularidad debe ser 'dia' o 'semana'.")
+        where, params = ["granularidad = ?"], [granularidad]
+        if perfil:
+            where.append("perfil_usado = ?")
+            params.append(perfil)
+        if desde:
+            where.append("periodo >= ?")
+            params.append(desde)
+        if hasta:
+            where.append("periodo <= ?")
+            params.append(hasta)
+
+        conn = self.db._get_connection()
+        rows = conn.execute(
+            "SELECT perfil_usado, periodo, n, volumen_total_L, ec_suma, ec_min, ec_max, dosis_gramos_json "
+            f"FROM history_rollups WHERE {' AND '.join(where)} ORDER BY periodo, perfil_usado",
+            params,
+        ).fetchall()
+        conn.close()
+
+        return [
+            {
+                "perfil_usado": r[0], "periodo": r[1], "n": r[2],
+                "volumen_total_L": round(r[3], 2),
+                "ec_media": round(r[4] / r[2], 3) if r[2] else None,
+                "ec_min": r[5], "ec_max": r[6],
+                "dosis_gramos": json.loads(r[7]),
+            }
+            for r in rows
+        ]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Mantenimiento del historial de HydroSynapse (sin servicio corriendo)")
+    parser.add_argument("db", nargs="?", default="hidrosynapse.db", help="base SQLite (relativa a Backend/)")
+    parser.add_argument("--vacuum", action="store_true",
+                        help="pasar a auto_vacuum=INCREMENTAL con un VACUUM completo (bloquea la base)")
+    args = parser.parse_args()
+
+    service = HistoryRetentionService(SQLiteDatabase(args.db))
+    if args.vacuum:
+        service.ensure_incremental_vacuum(vacuum_completo=True)
+    print(json.dumps(service.run_once(), ensure_ascii=False, indent=2))
+    print("auto_vacuum incremental:", "sí" if service.ensure_incremental_vacuum() else "no")
@@ -0,0 +1,310 @@
+import json
+import numpy as np
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Tuple
+
+from database import SQLiteDatabase
+
+# Segundos desde 1970 a partir de un texto ISO, calculado dentro de SQLite. Los
+# timestamps del historial son hora local sin zona: se tratan como "hora de
+# pared" en UTC en ambos lados (SQL y Python) para que los buckets coincidan.
+EPOCH_SQL = "(julianday({col}) - 2440587.5) * 86400.0"
+
+
+def _epoch(iso: str) -> float:
+    return (datetime.fromisoformat(iso) - datetime(1970, 1, 1)).total_seconds()
+
+
+def lttb(t: np.ndarray, y: np.ndarray, n_out: int) -> np.ndarray:
+    """
+    Largest-Triangle-Three-Buckets: índices de n_out puntos que conservan la
+    forma de la serie (picos y valles) mejor que un muestreo uniforme.
+    Conserva siempre el primer y el último punto.
+    """
+    n = len(t)
+    if n_out >= n or n_out < 3:
+        return np.arange(n) if n_out >= n else np.linspace(0, n - 1, max(n_out, 1)).astype(int)
+
+    edges = np.linspace(1, n - 1, n_out - 1).astype(int)   # n_out - 2 buckets interiores
+    selected = np.empty(n_out, dtype=int)
+    selected[0], selected[-1] = 0, n - 1
+    a = 0
+    for i in range(n_out - 2):
+        lo, hi = edges[i], edges[i + 1]
+        # Vértice C: promedio del bucket siguiente (o el último punto)
+        nlo, nhi = edges[i + 1], (edges[i + 2] if i + 2 < len(edges) else n)
+        cx, cy = t[nlo:nhi].mean(), y[nlo:nhi].mean()
+        # Área del triángulo (A, B, C) para cada candidato B del bucket
+        bx, by = t[lo:hi], y[lo:hi]
+        area = np.abs((t[a] - cx) * (by - y[a]) - (t[a] - bx) * (cy - y[a]))
+        a = lo + int(area.argmax())
+        selected[i + 1] = a
+    return selected
+
+
+class HistorySeriesService:
+    """
+    Series de tiempo del historial para las gráficas (EC, volumen, gramos por sal).
+
+    Lee los rangos por los índices de history (timestamp / perfil+timestamp) y,
+    para los periodos ya resumidos por la retención, de history_rollups. Nunca
+    devuelve más de 'max_puntos' por serie:
+      - 'lttb':   Largest-Triangle-Three-Buckets sobre los puntos crudos.
+      - 'minmax': mínimo y máximo por bucket de tiempo (vectorizado, O(n)).
+      - 'auto':   lttb si el rango tiene pocas filas, minmax si no.
+
+    Todas las métricas pedidas salen de una única consulta sobre el rango.
+    """
+
+    BASE_METRICS = {"ec": "ec_final", "volumen": "volumen_L"}
+    ROLLUP_METRICS = {"ec": "ec_suma / n", "volumen": "volumen_total_L / n"}
+
+    def __init__(self, db: SQLiteDatabase, fertilizers: List[str], lttb_max_filas: int = 100_000):
+        self.db = db
+        self.fertilizers = list(fertilizers)
+        self.lttb_max_filas = lttb_max_filas
+
+    # -------------------------------------------------------------------------
+    # Expresiones SQL por métrica
+    # -------------------------------------------------------------------------
+    def _raw_expr(self, metric: str) -> Tuple[str, List[Any]]:
+        if metric in self.BASE_METRICS:
+            return self.BASE_METRICS[metric], []
+        if metric in self.fertilizers:
+            return (
+                "(SELECT json_extract(j.value, '$.dosis_gramos') FROM json_each(history.dosis_json) j "
+                "WHERE json_extract(j.value, '$.nombre') = ?)",
+                [metric],
+            )
+        raise ValueError(f"Métrica desconocida: {metric}")
+
+    def _rollup_expr(self, metric: str) -> Tuple[str, List[Any]]:
+        if metric in self.ROLLUP_METRICS:
+            return self.ROLLUP_METRICS[metric], []
+        if metric in self.fertilizers:
+            return "json_extract(dosis_gramos_json, '$.' || ?) / n", [metric]
+        raise ValueError(f"Métrica desconocida: {metric}")
+
+    # -------------------------------------------------------------------------
+    # Lectura
+    # -------------------------------------------------------------------------
+    def _raw_filter(self, desde: str, hasta: str, perfil: str | None) -> Tuple[str, List[Any]]:
+        where, params = "timestamp >= ? AND timestamp < ?", [desde, hasta]
+        if perfil:
+            where = "perfil_usado = ? AND " + where
+            params = [perfil] + params
+        return where, params
+
+    def _raw_matrix(self, conn, metrics: List[str], desde: str, hasta: str, perfil: str | None):
+        """Una sola pasada por el índice: tiempos (n,) y valores (n, métricas)."""
+        exprs, expr_params = [], []
+        for metric in metrics:
+            expr, p = self._raw_expr(metric)
+            exprs.append(expr)
+            expr_params += p
+        where, params = self._raw_filter(desde, hasta, perfil)
+        rows = conn.execute(
+            f"SELECT {EPOCH_SQL.format(col='timestamp')}, {', '.join(exprs)} FROM history "
+            f"WHERE {where} ORDER BY timestamp",
+            (*expr_params, *params),
+        ).fetchall()
+        data = np.array(rows, dtype=float).reshape(-1, len(metrics) + 1)
+        return data[:, 0], data[:, 1:]
+
+    @staticmethod
+    def _minmax(t: np.ndarray, y: np.ndarray, t0: float, width: float):
+        """Mínimo y máximo de cada bucket de tiempo, conservando el instante de cada extremo."""
+        valid = ~np.isnan(y)
+        t, y = t[valid], y[valid]
+        if len(t) == 0:
+            return t, y
+        bucket = ((t - t0) // width).astype(np.int64)
+        starts = np.flatnonzero(np.r_[True, bucket[1:] != bucket[:-1]])
+        counts = np.diff(np.r_[starts, len(t)])
+        owner = np.repeat(np.arange(len(starts)), counts)
+
+        mins = np.minimum.reduceat(y, starts)
+        maxs = np.maximum.reduceat(y, starts)
+        # Primera posición de cada bucket que alcanza su mínimo / máximo
+        is_min = np.flatnonzero(y == mins[owner])
+        is_max = np.flatnonzero(y == maxs[owner])
+        first_min = is_min[np.r_[True, owner[is_min][1:] != owner[is_min][:-1]]]
+        first_max = is_max[np.r_[True, owner[is_max][1:] != owner[is_max][:-1]]]
+
+        idx = np.unique(np.concatenate([first_min, first_max]))
+        return t[idx], y[idx]
+
+    def _rollup_points(self, conn, metric: str, granularidad: str, desde: str, hasta: str,
+                       perfil: str | None):
+        """Puntos de los agregados: la media del periodo, fechada al mediodía (o a media semana)."""
+        expr, expr_params = self._rollup_expr(metric)
+        where = "granularidad = ? AND periodo >= ? AND periodo < ?"
+        params: List[Any] = [granularidad, desde, hasta]
+        if perfil:
+            where += " AND perfil_usado = ?"
+            params.append(perfil)
+        offset_h = 12 if granularidad == "dia" else 84
+        # Varios perfiles en el mismo periodo: media ponderada por número de recetas
+        rows = conn.execute(
+            f"SELECT {EPOCH_SQL.format(col='periodo')} + ?, SUM(({expr}) * n) / SUM(n) "
+            f"FROM history_rollups WHERE {where} GROUP BY periodo ORDER BY periodo",
+            (offset_h * 3600, *expr_params, *params),
+        ).fetchall()
+        data = np.array(rows, dtype=float).reshape(-1, 2)
+        data = data[~np.isnan(data[:, 1])]
+        return data[:, 0], data[:, 1]
+
+    @staticmethod
+    def _monday(day: str, up: bool = False) -> str:
+        """Lunes de la semana de 'day' (o el siguiente, con up=True, si no es lunes)."""
+        d = datetime.fromisoformat(day[:10]).date()
+        shift = -d.weekday() % 7 if up else -d.weekday()
+        return (d + timedelta(days=shift)).isoformat()
+
+    def _rollup_ranges(self, conn, desde: str, hasta: str) -> List[Tuple[str, str, str]]:
+        """
+        Tramos [lo, hi) de 'periodo' que se leen de cada granularidad.
+
+        Los agregados solo contienen filas ya borradas de history, así que no
+        se solapan con las crudas; lo que hay que evitar es contar un mismo
+        día en su semana y en su agregado diario. Los diarios están completos
+        desde el primero que queda (la poda borra días enteros), así que las
+        semanas se usan solo enteras y antes de ese día: se corta en el lunes
+        siguiente al primer diario (o en el de la semana de 'hasta') y desde
+        ahí siguen los diarios. Comparar el periodo con 'hasta' como texto
+        incluye el día de 'hasta' si este trae hora.
+        """
+        (first_daily,) = conn.execute(
+            "SELECT MIN(periodo) FROM history_rollups WHERE granularidad = 'dia'"
+        ).fetchone()
+        desde_dia = desde[:10]
+        if first_daily is not None and desde_dia >= first_daily:
+            return [("dia", desde_dia, hasta)]
+        corte = self._monday(hasta)
+        if first_daily is None:
+            return [("semana", desde_dia, corte)]
+        corte = min(corte, self._monday(first_daily, up=True))
+        return [("semana", desde_dia, corte), ("dia", max(corte, first_daily), hasta)]
+
+    # -------------------------------------------------------------------------
+    # API
+    # -------------------------------------------------------------------------
+    def series(
+        self,
+        metricas: List[str] | None = None,
+        desde: str | None = None,
+        hasta: str | None = None,
+        perfil: str | None = None,
+        max_puntos: int = 500,
+        metodo: str = "auto",
+        as_arrays: bool = False,
+    ) -> Dict[str, Any]:
+        """
+        Devuelve {"series": {metrica: {"t": [ms epoch], "y": [...]}}, ...}
+        con a lo sumo max_puntos por serie en el rango [desde, hasta).
+        Con as_arrays=True, "t" e "y" quedan como arrays numpy (formato columnar).
+        """
+        metricas = metricas or ["ec"]
+        if metodo not in ("auto", "lttb", "minmax"):
+            raise ValueError("metodo debe ser 'auto', 'lttb' o 'minmax'.")
+        max_puntos = max(3, min(int(max_puntos), 10_000))
+        hasta = hasta or (datetime.now() + timedelta(seconds=1)).isoformat()
+        desde = desde or (datetime.fromisoformat(hasta) - timedelta(days=90)).isoformat()
+        if desde >= hasta:
+            raise ValueError("'desde' debe ser anterior a 'hasta'.")
+
+        conn = self.db._get_connection()
+        try:
+            where, params = self._raw_filter(desde, hasta, perfil)
+            (n_raw,) = conn.execute(f"SELECT COUNT(*) FROM history WHERE {where}", params).fetchone()
+            if metodo == "auto":
+                metodo = "lttb" if n_raw <= self.lttb_max_filas else "minmax"
+
+            # Lo ya resumido por la retención solo existe en los agregados
+            ranges = self._rollup_ranges(conn, desde, hasta)
+
+            t_raw, y_raw = self._raw_matrix(conn, metricas, desde, hasta, perfil)
+            t0 = _epoch(desde)
+            width = max((_epoch(hasta) - t0) / max(1, max_puntos // 2), 1e-3)
+
+            series = {}
+            for k, metric in enumerate(metricas):
+                parts = [self._rollup_points(conn, metric, gran, lo, hi, perfil) for gran, lo, hi in ranges]
+                if metodo == "minmax":
+                    tr, yr = self._minmax(t_raw, y_raw[:, k], t0, width)
+                else:
+                    valid = ~np.isnan(y_raw[:, k])
+                    tr, yr = t_raw[valid], y_raw[valid, k]
+
+                t = np.concatenate([*(pt for pt, _ in parts), tr])
+                y = np.concatenate([*(py for _, py in parts), yr])
+                order = np.argsort(t, kind="stable")
+                t, y = t[order], y[order]
+                if len(t) > max_puntos:
+                    idx = lttb(t, y, max_puntos)
+                    t, y = t[idx], y[idx]
+
+                t_ms, y = np.round(t * 1000).astype(np.int64), np.round(y, 4)
+                series[metric] = {"t": t_ms, "y": y} if as_arrays else {"t": t_ms.tolist(), "y": y.tolist()}
+        finally:
+            conn.close()
+
+        return {
+            "desde": desde,
+            "hasta": hasta,
+            "perfil": perfil,
+            "metodo": metodo,
+            "max_puntos": max_puntos,
+            "filas_crudas": n_raw,
+            "series": series,
+        }
+
+    def consumption(self, desde: str | None = None, hasta: str | None = None,
+                    perfil: str | None = None) -> Dict[str, Any]:
+        """
+        Gramos de cada fertilizante, recetas y litros en [desde, hasta):
+        filas crudas más los agregados de los periodos ya resumidos (mismo
+        criterio de solape que series()).
+        """
+        hasta = hasta or (datetime.now() + timedelta(seconds=1)).isoformat()
+        desde = desde or "0000-01-01"
+        if desde >= hasta:
+            raise ValueError("'desde' debe ser anterior a 'hasta'.")
+
+        grams: Dict[str, float] = {}
+        conn = self.db._get_connection()
+        try:
+            where, params = self._raw_filter(desde, hasta, perfil)
+            n, litros = conn.execute(
+                f"SELECT COUNT(*), COALESCE(SUM(volumen_L), 0) FROM history WHERE {where}", params
+            ).fetchone()
+            for nombre, g in conn.execute(
+                "SELECT json_extract(j.value, '$.nombre'), SUM(json_extract(j.value, '$.dosis_gramos')) "
+                f"FROM history, json_each(history.dosis_json) j WHERE {where} GROUP BY 1",
+                params,
+            ):
+                grams[nombre] = grams.get(nombre, 0.0) + (g or 0.0)
+
+            for gran, lo, hi in self._rollup_ranges(conn, desde, hasta):
+                sql = ("SELECT n, volumen_total_L, dosis_gramos_json FROM history_rollups "
+                       "WHERE granularidad = ? AND periodo >= ? AND periodo < ?")
+                args: List[Any] = [gran, lo, hi]
+                if perfil:
+                    sql += " AND perfil_usado = ?"
+                    args.append(perfil)
+                for rn, rl, dosis in conn.execute(sql, args):
+                    n += rn
+                    litros += rl
+                    for nombre, g in json.loads(dosis).items():
+                        grams[nombre] = grams.get(nombre, 0.0) + g
+        finally:
+            conn.close()
+
+        return {
+            "desde": desde,
+            "hasta": hasta,
+            "perfil": perfil,
+            "recetas": n,
+            "volumen_L": round(litros, 2),
+            "dosis_gramos": {k: round(v, 2) for k, v in sorted(grams.items())},
+        }
@@ -1,7 +1,12 @@
 # main.py
-from flask import Flask, jsonify, request
-from database import SQLiteDatabase
-from calculator import NutrientCalculatorService
+from flask import Flask, Response, jsonify, request, stream_with_context
+from dosing_controller import DRIVERS, DosingController
+from admission_control import AdmissionController
+from bootstrap import BootstrapService
+from profile_bulk import detect_format
+from warm_cache import WarmCache
+from sites import DEFAULT_SITE, SiteRegistry, merge_consumption, merge_rollups
+import columnar
 from models import DoseResult, FertilizerDose
 import json
 from datetime import datetime
@@ -22,19 +27,87 @@ app = Flask(__name__)
 # ---------------------------------------------------------------------------------------
 # 🧱 INICIALIZACIÓN DE SERVICIOS
 # ---------------------------------------------------------------------------------------
-db_manager = SQLiteDatabase()
+# Control de admisión: límites por ruta y clase de prioridad (data/admission.json)
+admission = AdmissionController()
+admission.init_app(app)
 
-try:
-    available_profiles = db_manager.get_all_profiles()
-except Exception as e:
-    print(f"Error cargando perfiles iniciales: {e}")
-    available_profiles = []
+# Caché en disco de artefactos compilados (hidrosynapse.cache, junto a la base)
+warm_cache = WarmCache()
+
+# Sitios: una base SQLite por invernadero (cabecera X-Site o ?site=). Cada sitio
+# trae su calculadora (Ax = b), índices de similitud, retención del historial,
+# series reducidas, concentrados A/B e importación masiva de perfiles.
+sites = SiteRegistry(cache=warm_cache)
+sites.init_app(app)
+default_site = sites.get(DEFAULT_SITE)
+
+# Alias del sitio por defecto (hidrosynapse.db): controlador, agua y motor químico
+db_manager = default_site.db
+calc_service = default_site.calc
 
-# Tu calculadora estequiométrica de nutrientes (Ax = b)
-calc_service = NutrientCalculatorService(external_profiles=available_profiles)
+# Controlador de dosificación en lazo cerrado (driver simulado por defecto)
+dosing_controller = DosingController(calc_service, DRIVERS["simulado"](calc_service))
 
 # Instancia del motor químico de alto nivel
-chem_engine = ChemicalEngine() if MOTOR_QUIMICO and ChemicalEngine is not None else None
+chem_engine = ChemicalEngine(cache=warm_cache) if MOTOR_QUIMICO and ChemicalEngine is not None else None
+
+# El motor químico sigue el catálogo de fertilizantes del sitio por defecto
+if chem_engine is not None:
+    default_site.catalog.subscribe(chem_engine.set_fertilizers)
+
+# Payload de arranque de la interfaz (perfiles, fertilizantes, síntomas), ya
+# serializado por sitio y con ETag; los cambios se avisan por SSE
+bootstrap = BootstrapService(chem_engine)
+
+# Tras un arranque en frío, lo recién compilado queda en disco para el próximo
+warm_cache.flush()
+
+
+# ---------------------------------------------------------------------------------------
+# 🚀 ARRANQUE DE LA INTERFAZ: PAYLOAD ÚNICO CON ETAG + AVISOS SSE
+# ---------------------------------------------------------------------------------------
+@app.route("/api/bootstrap", methods=["GET"])
+def bootstrap_endpoint():
+    """Perfiles, fertilizantes, calculadora y síntomas en una respuesta; If-None-Match → 304."""
+    site = sites.current()
+    try:
+        snapshot = bootstrap.get(site)
+    except Exception as e:
+        return jsonify({"success": False, "error": str(e)}), 500
+
+    # ETag débil: la versión gzip y la plana son el mismo contenido
+    if request.if_none_match.contains_weak(snapshot["etag"]):
+        response = Response(status=304)
+    elif snapshot["gzip"] is not None and request.accept_encodings["gzip"]:
+        response = Response(snapshot["gzip"], mimetype="application/json")
+        response.headers["Content-Encoding"] = "gzip"
+    else:
+        response = Response(snapshot["body"], mimetype="application/json")
+    response.set_etag(snapshot["etag"], weak=True)
+    response.headers["Cache-Control"] = "no-cache"
+    response.headers["Vary"] = "Accept-Encoding, X-Site"
+    return response
+
+
+@app.route("/api/bootstrap/events", methods=["GET"])
+def bootstrap_events_endpoint():
+    """Server-Sent Events: 'bootstrap' con las versiones por fuente al conectar y en cada cambio."""
+    site = sites.current()
+    if not bootstrap.subscribe():
+        return jsonify({"success": False, "error": "Demasiados suscriptores de eventos", "retry_after": 5}), 429
+
+    # Sin stream_with_context: el contexto de la petición (y su hueco de
+    # admisión) se libera al devolver; el flujo solo espera cambios
+    response = Response(bootstrap.events(site), mimetype="text/event-stream")
+    response.call_on_close(bootstrap.unsubscribe)
+    response.headers["Cache-Control"] = "no-cache"
+    response.headers["X-Accel-Buffering"] = "no"
+    return response
+
+
+@app.route("/api/bootstrap/status", methods=["GET"])
+def bootstrap_status_endpoint():
+    return jsonify({"success": True, **bootstrap.status()})
 
 
 # ---------------------------------------------------------------------------------------
@@ -42,24 +115,37 @@ chem_engine = ChemicalEngine() if MOTOR_QUIMICO and ChemicalEngine is not None e
 # ---------------------------------------------------------------------------------------
 @app.route("/api/calculate_doses", methods=["POST"])
 def calculate_doses_endpoint():
+    site = sites.current()
     data = request.json or {}
     volumen = data.get("volumen_tanque")
     perfil = data.get("perfil_seleccionado")
+    incertidumbre = data.get("incertidumbre")   # opcional: modo Monte Carlo
+    agua = data.get("agua")                     # opcional: alcalinidad / ácido inyectado
 
     try:
-        resultado = calc_service.calculate(volumen, perfil)
+        if incertidumbre is not None:
+            incertidumbre = site.calc.validate_uncertainty(incertidumbre)
+    except ValueError as e:
+        error = DoseResult(exito=False, mensaje=str(e), dosis=[], ec_estimada=0.0, ph_estimado=0.0, analisis_final={})
+        return jsonify(error.dict()), 400
+
+    try:
+        resultado = site.calc.calculate(volumen, perfil, incertidumbre=incertidumbre, agua=agua)
 
         if not resultado.exito:
             return jsonify(resultado.dict()), 500
 
         # Guardar en historial
         dosis_json = json.dumps([d.dict() for d in resultado.dosis])
-        db_manager.save_new_recipe_history(
+        history_id = site.db.save_new_recipe_history(
             volumen_L=volumen,
             perfil_usado=perfil,
             ec_final=resultado.ec_estimada,
             dosis_json=dosis_json
         )
+        site.similarity.on_recipe_recorded(
+            history_id, datetime.now().isoformat(), float(volumen), perfil, resultado.ec_estimada, dosis_json
+        )
 
         return jsonify(resultado.dict())
 
@@ -75,20 +161,360 @@ def calculate_doses_endpoint():
         return jsonify(error.dict()), 500
 
 
+# ---------------------------------------------------------------------------------------
+# ⚖️ DOSIS DISCRETAS (RESOLUCIÓN DE BÁSCULA Y SACOS ENTEROS)
+# ---------------------------------------------------------------------------------------
+@app.route("/api/calculate_doses/discrete", methods=["POST"])
+def discrete_doses_endpoint():
+    """
+    Una receta: {volumen_tanque, perfil_seleccionado | objetivo, resolucion_g?,
+    incrementos_g?, max_unidades?, pesos?, limite_ms?}; o un lote: {"recetas": [...]}
+    (los campos de fuera de 'recetas' valen como valores por defecto).
+    """
+    site = sites.current()
+    data = request.json or {}
+    defaults = {
+        k: data[k] for k in ("resolucion_g", "incrementos_g", "max_unidades", "pesos", "limite_ms")
+        if data.get(k) is not None
+    }
+
+    try:
+        if data.get("recetas") is not None:
+            resultados = site.discrete.solve_many(data["recetas"], **defaults)
+            return jsonify({"success": True, "resultados": resultados})
+
+        objetivo = data.get("objetivo") or data.get("perfil_seleccionado")
+        if data.get("volumen_tanque") is None or not objetivo:
+            return jsonify({"success": False, "error": "Faltan 'volumen_tanque' y 'perfil_seleccionado' u 'objetivo'"}), 400
+        return jsonify(site.discrete.solve(data["volumen_tanque"], objetivo, **defaults))
+    except (TypeError, ValueError) as e:
+        return jsonify({"success": False, "error": str(e)}), 400
+    except Exception as e:
+        return jsonify({"success": False, "error": str(e)}), 500
+
+
+# ---------------------------------------------------------------------------------------
+# 🧭 FACTIBILIDAD: ¿EL PERFIL ES ALCANZABLE CON EL CATÁLOGO?
+# ---------------------------------------------------------------------------------------
+@app.route("/api/feasibility", methods=["GET"])
+def feasibility_summary_endpoint():
+    site = sites.current()
+    return jsonify({"success": True, **site.calc.feasibility.summary()})
+
+
+@app.route("/api/feasibility", methods=["POST"])
+def feasibility_check_endpoint():
+    """Cuerpo: {"perfil": nombre} | {"objetivo": {N,P,K,Ca,Mg}} | {"perfiles": [nombre | objetivo, ...]}."""
+    site = sites.current()
+    data = request.json or {}
+    consultas = data.get("perfiles") or [data.get("perfil") or data.get("objetivo")]
+
+    if not consultas or consultas[0] is None:
+        return jsonify({"success": False, "error": "Falta 'perfil', 'objetivo' o 'perfiles'"}), 400
+
+    try:
+        resultados = []
+        for consulta in consultas:
+            objetivo = site.calc.get_profile_data(consulta) if isinstance(consulta, str) else consulta
+            b = [float(objetivo.get(nut, 0.0)) for nut in site.calc.nutrient_order]
+            resultados.append({
+                "perfil": consulta if isinstance(consulta, str) else None,
+                **site.calc.feasibility.check(b),
+            })
+        return jsonify({"success": True, "resultados": resultados})
+    except (TypeError, ValueError) as e:
+        return jsonify({"success": False, "error": str(e)}), 400
+    except Exception as e:
+        return jsonify({"success": False, "error": str(e)}), 500
+
+
+# ---------------------------------------------------------------------------------------
+# 📈 ANÁLISIS "WHAT-IF": BARRIDOS DE OBJETIVOS SOBRE UN PERFIL BASE
+# ---------------------------------------------------------------------------------------
+@app.route("/api/what_if", methods=["POST"])
+def what_if_endpoint():
+    site = sites.current()
+    data = request.json or {}
+    volumen = data.get("volumen_tanque")
+    perfil = data.get("perfil_seleccionado")
+    perturbations = data.get("perturbations")   # [{"K": 20}, {"N": -10, "K": 5}, ...]
+    grid = data.get("grid")                     # {"N": {"min": -30, "max": 30, "steps": 7}}
+    agua = data.get("agua")
+
+    if volumen is None or not perfil:
+        return jsonify({"success": False, "error": "Faltan 'volumen_tanque' o 'perfil_seleccionado'"}), 400
+
+    try:
+        dtype = columnar.negotiate(request.accept_mimetypes)   # opt-in: respuesta binaria columnar
+        result = site.calc.sweep(
+            float(volumen), perfil, perturbations=perturbations, grid=grid, agua=agua, as_arrays=dtype is not None
+        )
+        if dtype:
+            return columnar.response(result, dtype)
+        return jsonify(result)
+    except ValueError as e:
+        return jsonify({"success": False, "error": str(e)}), 400
+    except Exception as e:
+        return jsonify({"success": False, "error": str(e)}), 500
+
+
+# ---------------------------------------------------------------------------------------
+# 🛢️ SIMULACIÓN DE AGOTAMIENTO DE TANQUES Y RECARGAS
+# ---------------------------------------------------------------------------------------
+@app.route("/api/simulate_tanks", methods=["POST"])
+def simulate_tanks_endpoint():
+    site = sites.current()
+    data = request.json or {}
+    tanks = data.get("tanques") or []
+    stream = bool(data.get("stream", True))
+
+    if not tanks:
+        return jsonify({"success": False, "error": "Falta lista 'tanques'"}), 400
+
+    try:
+        params = {
+            k: float(data[k])
+            for k in ("horas", "paso_h", "frame_cada_h", "tolerancia", "nivel_minimo", "intervalo_min_h")
+            if data.get(k) is not None
+        }
+        # Formato columnar: frames apilados (frames x tanques) en una sola respuesta
+        dtype = columnar.negotiate(request.accept_mimetypes)
+        if dtype:
+            return columnar.response(site.tank_simulator.run_columnar(tanks, **params), dtype)
+        frames = site.tank_simulator.run(tanks, **params)
+        first = next(frames)   # valida la entrada antes de empezar a transmitir
+    except (KeyError, TypeError, ValueError) as e:
+        return jsonify({"success": False, "error": str(e)}), 400
+    except Exception as e:
+        return jsonify({"success": False, "error": str(e)}), 500
+
+    if not stream:
+        return jsonify({"success": True, "items": [first, *frames]})
+
+    # NDJSON: un frame/evento por línea, para consumir con fetch + ReadableStream
+    def generate():
+        yield json.dumps(first) + "\n"
+        for item in frames:
+            yield json.dumps(item) + "\n"
+
+    return Response(stream_with_context(generate()), mimetype="application/x-ndjson")
+
+
+# ---------------------------------------------------------------------------------------
+# 🧪 CONCENTRADOS A/B MULTI-ZONA
+# ---------------------------------------------------------------------------------------
+@app.route("/api/stock/optimize", methods=["POST"])
+def stock_optimize_endpoint():
+    site = sites.current()
+    data = request.json or {}
+    zonas = data.get("zonas") or []   # [{zona, perfil | objetivo, peso?, volumen_L?}]
+
+    if not zonas:
+        return jsonify({"success": False, "error": "Falta lista 'zonas'"}), 400
+
+    try:
+        params = {
+            k: float(data[k])
+            for k in ("razon_min", "razon_max", "factor_seguridad", "volumen_stock_L")
+            if data.get(k) is not None
+        }
+        return jsonify(site.stock_optimizer.optimize(zonas, **params))
+    except (KeyError, ValueError) as e:
+        return jsonify({"success": False, "error": str(e)}), 400
+    except Exception as e:
+        return jsonify({"success": False, "error": str(e)}), 500
+
+
+# ---------------------------------------------------------------------------------------
+# 🗄️ HISTORIAL: RETENCIÓN Y AGREGADOS
+# ---------------------------------------------------------------------------------------
+@app.route("/api/history/retention", methods=["GET"])
+def retention_status_endpoint():
+    site = sites.current()
+    return jsonify({"success": True, **site.retention.status()})
+
+
+@app.route("/api/history/retention/run", methods=["POST"])
+def retention_run_endpoint():
+    site = sites.current()
+    try:
+        stats = site.retention.run_once()
+        return jsonify({"success": True, "resultado": stats})
+    except Exception as e:
+        return jsonify({"success": False, "error": str(e)}), 500
+
+
+@app.route("/api/history/series", methods=["GET"])
+def history_series_endpoint():
+    site = sites.current()
+    args = request.args
+    metricas = [m for m in args.get("metricas", "ec").split(",") if m]   # ec, volumen, <fertilizante>
+    try:
+        dtype = columnar.negotiate(request.accept_mimetypes)
+        result = site.series.series(
+            metricas=metricas,
+            desde=args.get("desde"),
+            hasta=args.get("hasta"),
+            perfil=args.get("perfil"),
+            max_puntos=int(args.get("max_puntos", 500)),
+            metodo=args.get("metodo", "auto"),
+            as_arrays=dtype is not None,
+        )
+        if dtype:
+            return columnar.response({"success": True, **result}, dtype)
+        return jsonify({"success": True, **result})
+    except ValueError as e:
+        return jsonify({"success": False, "error": str(e)}), 400
+    except Exception as e:
+        return jsonify({"success": False, "error": str(e)}), 500
+
+
+@app.route("/api/history/rollups", methods=["GET"])
+def history_rollups_endpoint():
+    site = sites.current()
+    args = request.args
+    try:
+        rows = site.retention.rollups(
+            granularidad=args.get("granularidad", "dia"),
+            perfil=args.get("perfil"),
+            desde=args.get("desde"),
+            hasta=args.get("hasta"),
+        )
+        return jsonify({"success": True, "agregados": rows})
+    except ValueError as e:
+        return jsonify({"success": False, "error": str(e)}), 400
+    except Exception as e:
+        return jsonify({"success": False, "error": str(e)}), 500
+
+
+# ---------------------------------------------------------------------------------------
+# 🎛️ CONTROLADOR DE DOSIFICACIÓN (LAZO CERRADO)
+# ---------------------------------------------------------------------------------------
+@app.route("/api/controller/tanks", methods=["POST"])
+def controller_tanks_endpoint():
+    data = request.json or {}
+    tanks = data.get("tanques") or []          # [{"id", "perfil", "volumen_L", "ppm_inicial"?}]
+    driver_name = data.get("driver")           # opcional: "simulado"
+    config = data.get("config") or {}          # opcional: límites de seguridad y ganancia
+
+    if not tanks:
+        return jsonify({"success": False, "error": "Falta lista 'tanques'"}), 400
+
+    try:
+        if driver_name and driver_name not in DRIVERS:
+            return jsonify({"success": False, "error": f"Driver desconocido: {driver_name}"}), 400
+        if not isinstance(config, dict):
+            return jsonify({"success": False, "error": "'config' debe ser un objeto"}), 400
+        if driver_name or config:
+            # Mismo controlador: los tanques ya registrados conservan bloqueos y presupuestos
+            driver = DRIVERS[driver_name](calc_service) if driver_name else None
+            dosing_controller.configure(driver, **config)
+
+        dosing_controller.set_tanks(tanks)
+
+        # El driver simulado necesita el estado inicial de cada tanque
+        driver = dosing_controller.driver
+        if hasattr(driver, "add_tank"):
+            for k, tank in enumerate(tanks):
+                row = dosing_controller.targets[k]
+                inicial = tank.get("ppm_inicial")
+                ppm0 = [float(inicial.get(n, row[i])) for i, n in enumerate(calc_service.nutrient_order)] \
+                    if inicial else row * 0.8
+                driver.add_tank(tank.get("id", k), float(tank["volumen_L"]), ppm0)
+
+        return jsonify({"success": True, **dosing_controller.status()})
+    except (KeyError, ValueError) as e:
+        return jsonify({"success": False, "error": str(e)}), 400
+    except Exception as e:
+        return jsonify({"success": False, "error": str(e)}), 500
+
+
+@app.route("/api/controller/tick", methods=["POST"])
+def controller_tick_endpoint():
+    data = request.json or {}
+    lecturas = data.get("lecturas")            # opcional: {tanque: {N,P,K,Ca,Mg, ec?}}; si falta, lee el driver
+    try:
+        result = dosing_controller.tick_from_readings(lecturas) if lecturas else dosing_controller.tick()
+        return jsonify({"success": True, **result})
+    except ValueError as e:
+        return jsonify({"success": False, "error": str(e)}), 400
+    except Exception as e:
+        return jsonify({"success": False, "error": str(e)}), 500
+
+
+@app.route("/api/controller/start", methods=["POST"])
+def controller_start_endpoint():
+    try:
+        dosing_controller.start()
+        return jsonify({"success": True, **dosing_controller.status()})
+    except ValueError as e:
+        return jsonify({"success": False, "error": str(e)}), 400
+
+
+@app.route("/api/controller/stop", methods=["POST"])
+def controller_stop_endpoint():
+    dosing_controller.stop()
+    return jsonify({"success": True, **dosing_controller.status()})
+
+
+@app.route("/api/controller/status", methods=["GET"])
+def controller_status_endpoint():
+    return jsonify({"success": True, **dosing_controller.status()})
+
+
+@app.route("/api/controller/reset_alarm", methods=["POST"])
+def controller_reset_alarm_endpoint():
+    data = request.json or {}
+    if not dosing_controller.reset_alarm(data.get("tanque")):
+        return jsonify({"success": False, "error": "Tanque desconocido"}), 404
+    return jsonify({"success": True})
+
+
 # ---------------------------------------------------------------------------------------
 # 📌 PERFILES
 # ---------------------------------------------------------------------------------------
 @app.route("/api/profiles", methods=["GET"])
 def get_profiles_endpoint():
+    site = sites.current()
+    args = request.args
+    prefix = args.get("prefix")
+    text = args.get("q")
+    after = args.get("after")
+    limit = args.get("limit")
+
     try:
-        profiles = db_manager.get_all_profiles()
-        return jsonify({"success": True, "profiles": profiles})
+        # Sin parámetros: catálogo completo (compatibilidad con clientes antiguos)
+        if prefix is None and text is None and after is None and limit is None:
+            profiles = site.db.get_all_profiles()
+            return jsonify({"success": True, "profiles": profiles, "version": site.db.get_profiles_version()})
+
+        profiles, next_cursor = site.db.search_profiles(
+            prefix=prefix, text=text, after=after, limit=int(limit or 100)
+        )
+        return jsonify({"success": True, "profiles": profiles, "next_cursor": next_cursor})
+    except ValueError as e:
+        return jsonify({"success": False, "error": str(e)}), 400
+    except Exception as e:
+        return jsonify({"success": False, "error": str(e)}), 500
+
+
+@app.route("/api/profiles/changes", methods=["GET"])
+def profile_changes_endpoint():
+    site = sites.current()
+    try:
+        since = int(request.args.get("since", 0))
+        limit = int(request.args.get("limit", 1000))
+        changes, has_more, version = site.db.get_profile_changes(since=since, limit=limit)
+        return jsonify({"success": True, "version": version, "changes": changes, "has_more": has_more})
+    except ValueError as e:
+        return jsonify({"success": False, "error": str(e)}), 400
     except Exception as e:
         return jsonify({"success": False, "error": str(e)}), 500
 
 
 @app.route("/api/profiles/save", methods=["POST"])
 def save_profile_endpoint():
+    site = sites.current()
     data = request.json or {}
 
     required = ["nombre", "N", "P", "K", "Ca", "Mg"]
@@ -97,31 +523,171 @@ def save_profile_endpoint():
             return jsonify({"success": False, "message": f"Falta campo: {r}"}), 400
 
     try:
-        conn = db_manager._get_connection()
-        cursor = conn.cursor()
+        version = site.db.save_profile(data)
+        # La calculadora usa el perfil nuevo sin reiniciar el backend
+        site.calc.external_profiles[data["nombre"]] = {k: data[k] for k in required}
+        site.similarity.on_profile_saved(data)
+        bootstrap.notify(site.id)
+        return jsonify({"success": True, "version": version})
 
-        cursor.execute("""
-            INSERT INTO profiles (nombre, N, P, K, Ca, Mg)
-            VALUES (?, ?, ?, ?, ?, ?)
-            ON CONFLICT(nombre) DO UPDATE SET
-                N = excluded.N,
-                P = excluded.P,
-                K = excluded.K,
-                Ca = excluded.Ca,
-                Mg = excluded.Mg;
-        """, (
-            data["nombre"], data["N"], data["P"], data["K"], data["Ca"], data["Mg"]
-        ))
+    except Exception as e:
+        return jsonify({"success": False, "message": str(e)}), 500
 
-        conn.commit()
-        conn.close()
 
-        return jsonify({"success": True})
+@app.route("/api/profiles/delete", methods=["POST"])
+def delete_profile_endpoint():
+    site = sites.current()
+    data = request.json or {}
+    nombre = data.get("nombre")
+
+    if not nombre:
+        return jsonify({"success": False, "message": "Falta campo: nombre"}), 400
+
+    try:
+        version = site.db.delete_profile(nombre)
+        if version is None:
+            return jsonify({"success": False, "message": f"Perfil '{nombre}' no encontrado"}), 404
+        site.calc.external_profiles.pop(nombre, None)
+        site.similarity.on_profile_deleted(nombre)
+        bootstrap.notify(site.id)
+        return jsonify({"success": True, "version": version})
 
     except Exception as e:
         return jsonify({"success": False, "message": str(e)}), 500
 
 
+@app.route("/api/profiles/import", methods=["POST"])
+def import_profiles_endpoint():
+    """
+    Cuerpo: el archivo tal cual (CSV, array JSON o NDJSON) o multipart con
+    campo 'file'. ?formato=csv|json|ndjson (si no, se deduce del Content-Type),
+    ?atomico=1 para cancelar todo ante cualquier fila inválida.
+    """
+    site = sites.current()
+    upload = request.files.get("file")
+    stream = upload.stream if upload else request.stream
+    content_type = upload.mimetype if upload else request.content_type
+    atomico = request.args.get("atomico", "0").lower() in ("1", "true", "si", "sí")
+
+    try:
+        formato = detect_format(content_type, request.args.get("formato"))
+        report = site.bulk.import_stream(stream, formato, atomico=atomico)
+        if report["importadas"]:
+            # Calculadora e índice de similitud ven el catálogo nuevo sin reiniciar
+            profiles = site.db.get_all_profiles()
+            site.calc.external_profiles = {p["nombre"]: p for p in profiles}
+            site.similarity.load_profiles(profiles)
+            bootstrap.notify(site.id)
+        return jsonify(report), 200 if report["success"] else 400
+    except ValueError as e:
+        return jsonify({"success": False, "error": str(e)}), 400
+    except Exception as e:
+        return jsonify({"success": False, "error": str(e)}), 500
+
+
+@app.route("/api/profiles/export", methods=["GET"])
+def export_profiles_endpoint():
+    site = sites.current()
+    formato = request.args.get("formato", "csv")
+    try:
+        lines = site.bulk.export_lines(formato)
+        first = next(lines, "")   # valida el formato antes de empezar a transmitir
+    except ValueError as e:
+        return jsonify({"success": False, "error": str(e)}), 400
+
+    def generate():
+        yield first
+        yield from lines
+
+    mimetype = "text/csv" if formato == "csv" else "application/x-ndjson"
+    response = Response(stream_with_context(generate()), mimetype=mimetype)
+    response.headers["Content-Disposition"] = f"attachment; filename=perfiles.{formato}"
+    return response
+
+
+@app.route("/api/profiles/nearest", methods=["POST"])
+def nearest_profiles_endpoint():
+    site = sites.current()
+    data = request.json or {}
+    consultas = data.get("consultas") or ([data["objetivo"]] if data.get("objetivo") else [])   # [{N,P,K,Ca,Mg}]
+    pesos = data.get("pesos")                       # opcional: {"K": 2.0, "Mg": 0.5}
+    incluir = data.get("incluir") or ["perfiles", "recetas"]
+
+    if not consultas:
+        return jsonify({"success": False, "error": "Falta 'objetivo' o 'consultas'"}), 400
+
+    try:
+        results = site.similarity.nearest(consultas, k=int(data.get("k", 5)), pesos=pesos, incluir=incluir)
+        return jsonify({"success": True, "resultados": results})
+    except ValueError as e:
+        return jsonify({"success": False, "error": str(e)}), 400
+    except Exception as e:
+        return jsonify({"success": False, "error": str(e)}), 500
+
+
+# ---------------------------------------------------------------------------------------
+# 🧂 CATÁLOGO DE FERTILIZANTES
+# ---------------------------------------------------------------------------------------
+@app.route("/api/fertilizers", methods=["GET"])
+def get_fertilizers_endpoint():
+    """?nutriente=Mg&min=9&max=: sales que aportan ese nutriente en el rango; ?since=: cambios."""
+    site = sites.current()
+    args = request.args
+    try:
+        fertilizantes = site.catalog.search(
+            nutriente=args.get("nutriente"),
+            minimo=float(args["min"]) if args.get("min") else None,
+            maximo=float(args["max"]) if args.get("max") else None,
+            since=int(args["since"]) if args.get("since") else None,
+        )
+        return jsonify({"success": True, "version": site.catalog.version, "fertilizantes": fertilizantes})
+    except ValueError as e:
+        return jsonify({"success": False, "error": str(e)}), 400
+    except Exception as e:
+        return jsonify({"success": False, "error": str(e)}), 500
+
+
+@app.route("/api/fertilizers/save", methods=["POST"])
+def save_fertilizer_endpoint():
+    """Cuerpo: {"nombre", "formula"?, "composicion": {"N": 15.5, "Ca": 19, ...}} (en %)."""
+    site = sites.current()
+    data = request.json or {}
+    try:
+        # Una sal en uso no puede dejar la matriz de la calculadora sin solución
+        nombre, _, composicion = site.catalog.validate(data)
+        problema = site.calc.singular_with(nombre, composicion)
+        if problema:
+            return jsonify({"success": False, "error": problema}), 409
+
+        version = site.catalog.save(data)
+        bootstrap.notify(site.id)
+        return jsonify({"success": True, "version": version})
+    except (TypeError, ValueError) as e:
+        return jsonify({"success": False, "error": str(e)}), 400
+    except Exception as e:
+        return jsonify({"success": False, "error": str(e)}), 500
+
+
+@app.route("/api/fertilizers/delete", methods=["POST"])
+def delete_fertilizer_endpoint():
+    site = sites.current()
+    nombre = (request.json or {}).get("nombre")
+
+    if not nombre:
+        return jsonify({"success": False, "error": "Falta campo: nombre"}), 400
+    if nombre in site.calc.selected_ferts:
+        return jsonify({"success": False, "error": f"'{nombre}' está en uso por la calculadora"}), 409
+
+    try:
+        version = site.catalog.delete(nombre)
+        if version is None:
+            return jsonify({"success": False, "error": f"Fertilizante '{nombre}' no encontrado"}), 404
+        bootstrap.notify(site.id)
+        return jsonify({"success": True, "version": version})
+    except Exception as e:
+        return jsonify({"success": False, "error": str(e)}), 500
+
+
 # ---------------------------------------------------------------------------------------
 # ⚗️ ANÁLISIS DE AGUA (DE MOMENTO: MODO SIMPLE)
 # ---------------------------------------------------------------------------------------
@@ -157,13 +723,15 @@ def deficiency_plan_endpoint():
 
     data = request.json or {}
     symptom_code = data.get("symptom_code")
+    symptom_codes = data.get("symptom_codes")         # opcional: varios síntomas a la vez
     volume_L = float(data.get("volume_L") or 0)
 
     current_profile = data.get("current_profile")      # opcional: dict con N,P,K,Ca,Mg
     tissue_analysis = data.get("tissue_analysis")      # opcional
+    tissue_unit = data.get("tissue_unit")              # "pct" | "ppm": sin unidad no puntúa
 
-    if not symptom_code:
-        return jsonify({"success": False, "error": "Falta 'symptom_code'"}), 400
+    if not symptom_code and not symptom_codes:
+        return jsonify({"success": False, "error": "Falta 'symptom_code' o 'symptom_codes'"}), 400
 
     try:
         plan = chem_engine.build_correction_plan(
@@ -171,9 +739,33 @@ def deficiency_plan_endpoint():
             volume_L=volume_L,
             current_profile=current_profile,
             tissue_analysis=tissue_analysis,
+            symptom_codes=symptom_codes,
+            tissue_unit=tissue_unit,
         )
         status = 200 if plan.get("success") else 400
         return jsonify(plan), status
+    except ValueError as e:
+        return jsonify({"success": False, "error": str(e)}), 400
+    except Exception as e:
+        return jsonify({"success": False, "error": str(e)}), 500
+
+
+@app.route("/api/deficiency/plan_batch", methods=["POST"])
+def deficiency_plan_batch_endpoint():
+    if chem_engine is None:
+        return jsonify({"success": False, "error": "Motor químico no instalado"}), 500
+
+    data = request.json or {}
+    requests_list = data.get("requests") or []   # [{symptom_code(s), volume_L, current_profile?, tissue_analysis?, tissue_unit?}]
+
+    if not requests_list:
+        return jsonify({"success": False, "error": "Falta lista 'requests'"}), 400
+
+    try:
+        plans = chem_engine.build_correction_plans(requests_list)
+        return jsonify({"success": True, "plans": plans})
+    except ValueError as e:
+        return jsonify({"success": False, "error": str(e)}), 400
     except Exception as e:
         return jsonify({"success": False, "error": str(e)}), 500
 
@@ -197,12 +789,27 @@ def balance_reaction_endpoint():
         }), 400
 
     try:
-        result = chem_engine.balance_reaction(reactants, products)
+        result = chem_engine.balance_reaction(reactants, products)   # la caché se escribe al salir
         status = 200 if result.get("success") else 400
         return jsonify(result), status
     except Exception as e:
         return jsonify({"success": False, "error": str(e)}), 500
 
+@app.route("/api/compounds/autocomplete", methods=["GET"])
+def compound_autocomplete_endpoint():
+    if chem_engine is None:
+        return jsonify({"success": False, "error": "Motor químico no instalado"}), 500
+
+    prefix = request.args.get("q", "")
+    try:
+        limit = int(request.args.get("limit", 8))
+        return jsonify(chem_engine.autocomplete_compound(prefix, limit))
+    except ValueError as e:
+        return jsonify({"success": False, "error": str(e)}), 400
+    except Exception as e:
+        return jsonify({"success": False, "error": str(e)}), 500
+
+
 @app.route("/api/molar_solution", methods=["POST"])
 def molar_solution():
     if chem_engine is None:
@@ -219,12 +826,133 @@ def molar_solution():
         return jsonify({"success": False, "error": str(e)}), 500
 
 
+@app.route("/api/molar_solution/batch", methods=["POST"])
+def molar_solution_batch():
+    if chem_engine is None:
+        return jsonify({"success": False, "error": "Motor químico no instalado"}), 500
+
+    data = request.json or {}
+    items = data.get("solutions") or []   # [{compound, volume_L, molarity_M?}]
+
+    if not items or not isinstance(items, list):
+        return jsonify({"success": False, "error": "Falta lista 'solutions'"}), 400
+
+    try:
+        return jsonify(chem_engine.prepare_molar_solutions(items))
+    except (TypeError, ValueError) as e:
+        return jsonify({"success": False, "error": str(e)}), 400
+    except Exception as e:
+        return jsonify({"success": False, "error": str(e)}), 500
+
+
+# ---------------------------------------------------------------------------------------
+# 🌐 SITIOS E INFORMES ENTRE SITIOS
+# ---------------------------------------------------------------------------------------
+@app.route("/api/sites", methods=["GET"])
+def list_sites_endpoint():
+    return jsonify({"success": True, "sites": sites.list(), "por_defecto": DEFAULT_SITE})
+
+
+@app.route("/api/sites", methods=["POST"])
+def create_site_endpoint():
+    data = request.json or {}
+    try:
+        site = sites.get(data.get("site", ""), create=True)
+        return jsonify({"success": True, "site": site.id})
+    except ValueError as e:
+        return jsonify({"success": False, "error": str(e)}), 400
+    except Exception as e:
+        return jsonify({"success": False, "error": str(e)}), 500
+
+
+def _report_sites():
+    """?sites=a,b,c (por defecto, todos)."""
+    return [s for s in request.args.get("sites", "").split(",") if s.strip()] or None
+
+
+@app.route("/api/sites/report/rollups", methods=["GET"])
+def sites_rollups_endpoint():
+    args = request.args
+    granularidad = args.get("granularidad", "dia")
+    if granularidad not in ("dia", "semana"):
+        return jsonify({"success": False, "error": "granularidad debe ser 'dia' o 'semana'."}), 400
+    try:
+        # Cada sitio consulta su propia base en un hilo del pool; luego se suman por periodo
+        results = sites.map(
+            lambda site: site.retention.rollups(
+                granularidad=granularidad, perfil=args.get("perfil"),
+                desde=args.get("desde"), hasta=args.get("hasta"),
+            ),
+            _report_sites(),
+        )
+        return jsonify({
+            "success": True,
+            "agregados": merge_rollups(results),
+            "errores": {s: r["error"] for s, r in results.items() if "error" in r},
+        })
+    except ValueError as e:
+        return jsonify({"success": False, "error": str(e)}), 400
+    except Exception as e:
+        return jsonify({"success": False, "error": str(e)}), 500
+
+
+@app.route("/api/sites/report/consumption", methods=["GET"])
+def sites_consumption_endpoint():
+    args = request.args
+    try:
+        results = sites.map(
+            lambda site: site.series.consumption(
+                desde=args.get("desde"), hasta=args.get("hasta"), perfil=args.get("perfil"),
+            ),
+            _report_sites(),
+        )
+        return jsonify({
+            "success": True,
+            "sitios": {s: r.get("resultado") for s, r in results.items() if "resultado" in r},
+            "total": merge_consumption(results),
+            "errores": {s: r["error"] for s, r in results.items() if "error" in r},
+        })
+    except ValueError as e:
+        return jsonify({"success": False, "error": str(e)}), 400
+    except Exception as e:
+        return jsonify({"success": False, "error": str(e)}), 500
+
+
+# ---------------------------------------------------------------------------------------
+# 🚦 CONTROL DE ADMISIÓN: MÉTRICAS
+# ---------------------------------------------------------------------------------------
+@app.route("/api/admission/metrics", methods=["GET"])
+def admission_metrics_endpoint():
+    return jsonify({"success": True, **admission.metrics()})
+
+
+# ---------------------------------------------------------------------------------------
+# 💾 CACHÉ DE ARRANQUE EN CALIENTE
+# ---------------------------------------------------------------------------------------
+@app.route("/api/cache", methods=["GET"])
+def warm_cache_status_endpoint():
+    return jsonify({"success": True, **warm_cache.status()})
+
 
 # ---------------------------------------------------------------------------------------
 # ARRANQUE
 # ---------------------------------------------------------------------------------------
+def start_services():
+    """
+    Hook de arranque de los servicios en segundo plano (retención del historial
+    de cada sitio). Importar main no los arranca: lo llama cada punto de
+    entrada que atiende peticiones (este script, rpc_server.py o el servidor
+    WSGI que se use). Llamarlo más de una vez no hace nada.
+    """
+    sites.start_background()
+
+
 if __name__ == "__main__":
+    debug = os.environ.get("HYDROSYNAPSE_DEBUG", "1") != "0"
     print("HydroSynapse Backend iniciado.")
     print("DB:", db_manager.db_path)
     print("Motor químico avanzado:", "✔️ ACTIVADO" if chem_engine else "❌ NO DETECTADO")
-    app.run(port=8000, debug=True)
+    # Con el recargador de debug, el proceso vigilante no atiende peticiones: solo el hijo arranca los servicios
+    if not debug or os.environ.get("WERKZEUG_RUN_MAIN") == "true":
+        start_services()
+    app.run(port=8000, debug=debug)
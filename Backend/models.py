@@ -1,5 +1,5 @@
 from pydantic import BaseModel
-from typing import List, Dict
+from typing import Any, Dict, List, Optional
 
 # Modelo para lo que envía el Frontend
 class InputParameters(BaseModel):
@@ -18,4 +18,7 @@ class DoseResult(BaseModel):
     dosis: List[FertilizerDose]
     ec_estimada: float
     ph_estimado: float
-    analisis_final: Dict[str, float] # Ej: {"N": 150.1, "P": 50.0}
\ No newline at end of file
+    analisis_final: Dict[str, float] # Ej: {"N": 150.1, "P": 50.0}
+    incertidumbre: Optional[Dict[str, Any]] = None # Intervalos Monte Carlo (opcional)
+    quimica: Optional[Dict[str, Any]] = None # Fuerza iónica y ácido para el pH objetivo
+    factibilidad: Optional[Dict[str, Any]] = None # Alcanzable con las sales + nutrientes restrictivos y desvíos de la solución
\ No newline at end of file
@@ -0,0 +1,202 @@
+import csv
+import io
+import json
+import math
+from typing import Any, BinaryIO, Dict, Iterable, Iterator, List, Tuple
+
+from database import SQLiteDatabase
+
+NUTRIENT_FIELDS = ["N", "P", "K", "Ca", "Mg"]
+PROFILE_FIELDS = ["nombre", *NUTRIENT_FIELDS]
+
+
+# ---------------------------------------------------------------------------------------
+# LECTURA EN FLUJO (CSV / JSON / NDJSON)
+# ---------------------------------------------------------------------------------------
+def iter_csv(stream: BinaryIO) -> Iterator[Dict[str, Any]]:
+    """Filas de un CSV con cabecera (nombre,N,P,K,Ca,Mg); acepta ',' o ';' como separador."""
+    text = io.TextIOWrapper(stream, encoding="utf-8-sig", newline="")
+    header = text.readline()
+    delimiter = ";" if header.count(";") > header.count(",") else ","
+    fields = [h.strip() for h in next(csv.reader([header], delimiter=delimiter), [])]
+    for values in csv.reader(text, delimiter=delimiter):
+        if values:
+            yield dict(zip(fields, values))
+
+
+def iter_ndjson(stream: BinaryIO) -> Iterator[Any]:
+    """Un objeto JSON por línea."""
+    for line in stream:
+        line = line.strip()
+        if line:
+            try:
+                yield json.loads(line)
+            except json.JSONDecodeError as e:
+                yield ValueError(f"JSON inválido: {e.msg}")
+
+
+def iter_json_array(stream: BinaryIO, chunk_size: int = 1 << 16) -> Iterator[Any]:
+    """
+    Elementos de un array JSON ([{...}, {...}]) sin cargar el documento
+    entero: se decodifica objeto a objeto sobre un búfer que se va rellenando.
+    """
+    decoder = json.JSONDecoder()
+    reader = io.TextIOWrapper(stream, encoding="utf-8-sig")
+    buf, pos, started, eof = "", 0, False, False
+
+    while True:
+        # Saltar espacios, la apertura del array y las comas entre elementos
+        while pos < len(buf) and (buf[pos].isspace() or buf[pos] == "," or (buf[pos] == "[" and not started)):
+            started = started or buf[pos] == "["
+            pos += 1
+        if pos < len(buf) and buf[pos] == "]":
+            return
+        if pos < len(buf) and not started:
+            raise ValueError("Se esperaba un array JSON de perfiles.")
+        try:
+            item, end = decoder.raw_decode(buf, pos)
+        except json.JSONDecodeError:
+            if eof:
+                if buf[pos:].strip():
+                    raise ValueError("JSON inválido o truncado al final del archivo.")
+                return
+            chunk = reader.read(chunk_size)
+            eof = not chunk
+            buf, pos = buf[pos:] + chunk, 0
+            continue
+        if end == len(buf) and not eof:
+            # Un número puede seguir en el siguiente bloque: releer con más datos
+            chunk = reader.read(chunk_size)
+            if chunk:
+                buf, pos = buf[pos:] + chunk, 0
+                continue
+            eof = True
+        yield item
+        pos = end
+
+
+READERS = {"csv": iter_csv, "ndjson": iter_ndjson, "json": iter_json_array}
+
+
+def detect_format(content_type: str | None, formato: str | None) -> str:
+    """Formato explícito (?formato=) o deducido del Content-Type."""
+    if formato:
+        if formato not in READERS:
+            raise ValueError(f"Formato no soportado: {formato} (usa csv, json o ndjson)")
+        return formato
+    content_type = (content_type or "").lower()
+    if "ndjson" in content_type or "jsonl" in content_type:
+        return "ndjson"
+    if "json" in content_type:
+        return "json"
+    return "csv"
+
+
+# ---------------------------------------------------------------------------------------
+# IMPORTACIÓN / EXPORTACIÓN
+# ---------------------------------------------------------------------------------------
+class ProfileBulkService:
+    """
+    Importación y exportación masiva del catálogo de perfiles.
+
+    La importación lee la subida en flujo, valida por lotes de 'tamano_lote'
+    filas y escribe todas las válidas en una sola transacción (executemany
+    por lote), así que 100k perfiles tardan segundos y no un commit por
+    perfil. Devuelve un informe de errores por fila (número de registro,
+    1 = primer dato) acotado a 'max_errores' entradas.
+
+    La exportación recorre la tabla con fetchmany y emite CSV o NDJSON a
+    medida que lee: memoria constante sea cual sea el tamaño del catálogo.
+    """
+
+    def __init__(self, db: SQLiteDatabase, tamano_lote: int = 5000, max_errores: int = 1000):
+        self.db = db
+        self.tamano_lote = tamano_lote
+        self.max_errores = max_errores
+
+    @staticmethod
+    def validate_row(item: Any) -> Tuple:
+        """Fila lista para la base de datos; ValueError con el motivo si no es válida."""
+        if isinstance(item, Exception):
+            raise item
+        if not isinstance(item, dict):
+            raise ValueError("Se esperaba un objeto con nombre, N, P, K, Ca, Mg.")
+        missing = [f for f in PROFILE_FIELDS if item.get(f) in (None, "")]
+        if missing:
+            raise ValueError(f"Falta campo: {', '.join(missing)}")
+
+        nombre = str(item["nombre"]).strip()
+        if not nombre:
+            raise ValueError("El nombre no puede estar vacío.")
+        if len(nombre) > 200:
+            raise ValueError("Nombre demasiado largo (máx. 200 caracteres).")
+
+        values = []
+        for f in NUTRIENT_FIELDS:
+            raw = item[f]
+            try:
+                value = float(raw.replace(",", ".") if isinstance(raw, str) else raw)
+            except (TypeError, ValueError):
+                raise ValueError(f"{f} no es numérico: {raw!r}")
+            if not math.isfinite(value) or value < 0:
+                raise ValueError(f"{f} debe ser un número finito y no negativo.")
+            values.append(value)
+        return (nombre, *values)
+
+    def _chunks(self, items: Iterable[Any], report: Dict[str, Any], atomico: bool) -> Iterator[List[Tuple]]:
+        chunk: List[Tuple] = []
+        for n, item in enumerate(items, start=1):
+            report["leidas"] = n
+            try:
+                chunk.append(self.validate_row(item))
+            except ValueError as e:
+                report["n_errores"] += 1
+                if len(report["errores"]) < self.max_errores:
+                    report["errores"].append({"fila": n, "error": str(e)})
+                continue
+            if len(chunk) >= self.tamano_lote:
+                yield chunk
+                chunk = []
+        if chunk:
+            yield chunk
+        if atomico and report["n_errores"]:
+            raise ValueError(f"{report['n_errores']} filas inválidas: importación cancelada (modo atómico).")
+
+    def import_stream(self, stream: BinaryIO, formato: str = "csv", atomico: bool = False) -> Dict[str, Any]:
+        """
+        Importa perfiles desde un flujo. Con atomico=True, cualquier fila
+        inválida cancela toda la importación; si no, se guardan las válidas.
+        """
+        if formato not in READERS:
+            raise ValueError(f"Formato no soportado: {formato}")
+        report: Dict[str, Any] = {"leidas": 0, "importadas": 0, "n_errores": 0, "errores": []}
+        try:
+            report["importadas"], report["version"] = self.db.upsert_profiles(
+                self._chunks(READERS[formato](stream), report, atomico)
+            )
+            report["success"] = True
+        except ValueError as e:
+            # Error de formato o modo atómico: la transacción ya se deshizo
+            report.update(success=False, error=str(e), importadas=0)
+        return report
+
+    def export_lines(self, formato: str = "csv") -> Iterator[str]:
+        """Catálogo activo como líneas de texto (CSV con cabecera o NDJSON)."""
+        if formato not in ("csv", "ndjson"):
+            raise ValueError("Formato de exportación no soportado (usa csv o ndjson).")
+        rows = self.db.iter_profiles(self.tamano_lote)
+        if formato == "ndjson":
+            for row in rows:
+                yield json.dumps(dict(zip(PROFILE_FIELDS, row)), ensure_ascii=False) + "\n"
+            return
+
+        buf = io.StringIO()
+        writer = csv.writer(buf, lineterminator="\n")
+        writer.writerow(PROFILE_FIELDS)
+        for n, row in enumerate(rows, start=1):
+            writer.writerow(row)
+            if n % 1000 == 0:
+                yield buf.getvalue()
+                buf.seek(0)
+                buf.truncate()
+        yield buf.getvalue()
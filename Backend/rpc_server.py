@@ -0,0 +1,344 @@
+"""
+Transporte RPC de baja latencia para el sidecar de Electron.
+
+Alternativa al servidor HTTP en localhost:8000: mensajes JSON-RPC 2.0 con
+prefijo de longitud (4 bytes big-endian + cuerpo UTF-8) sobre stdin/stdout
+o un socket Unix. Cada petición se despacha a las MISMAS rutas Flask de
+main.py, así que la lógica y las respuestas son idénticas.
+
+Petición:   {"jsonrpc": "2.0", "id": 7, "method": "/api/calculate_doses",
+             "params": {...}, "http_method": "POST"?}
+Respuesta:  {"jsonrpc": "2.0", "id": 7, "result": {...}, "status": 200}
+
+Las rutas que responden NDJSON en streaming (/api/simulate_tanks) se
+reenvían línea a línea según se generan, como notificaciones
+{"jsonrpc": "2.0", "method": "stream", "params": {"id": 7, "item": {...}}},
+y al final llega la respuesta con {"items": n}. Las de Server-Sent Events
+(/api/bootstrap/events) no terminan nunca y se rechazan: por RPC se usa
+/api/bootstrap y se vuelve a pedir.
+
+Las peticiones se leen sin esperar a las respuestas (pipelining) y se
+resuelven en un pool de hilos; las respuestas salen en orden de llegada a
+término y se emparejan por "id".
+
+Uso:
+    python rpc_server.py --stdio
+    python rpc_server.py --socket /tmp/hydrosynapse.sock
+    python rpc_server.py --bench 2000      # comparación de latencia vs HTTP
+"""
+import argparse
+import json
+import os
+import socket
+import stat
+import struct
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+from typing import Any, BinaryIO, Callable, Dict
+
+from werkzeug.exceptions import MethodNotAllowed, NotFound
+
+HEADER = struct.Struct(">I")
+MAX_FRAME = 64 * 1024 * 1024
+SSE_MIME = "text/event-stream"
+NDJSON_MIME = "application/x-ndjson"
+
+
+# ---------------------------------------------------------------------------------------
+# ENCUADRE (LENGTH-PREFIXED)
+# ---------------------------------------------------------------------------------------
+def read_frame(stream: BinaryIO) -> bytes | None:
+    """Lee un mensaje completo; devuelve None al cerrarse el flujo."""
+    header = _read_exact(stream, HEADER.size)
+    if header is None:
+        return None
+    (length,) = HEADER.unpack(header)
+    if length > MAX_FRAME:
+        raise ValueError(f"Mensaje demasiado grande: {length} bytes")
+    return _read_exact(stream, length)
+
+
+def _read_exact(stream: BinaryIO, n: int) -> bytes | None:
+    buf = bytearray()
+    while len(buf) < n:
+        chunk = stream.read(n - len(buf))
+        if not chunk:
+            return None
+        buf += chunk
+    return bytes(buf)
+
+
+def encode_frame(payload: Dict[str, Any]) -> bytes:
+    body = json.dumps(payload, separators=(",", ":")).encode("utf-8")
+    return HEADER.pack(len(body)) + body
+
+
+# ---------------------------------------------------------------------------------------
+# DESPACHO A LAS RUTAS FLASK
+# ---------------------------------------------------------------------------------------
+class RpcDispatcher:
+    """Traduce mensajes JSON-RPC a llamadas a las vistas registradas en la app Flask."""
+
+    def __init__(self, app):
+        self.app = app
+        self.adapter = app.url_map.bind("localhost")
+
+    def _resolve_method(self, path: str, http_method: str | None) -> str:
+        if http_method:
+            return http_method.upper()
+        # Sin método explícito: POST si la ruta lo acepta, si no GET
+        try:
+            self.adapter.match(path, method="POST")
+            return "POST"
+        except MethodNotAllowed:
+            return "GET"
+
+    def dispatch(self, message: Dict[str, Any],
+                 emit: Callable[[Dict[str, Any]], None] | None = None) -> Dict[str, Any]:
+        """
+        emit: si se pasa, las respuestas NDJSON en streaming se reenvían por
+        él item a item (notificaciones "stream"); si no, se acumulan en una lista.
+        """
+        req_id = message.get("id")
+        path = message.get("method")
+        params = message.get("params")
+
+        if not isinstance(path, str):
+            return self._error(req_id, -32600, "Falta 'method' (ruta de la API)")
+
+        try:
+            http_method = self._resolve_method(path, message.get("http_method"))
+            self.adapter.match(path, method=http_method)
+        except NotFound:
+            return self._error(req_id, -32601, f"Ruta desconocida: {path}")
+        except MethodNotAllowed:
+            return self._error(req_id, -32601, f"Método no permitido en {path}")
+
+        kwargs: Dict[str, Any] = {"method": http_method, "headers": message.get("headers") or {}}
+        if http_method == "GET":
+            kwargs["query_string"] = params or {}
+        else:
+            kwargs["json"] = params or {}
+
+        with self.app.test_request_context(path, **kwargs):
+            response = self.app.full_dispatch_request()
+            try:
+                if response.mimetype == SSE_MIME:
+                    return self._error(req_id, -32601, f"{path} es un flujo de eventos sin fin: no disponible por RPC")
+                if response.mimetype == NDJSON_MIME and response.is_streamed and emit is not None:
+                    result = {"items": self._forward_ndjson(req_id, response, emit)}
+                    return {"jsonrpc": "2.0", "id": req_id, "result": result, "status": response.status_code}
+                body = response.get_data()
+            finally:
+                response.close()   # libera lo que la respuesta reservó (p. ej. suscriptores SSE)
+
+        if response.mimetype == "application/json":
+            result = json.loads(body) if body else None
+        elif response.mimetype == NDJSON_MIME:
+            result = [json.loads(line) for line in body.splitlines() if line.strip()]
+        else:
+            result = body.decode("utf-8", errors="replace")
+
+        return {"jsonrpc": "2.0", "id": req_id, "result": result, "status": response.status_code}
+
+    @staticmethod
+    def _forward_ndjson(req_id, response, emit: Callable[[Dict[str, Any]], None]) -> int:
+        """Reenvía cada línea NDJSON en cuanto la vista la genera; devuelve cuántas."""
+        count, pending = 0, b""
+        for chunk in response.iter_encoded():
+            pending += chunk
+            *lines, pending = pending.split(b"\n")
+            for line in lines:
+                if line.strip():
+                    emit({"jsonrpc": "2.0", "method": "stream", "params": {"id": req_id, "item": json.loads(line)}})
+                    count += 1
+        if pending.strip():
+            emit({"jsonrpc": "2.0", "method": "stream", "params": {"id": req_id, "item": json.loads(pending)}})
+            count += 1
+        return count
+
+    @staticmethod
+    def _error(req_id, code: int, message: str) -> Dict[str, Any]:
+        return {"jsonrpc": "2.0", "id": req_id, "error": {"code": code, "message": message}}
+
+
+def serve_stream(dispatcher: RpcDispatcher, reader: BinaryIO, write: Callable[[bytes], None],
+                 executor: ThreadPoolExecutor) -> None:
+    """
+    Bucle de lectura: cada mensaje se resuelve en el pool sin bloquear la
+    lectura. Vuelve al cerrarse el flujo o ante un marco inválido (demasiado
+    grande), tras responder a las peticiones ya recibidas.
+    """
+    lock = threading.Lock()
+
+    def send(payload: Dict[str, Any]):
+        frame = encode_frame(payload)
+        with lock:
+            write(frame)
+
+    def handle(raw: bytes):
+        try:
+            message = json.loads(raw)
+            reply = dispatcher.dispatch(message, emit=send)
+        except json.JSONDecodeError as e:
+            reply = RpcDispatcher._error(None, -32700, f"JSON inválido: {e}")
+        except Exception as e:
+            reply = RpcDispatcher._error(None, -32603, str(e))
+        send(reply)
+
+    in_flight = set()
+    in_flight_lock = threading.Lock()
+
+    def done(future):
+        with in_flight_lock:
+            in_flight.discard(future)
+
+    while True:
+        try:
+            raw = read_frame(reader)
+        except ValueError as e:
+            # Sin un prefijo de longitud fiable el flujo no se puede resincronizar:
+            # se avisa con -32600 y se cierra esta conexión (no el proceso)
+            send(RpcDispatcher._error(None, -32600, str(e)))
+            break
+        if raw is None:
+            break
+        future = executor.submit(handle, raw)
+        with in_flight_lock:
+            in_flight.add(future)
+        future.add_done_callback(done)
+
+    # Las respuestas pendientes salen antes de que se cierre la conexión
+    with in_flight_lock:
+        pending = list(in_flight)
+    wait(pending)
+
+
+# ---------------------------------------------------------------------------------------
+# TRANSPORTES
+# ---------------------------------------------------------------------------------------
+def serve_stdio(workers: int = 8) -> None:
+    # stdout queda reservado al protocolo: cualquier print va a stderr
+    out = sys.stdout.buffer
+    sys.stdout = sys.stderr
+    from main import app, start_services
+    start_services()
+
+    def write(frame: bytes):
+        out.write(frame)
+        out.flush()
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        serve_stream(RpcDispatcher(app), sys.stdin.buffer, write, executor)
+
+
+def serve_unix(path: str, workers: int = 8, ready: threading.Event | None = None,
+               servicios: bool = True) -> None:
+    from main import app, start_services
+    if servicios:
+        start_services()   # retención del historial, como en el servidor HTTP
+    dispatcher = RpcDispatcher(app)
+
+    # Solo se reemplaza un socket viejo: cualquier otra cosa en esa ruta es un error
+    try:
+        if not stat.S_ISSOCK(os.lstat(path).st_mode):
+            raise FileExistsError(f"{path} existe y no es un socket: no se reemplaza")
+        os.unlink(path)
+    except FileNotFoundError:
+        pass
+    server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    server.bind(path)
+    os.chmod(path, 0o600)   # solo el usuario del backend; antes de listen() nadie puede conectar
+    server.listen()
+    if ready is not None:
+        ready.set()
+
+    executor = ThreadPoolExecutor(max_workers=workers)
+
+    def client_loop(conn: socket.socket):
+        with conn, conn.makefile("rb") as reader:
+            serve_stream(dispatcher, reader, conn.sendall, executor)
+
+    try:
+        while True:
+            conn, _ = server.accept()
+            threading.Thread(target=client_loop, args=(conn,), daemon=True).start()
+    finally:
+        server.close()
+        executor.shutdown(wait=False)
+
+
+# ---------------------------------------------------------------------------------------
+# COMPARACIÓN DE LATENCIA (HTTP vs SOCKET UNIX)
+# ---------------------------------------------------------------------------------------
+def benchmark(n: int = 2000) -> None:
+    import http.client
+    import tempfile
+    from werkzeug.serving import make_server
+
+    sys.stdout, real_stdout = sys.stderr, sys.stdout
+    from main import app
+    sys.stdout = real_stdout
+
+    body = {"volumen_tanque": 100, "perfil_seleccionado": "lechuga"}
+    route = "/api/what_if"   # no escribe en el historial
+
+    # HTTP (Werkzeug, conexión keep-alive)
+    http_server = make_server("127.0.0.1", 0, app, threaded=True)
+    threading.Thread(target=http_server.serve_forever, daemon=True).start()
+    conn = http.client.HTTPConnection("127.0.0.1", http_server.server_port)
+    payload = json.dumps(body)
+    t0 = time.perf_counter()
+    for _ in range(n):
+        conn.request("POST", route, payload, {"Content-Type": "application/json"})
+        conn.getresponse().read()
+    http_seq = time.perf_counter() - t0
+    http_server.shutdown()
+
+    # RPC sobre socket Unix
+    sock_path = os.path.join(tempfile.mkdtemp(), "hydrosynapse.sock")
+    ready = threading.Event()
+    threading.Thread(target=serve_unix, args=(sock_path,), kwargs={"ready": ready, "servicios": False}, daemon=True).start()
+    ready.wait()
+    client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    client.connect(sock_path)
+    reader = client.makefile("rb")
+
+    t0 = time.perf_counter()
+    for i in range(n):
+        client.sendall(encode_frame({"jsonrpc": "2.0", "id": i, "method": route, "params": body}))
+        read_frame(reader)
+    rpc_seq = time.perf_counter() - t0
+
+    t0 = time.perf_counter()
+    client.sendall(b"".join(
+        encode_frame({"jsonrpc": "2.0", "id": i, "method": route, "params": body}) for i in range(n)
+    ))
+    for _ in range(n):
+        read_frame(reader)
+    rpc_pipe = time.perf_counter() - t0
+    client.close()
+
+    print(f"{n} peticiones {route}")
+    print(f"  HTTP keep-alive (secuencial): {http_seq / n * 1e6:8.1f} µs/petición")
+    print(f"  RPC socket Unix (secuencial): {rpc_seq / n * 1e6:8.1f} µs/petición")
+    print(f"  RPC socket Unix (pipelining): {rpc_pipe / n * 1e6:8.1f} µs/petición")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Transporte RPC de HydroSynapse")
+    group = parser.add_mutually_exclusive_group(required=True)
+    group.add_argument("--stdio", action="store_true", help="JSON-RPC sobre stdin/stdout")
+    group.add_argument("--socket", metavar="PATH", help="JSON-RPC sobre un socket Unix")
+    group.add_argument("--bench", type=int, metavar="N", help="comparar latencia con HTTP")
+    parser.add_argument("--workers", type=int, default=8)
+    args = parser.parse_args()
+
+    if args.stdio:
+        serve_stdio(args.workers)
+    elif args.socket:
+        serve_unix(args.socket, args.workers)
+    else:
+        benchmark(args.bench)
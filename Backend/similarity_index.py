@@ -0,0 +1,288 @@
+import json
+import threading
+import numpy as np
+from typing import Any, Dict, Hashable, Iterable, List, Tuple
+
+from calculator import NutrientCalculatorService
+
+
+class VectorIndex:
+    """
+    Índice de vectores denso en memoria (array numpy contiguo filas x dimensiones).
+
+    Las altas y bajas son O(1) amortizado: el array crece por duplicación y
+    un borrado mueve la última fila al hueco. La búsqueda calcula todas las
+    distancias de una vez (euclídea ponderada) y selecciona el top-k con
+    argpartition, sin recorrer las filas en Python.
+    """
+
+    def __init__(self, dims: int, capacity: int = 1024):
+        self.dims = dims
+        self._data = np.zeros((capacity, dims))
+        self._keys: List[Hashable] = []
+        self._rows: Dict[Hashable, int] = {}
+        self._meta: List[Dict[str, Any]] = []
+        self._lock = threading.RLock()
+
+    def __len__(self) -> int:
+        return len(self._keys)
+
+    @property
+    def vectors(self) -> np.ndarray:
+        return self._data[:len(self._keys)]
+
+    def _grow(self, needed: int):
+        capacity = self._data.shape[0]
+        if needed <= capacity:
+            return
+        while capacity < needed:
+            capacity *= 2
+        data = np.zeros((capacity, self.dims))
+        data[:len(self._keys)] = self.vectors
+        self._data = data
+
+    def upsert(self, key: Hashable, vector, meta: Dict[str, Any] | None = None):
+        with self._lock:
+            row = self._rows.get(key)
+            if row is None:
+                row = len(self._keys)
+                self._grow(row + 1)
+                self._keys.append(key)
+                self._meta.append({})
+                self._rows[key] = row
+            self._data[row] = vector
+            self._meta[row] = meta or {}
+
+    def upsert_many(self, keys: List[Hashable], vectors: np.ndarray, metas: List[Dict[str, Any]]):
+        """Alta en bloque (claves nuevas): una sola copia al array contiguo."""
+        with self._lock:
+            new = [k for k in keys if k not in self._rows]
+            if len(new) != len(keys):
+                for key, vec, meta in zip(keys, vectors, metas):
+                    self.upsert(key, vec, meta)
+                return
+            start = len(self._keys)
+            self._grow(start + len(keys))
+            self._data[start:start + len(keys)] = vectors
+            for offset, key in enumerate(keys):
+                self._rows[key] = start + offset
+            self._keys.extend(keys)
+            self._meta.extend(metas)
+
+    def remove(self, key: Hashable) -> bool:
+        with self._lock:
+            row = self._rows.pop(key, None)
+            if row is None:
+                return False
+            last = len(self._keys) - 1
+            if row != last:
+                self._data[row] = self._data[last]
+                self._keys[row] = self._keys[last]
+                self._meta[row] = self._meta[last]
+                self._rows[self._keys[row]] = row
+            self._keys.pop()
+            self._meta.pop()
+            return True
+
+    def search(self, queries: np.ndarray, k: int = 5, weights: np.ndarray | None = None
+               ) -> List[List[Tuple[Hashable, float, Dict[str, Any]]]]:
+        """
+        Top-k vecinos para cada fila de 'queries' (Q x dims).
+        Distancia: sqrt(sum_i w_i (q_i - x_i)^2). 'weights' es un vector (dims)
+        común a todas las consultas o una matriz (Q x dims) con pesos propios
+        por consulta (peso 0 = dimensión que no cuenta).
+        """
+        queries = np.atleast_2d(np.asarray(queries, dtype=float))
+        w = np.ones(self.dims) if weights is None else np.asarray(weights, dtype=float)
+        W = np.broadcast_to(w, queries.shape)
+
+        with self._lock:
+            X = self.vectors.copy()
+            keys = list(self._keys)
+            metas = list(self._meta)
+
+        n = X.shape[0]
+        if n == 0:
+            return [[] for _ in range(queries.shape[0])]
+        k = max(1, min(int(k), n))
+
+        # ||q - x||²_w = q·w·q + x·w·x - 2 (q·w)·x   (un solo producto matricial)
+        d2 = ((queries ** 2) * W).sum(axis=1)[:, None] + W @ (X ** 2).T - 2.0 * (queries * W) @ X.T
+        np.maximum(d2, 0, out=d2)
+
+        if k < n:
+            top = np.argpartition(d2, k - 1, axis=1)[:, :k]
+        else:
+            top = np.broadcast_to(np.arange(n), (queries.shape[0], n))
+        order = np.take_along_axis(d2, top, axis=1).argsort(axis=1)
+        top = np.take_along_axis(top, order, axis=1)
+        dist = np.sqrt(np.take_along_axis(d2, top, axis=1))
+
+        return [
+            [(keys[j], float(d), metas[j]) for j, d in zip(row_idx, row_dist)]
+            for row_idx, row_dist in zip(top, dist)
+        ]
+
+
+class SimilarityService:
+    """
+    Búsqueda del perfil más cercano y de recetas históricas similares.
+
+    Perfiles y recetas viven en el mismo espacio (ppm de N, P, K, Ca, Mg):
+    la receta se representa por las ppm que aportan sus dosis (A·x con x en
+    g/L), de modo que un análisis de laboratorio o un objetivo escrito por el
+    usuario se compara directamente con ambos índices. dosis_json se
+    decodifica una sola vez al construir el índice.
+
+    El índice de perfiles incluye los perfiles base del JSON (lechuga, tomate,
+    ...) además de los de SQLite; como en la calculadora, un perfil de SQLite
+    con el mismo nombre tapa al base.
+    """
+
+    def __init__(self, calc_service: NutrientCalculatorService):
+        self.calc = calc_service
+        self.nutrient_order = calc_service.nutrient_order
+        self.fert_index = {f: i for i, f in enumerate(calc_service.selected_ferts)}
+        self.profiles = VectorIndex(len(self.nutrient_order))
+        self.recipes = VectorIndex(len(self.nutrient_order), capacity=4096)
+
+    # -------------------------------------------------------------------------
+    # Construcción y mantenimiento
+    # -------------------------------------------------------------------------
+    def _profile_vector(self, profile: Dict[str, Any]) -> np.ndarray:
+        return np.array([float(profile.get(nut) or 0) for nut in self.nutrient_order])
+
+    def _dose_grams(self, dosis: Iterable[Dict[str, Any]]) -> np.ndarray:
+        grams = np.zeros(len(self.fert_index))
+        for d in dosis:
+            i = self.fert_index.get(d.get("nombre"))
+            if i is not None:
+                grams[i] = float(d.get("dosis_gramos", 0))
+        return grams
+
+    def _profile_meta(self, vector: np.ndarray, origen: str) -> Dict[str, Any]:
+        return {"ppm": self._format_ppm(vector), "origen": origen}
+
+    def load_profiles(self, profiles: List[Dict[str, Any]]):
+        """Perfiles de SQLite más los base del JSON que no estén sobrescritos."""
+        names = [p["nombre"] for p in profiles]
+        shadowed = set(names)
+        base = [(name, p) for name, p in self.calc.json_profiles.items() if name not in shadowed]
+        rows = list(profiles) + [p for _, p in base]
+        names += [name for name, _ in base]
+        origins = ["sqlite"] * len(profiles) + ["base"] * len(base)
+
+        vectors = np.array([self._profile_vector(p) for p in rows]).reshape(-1, len(self.nutrient_order))
+        self.profiles = VectorIndex(len(self.nutrient_order), capacity=max(1024, len(rows)))
+        self.profiles.upsert_many(
+            names, vectors, [self._profile_meta(v, o) for v, o in zip(vectors, origins)]
+        )
+
+    def load_history(self, rows: Iterable[Tuple], batch_size: int = 5000):
+        """rows: (id, timestamp, volumen_L, perfil_usado, ec_final, dosis_json), p. ej. db.iter_history()."""
+        self.recipes = VectorIndex(len(self.nutrient_order), capacity=4096)
+        batch: List[Tuple] = []
+        for row in rows:
+            batch.append(row)
+            if len(batch) == batch_size:
+                self._add_recipes(batch)
+                batch = []
+        if batch:
+            self._add_recipes(batch)
+
+    def _add_recipes(self, rows: List[Tuple]):
+        keys, grams, volumes, metas = [], [], [], []
+        for hid, timestamp, volumen_L, perfil, ec, dosis_json in rows:
+            try:
+                dosis = json.loads(dosis_json)
+            except (TypeError, ValueError):
+                continue
+            if not volumen_L or volumen_L <= 0:
+                continue
+            keys.append(hid)
+            grams.append(self._dose_grams(dosis))
+            volumes.append(float(volumen_L))
+            metas.append({"timestamp": timestamp, "perfil_usado": perfil,
+                          "volumen_L": float(volumen_L), "ec_final": ec})
+        if not keys:
+            return
+
+        grams = np.array(grams)
+        volumes = np.array(volumes)
+        # ppm aportadas = A · (g / L)
+        ppm = (grams / volumes[:, None]) @ self.calc.matrix_A.T
+        for meta, g, p in zip(metas, grams, ppm):
+            meta["dosis_gramos"] = {f: round(float(v), 2) for f, v in zip(self.fert_index, g) if v > 0}
+            meta["ppm"] = self._format_ppm(p)
+        self.recipes.upsert_many(keys, ppm, metas)
+
+    def on_profile_saved(self, profile: Dict[str, Any]):
+        vector = self._profile_vector(profile)
+        self.profiles.upsert(profile["nombre"], vector, self._profile_meta(vector, "sqlite"))
+
+    def on_profile_deleted(self, name: str):
+        # Si tapaba a un perfil base, el base vuelve a ser el vecino con ese nombre
+        base = self.calc.json_profiles.get(name)
+        if base is None:
+            self.profiles.remove(name)
+        else:
+            vector = self._profile_vector(base)
+            self.profiles.upsert(name, vector, self._profile_meta(vector, "base"))
+
+    def on_recipes_deleted(self, history_ids: Iterable[int]):
+        for hid in history_ids:
+            self.recipes.remove(hid)
+
+    def on_recipe_recorded(self, history_id: int, timestamp: str, volumen_L: float, perfil: str,
+                           ec_final: float, dosis_json: str):
+        self._add_recipes([(history_id, timestamp, volumen_L, perfil, ec_final, dosis_json)])
+
+    # -------------------------------------------------------------------------
+    # Consultas
+    # -------------------------------------------------------------------------
+    def _weights(self, pesos: Dict[str, float] | None) -> np.ndarray:
+        w = np.ones(len(self.nutrient_order))
+        for nut, value in (pesos or {}).items():
+            if nut not in self.nutrient_order:
+                raise ValueError(f"Nutriente desconocido en 'pesos': {nut}")
+            if float(value) < 0:
+                raise ValueError("Los pesos deben ser no negativos.")
+            w[self.nutrient_order.index(nut)] = float(value)
+        return w
+
+    def _format_ppm(self, vector: np.ndarray, mask: np.ndarray | None = None) -> Dict[str, float]:
+        return {nut: round(float(v), 2) for i, (nut, v) in enumerate(zip(self.nutrient_order, vector))
+                if mask is None or mask[i]}
+
+    def _query_mask(self, consulta: Dict[str, Any]) -> np.ndarray:
+        """Dimensiones presentes en la consulta: las que faltan no cuentan en la distancia."""
+        mask = np.array([consulta.get(nut) is not None for nut in self.nutrient_order])
+        if not mask.any():
+            raise ValueError(f"La consulta no trae ningún nutriente ({', '.join(self.nutrient_order)}).")
+        return mask
+
+    def nearest(self, consultas: List[Dict[str, Any]], k: int = 5, pesos: Dict[str, float] | None = None,
+                incluir: Iterable[str] = ("perfiles", "recetas")) -> List[Dict[str, Any]]:
+        """
+        consultas: [{"N": .., "P": .., ...}] (análisis de tanque u objetivo en ppm).
+        Devuelve, por consulta, los k perfiles y/o recetas más cercanos. Un
+        nutriente ausente de la consulta no se compara (peso 0 para esa
+        consulta), en vez de tomarse como 0 ppm.
+        """
+        if not consultas:
+            raise ValueError("Se requiere al menos una consulta.")
+        queries = np.array([self._profile_vector(q) for q in consultas])
+        masks = np.array([self._query_mask(q) for q in consultas])
+        w = self._weights(pesos) * masks
+        incluir = set(incluir)
+        results: List[Dict[str, Any]] = [{"consulta": self._format_ppm(q, m)} for q, m in zip(queries, masks)]
+
+        if "perfiles" in incluir:
+            for res, hits in zip(results, self.profiles.search(queries, k, w)):
+                res["perfiles"] = [{"nombre": name, "distancia": round(dist, 3), **meta} for name, dist, meta in hits]
+
+        if "recetas" in incluir:
+            for res, hits in zip(results, self.recipes.search(queries, k, w)):
+                res["recetas"] = [{"id": hid, "distancia": round(dist, 3), **meta} for hid, dist, meta in hits]
+
+        return results
@@ -0,0 +1,237 @@
+import os
+import re
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List
+
+from flask import Flask, g, jsonify, request
+
+from calculator import NutrientCalculatorService
+from database import SQLiteDatabase
+from discrete_dosing import DiscreteDosingService
+from fertilizer_catalog import FertilizerCatalog
+from history_retention import HistoryRetentionService
+from history_series import HistorySeriesService
+from profile_bulk import ProfileBulkService
+from similarity_index import SimilarityService
+from stock_optimizer import StockSolutionOptimizer
+from tank_simulator import TankSimulatorService
+
+DEFAULT_SITE = "principal"
+SITE_HEADER = "X-Site"
+SITE_PARAM = "site"
+SITE_ID = re.compile(r"[a-z0-9][a-z0-9_-]{0,39}")   # con fullmatch: "$" aceptaría un "\n" final
+
+
+class Site:
+    """
+    Servicios ligados a la base de datos de un sitio (invernadero).
+
+    Cada sitio tiene su propio archivo SQLite y su propio SQLiteDatabase (el
+    gestor de conexiones del sitio), así que las escrituras pesadas de uno
+    (importaciones, retención) nunca bloquean a los demás. Calculadora,
+    índices de similitud, retención y series se construyen sobre esa base.
+    """
+
+    def __init__(self, site_id: str, db: SQLiteDatabase, cache: Any = None):
+        self.id = site_id
+        self.db = db
+
+        try:
+            profiles = db.get_all_profiles()
+        except Exception as e:
+            print(f"[Site:{site_id}] Error cargando perfiles iniciales: {e}")
+            profiles = []
+
+        # Calculadora con los perfiles del sitio (Ax = b); la matriz A sale del
+        # catálogo de fertilizantes del sitio y se rehace cuando cambia su versión
+        self.calc = NutrientCalculatorService(external_profiles=profiles, cache=cache)
+        self.catalog = FertilizerCatalog(db)
+        self.catalog.subscribe(self.calc.set_fertilizers)
+        self.tank_simulator = TankSimulatorService(self.calc)
+        self.discrete = DiscreteDosingService(self.calc)
+        self.stock_optimizer = StockSolutionOptimizer(self.calc)
+
+        # Índices de vecinos cercanos: perfiles y recetas del historial (en ppm)
+        self.similarity = SimilarityService(self.calc)
+        try:
+            self.similarity.load_profiles(profiles)
+            self.similarity.load_history(db.iter_history())
+        except Exception as e:
+            print(f"[Site:{site_id}] Error construyendo índices de similitud: {e}")
+
+        self.retention = HistoryRetentionService(db, on_deleted=self.similarity.on_recipes_deleted)
+        self.series = HistorySeriesService(db, self.calc.selected_ferts)
+        self.bulk = ProfileBulkService(db)
+
+
+class SiteRegistry:
+    """
+    Enrutado por sitio: cada petición trabaja sobre la base del sitio indicado
+    en la cabecera X-Site o el parámetro ?site= (sin ninguno, el sitio por
+    defecto, que usa el hidrosynapse.db de siempre). Los demás sitios viven en
+    sites/<sitio>.db y se cargan la primera vez que se piden.
+
+    Los informes entre sitios (map) se reparten en un pool de hilos: sqlite3
+    libera el GIL mientras ejecuta cada consulta, así que corren en paralelo.
+    """
+
+    def __init__(self, base_dir: str | None = None, sites_dir: str = "sites",
+                 default_db: str = "hidrosynapse.db", workers: int = 4, cache: Any = None):
+        self.base_dir = base_dir or os.path.dirname(os.path.abspath(__file__))
+        self.sites_dir = os.path.join(self.base_dir, sites_dir)
+        self.default_db = default_db
+        self.workers = workers
+        self.cache = cache   # WarmCache compartida: los artefactos compilados no dependen del sitio
+        self._sites: Dict[str, Site] = {}
+        self._lock = threading.Lock()
+        self._background = False
+
+    # -------------------------------------------------------------------------
+    # Sitios
+    # -------------------------------------------------------------------------
+    def _path(self, site_id: str) -> str:
+        if site_id == DEFAULT_SITE:
+            return os.path.join(self.base_dir, self.default_db)
+        return os.path.join(self.sites_dir, f"{site_id}.db")
+
+    @staticmethod
+    def validate_id(site_id: str) -> str:
+        site_id = (site_id or "").strip().lower()
+        if not SITE_ID.fullmatch(site_id):
+            raise ValueError("Identificador de sitio inválido (a-z, 0-9, '-' y '_', máx. 40).")
+        return site_id
+
+    def get(self, site_id: str = DEFAULT_SITE, create: bool = False) -> Site:
+        """Sitio cargado (o lo abre). KeyError si no existe y create=False."""
+        site_id = self.validate_id(site_id)
+        site = self._sites.get(site_id)
+        if site is not None:
+            return site
+        with self._lock:
+            site = self._sites.get(site_id)
+            if site is None:
+                path = self._path(site_id)
+                if site_id != DEFAULT_SITE and not os.path.exists(path):
+                    if not create:
+                        raise KeyError(f"Sitio desconocido: {site_id}")
+                    os.makedirs(self.sites_dir, exist_ok=True)
+                site = Site(site_id, SQLiteDatabase(path), cache=self.cache)
+                self._sites[site_id] = site
+                if self._background:
+                    site.retention.start()
+        return site
+
+    def list(self) -> List[str]:
+        names = {DEFAULT_SITE, *self._sites}
+        if os.path.isdir(self.sites_dir):
+            names.update(f[:-3] for f in os.listdir(self.sites_dir)
+                         if f.endswith(".db") and SITE_ID.fullmatch(f[:-3]))
+        return sorted(names)
+
+    def start_background(self):
+        """Retención en segundo plano para los sitios cargados y los que se abran después."""
+        self._background = True
+        for site in list(self._sites.values()):
+            site.retention.start()
+
+    # -------------------------------------------------------------------------
+    # Integración con Flask
+    # -------------------------------------------------------------------------
+    def init_app(self, app: Flask):
+        app.before_request(self._before_request)
+
+    def _before_request(self):
+        site_id = request.headers.get(SITE_HEADER) or request.args.get(SITE_PARAM)
+        try:
+            site = self.get(site_id) if site_id else self.get(DEFAULT_SITE)
+        except ValueError as e:
+            return jsonify({"success": False, "error": str(e)}), 400
+        except KeyError as e:
+            return jsonify({"success": False, "error": e.args[0]}), 404
+        g.site = site
+        # Cambios del catálogo hechos por otro proceso (comprobación espaciada)
+        site.catalog.refresh()
+        return None
+
+    def current(self) -> Site:
+        """Sitio de la petición en curso (el por defecto si no se indicó ninguno)."""
+        return g.get("site") or self.get(DEFAULT_SITE)
+
+    # -------------------------------------------------------------------------
+    # Informes entre sitios
+    # -------------------------------------------------------------------------
+    def map(self, fn: Callable[[Site], Any], site_ids: List[str] | None = None) -> Dict[str, Dict[str, Any]]:
+        """
+        Ejecuta fn(sitio) en paralelo; devuelve {sitio: {"resultado": ...}} o
+        {sitio: {"error": ...}} sin que el fallo de uno tumbe el informe.
+        """
+        site_ids = [self.validate_id(s) for s in site_ids] if site_ids else self.list()
+
+        def run(site_id: str) -> Dict[str, Any]:
+            try:
+                return {"resultado": fn(self.get(site_id))}
+            except KeyError as e:
+                return {"error": e.args[0]}
+            except Exception as e:
+                return {"error": str(e)}
+
+        with ThreadPoolExecutor(max_workers=max(1, min(self.workers, len(site_ids)))) as pool:
+            return dict(zip(site_ids, pool.map(run, site_ids)))
+
+
+# ---------------------------------------------------------------------------------------
+# FUSIÓN DE INFORMES
+# ---------------------------------------------------------------------------------------
+def _ok(results: Dict[str, Dict[str, Any]]) -> List[Any]:
+    return [r["resultado"] for r in results.values() if "resultado" in r]
+
+
+def merge_rollups(results: Dict[str, Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """
+    Agregados de varios sitios sumados por periodo. La EC media se pondera
+    por el n de los agregados que traen EC: los que no la traen no diluyen
+    la media.
+    """
+    merged: Dict[str, Dict[str, Any]] = {}
+    ec_sum: Dict[str, float] = {}
+    ec_n: Dict[str, int] = {}
+    for rows in _ok(results):
+        for r in rows:
+            m = merged.setdefault(r["periodo"], {
+                "periodo": r["periodo"], "n": 0, "volumen_total_L": 0.0,
+                "ec_min": None, "ec_max": None, "dosis_gramos": {},
+            })
+            m["n"] += r["n"]
+            m["volumen_total_L"] += r["volumen_total_L"]
+            if r["ec_media"] is not None:
+                ec_sum[r["periodo"]] = ec_sum.get(r["periodo"], 0.0) + r["ec_media"] * r["n"]
+                ec_n[r["periodo"]] = ec_n.get(r["periodo"], 0) + r["n"]
+            if r["ec_min"] is not None:
+                m["ec_min"] = r["ec_min"] if m["ec_min"] is None else min(m["ec_min"], r["ec_min"])
+            if r["ec_max"] is not None:
+                m["ec_max"] = r["ec_max"] if m["ec_max"] is None else max(m["ec_max"], r["ec_max"])
+            for nombre, g in r["dosis_gramos"].items():
+                m["dosis_gramos"][nombre] = m["dosis_gramos"].get(nombre, 0.0) + g
+
+    out = []
+    for periodo in sorted(merged):
+        m = merged[periodo]
+        m["volumen_total_L"] = round(m["volumen_total_L"], 2)
+        m["ec_media"] = round(ec_sum[periodo] / ec_n[periodo], 3) if ec_n.get(periodo) else None
+        m["dosis_gramos"] = {k: round(v, 2) for k, v in sorted(m["dosis_gramos"].items())}
+        out.append(m)
+    return out
+
+
+def merge_consumption(results: Dict[str, Dict[str, Any]]) -> Dict[str, Any]:
+    """Consumo total de todos los sitios: recetas, litros y gramos por fertilizante."""
+    total = {"recetas": 0, "volumen_L": 0.0, "dosis_gramos": {}}
+    for r in _ok(results):
+        total["recetas"] += r["recetas"]
+        total["volumen_L"] += r["volumen_L"]
+        for nombre, g in r["dosis_gramos"].items():
+            total["dosis_gramos"][nombre] = total["dosis_gramos"].get(nombre, 0.0) + g
+    total["volumen_L"] = round(total["volumen_L"], 2)
+    total["dosis_gramos"] = {k: round(v, 2) for k, v in sorted(total["dosis_gramos"].items())}
+    return total
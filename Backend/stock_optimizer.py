@@ -0,0 +1,365 @@
+import json
+import os
+import time
+import numpy as np
+from typing import Any, Dict, List, Tuple
+
+from calculator import NutrientCalculatorService
+
+# Iones que no pueden compartir tanque concentrado (precipitan CaSO4 / fosfatos de Ca)
+CALCIUM_IONS = {"Ca"}
+PRECIPITANT_IONS = {"SO4", "PO4_T"}
+
+
+def box_qp(G: np.ndarray, h: np.ndarray, upper: np.ndarray, x0: np.ndarray, max_iter: int = 100) -> np.ndarray:
+    """
+    min ½xᵀGx − hᵀx  con 0 ≤ x ≤ upper (conjunto activo primal).
+
+    Para las pocas sales de un tanque converge en unas cuantas resoluciones
+    de un sistema pequeño; parte de x0 (la solución de la iteración anterior).
+    """
+    n = len(h)
+    x = np.clip(x0, 0, upper).astype(float)
+    ridge = 1e-12 * max(1.0, float(np.abs(np.diag(G)).max(initial=0.0)))
+    at_lo, at_hi = x <= 0, x >= upper
+    for _ in range(max_iter):
+        free = ~(at_lo | at_hi)
+        z = x.copy()
+        if free.any():
+            rhs = h[free] - G[np.ix_(free, ~free)] @ x[~free]
+            z[free] = np.linalg.solve(G[np.ix_(free, free)] + ridge * np.eye(int(free.sum())), rhs)
+
+        violating = free & ((z < 0) | (z > upper))
+        if violating.any():
+            # Avanzar hasta la primera cota que se cruza y fijar esa variable
+            d = z - x
+            with np.errstate(divide="ignore", invalid="ignore"):
+                steps = np.where(d < 0, -x / d, np.where(d > 0, (upper - x) / d, np.inf))
+            steps = np.where(violating, steps, np.inf)
+            k = int(np.argmin(steps))
+            x = x + max(0.0, min(1.0, float(steps[k]))) * d
+            x = np.clip(x, 0, upper)
+            if d[k] < 0:
+                at_lo[k], x[k] = True, 0.0
+            else:
+                at_hi[k], x[k] = True, upper[k]
+            continue
+
+        x = z
+        # KKT: en la cota inferior el gradiente debe ser ≥ 0; en la superior, ≤ 0
+        grad = G @ x - h
+        wrong = np.where(at_lo, -grad, 0.0) + np.where(at_hi, grad, 0.0)
+        k = int(np.argmax(wrong))
+        if wrong[k] <= 1e-12 * max(1.0, float(np.abs(h).max(initial=0.0))):
+            break
+        at_lo[k] = at_hi[k] = False
+    return x
+
+
+def _ratios_step(ua: np.ndarray, ub: np.ndarray, target: np.ndarray, rmax: float) -> np.ndarray:
+    """
+    Razones de inyección óptimas (r_A, r_B) en [0, rmax]² para todas las zonas
+    a la vez: el óptimo de una cuadrática convexa en una caja está en el
+    interior o en una de sus aristas, así que se evalúan los 5 candidatos
+    (cerrados) y se elige el mejor por zona.
+
+    ua, ub, target: (zonas, nutrientes), ya ponderados.
+    """
+    gaa = np.einsum("zn,zn->z", ua, ua)
+    gbb = np.einsum("zn,zn->z", ub, ub)
+    gab = np.einsum("zn,zn->z", ua, ub)
+    ha = np.einsum("zn,zn->z", ua, target)
+    hb = np.einsum("zn,zn->z", ub, target)
+    safe_a = np.maximum(gaa, 1e-300)
+    safe_b = np.maximum(gbb, 1e-300)
+
+    det = gaa * gbb - gab ** 2
+    ok = det > 1e-12 * np.maximum(gaa * gbb, 1e-300)
+    det = np.where(ok, det, 1.0)
+    free_a = (gbb * ha - gab * hb) / det
+    free_b = (gaa * hb - gab * ha) / det
+    ok &= (free_a >= 0) & (free_a <= rmax) & (free_b >= 0) & (free_b <= rmax)
+
+    zero = np.zeros_like(gaa)
+    full = np.full_like(gaa, rmax)
+    cand_a = np.stack([
+        free_a, zero, full,
+        np.clip(ha / safe_a, 0, rmax), np.clip((ha - gab * rmax) / safe_a, 0, rmax),
+    ])
+    cand_b = np.stack([
+        free_b, np.clip(hb / safe_b, 0, rmax), np.clip((hb - gab * rmax) / safe_b, 0, rmax),
+        zero, full,
+    ])
+    obj = 0.5 * (gaa * cand_a ** 2 + 2 * gab * cand_a * cand_b + gbb * cand_b ** 2) - ha * cand_a - hb * cand_b
+    obj[0] = np.where(ok, obj[0], np.inf)
+    best = obj.argmin(axis=0)
+    cols = np.arange(len(gaa))
+    return np.stack([cand_a[best, cols], cand_b[best, cols]], axis=1)
+
+
+class StockSolutionOptimizer:
+    """
+    Optimizador de concentrados A/B para riego multi-zona.
+
+    En producción no se disuelven sales en cada tanque: se preparan dos
+    concentrados (A y B) que los inyectores diluyen en cada zona de riego,
+    cada una con su perfil. Se eligen a la vez la composición de los
+    concentrados (g/L de cada sal) y las razones de inyección de cada zona
+    (L de concentrado por L de agua) para aproximar todos los perfiles:
+
+        ppm_z = r_Az · P_A c_A + r_Bz · P_B c_B
+
+    Restricciones:
+      - El calcio va solo en A; sulfatos y fosfatos solo en B. Las sales sin
+        conflicto (KNO3, NH4NO3...) pueden repartirse entre ambos.
+      - 0 ≤ c ≤ solubilidad · factor_seguridad (data/solubility.json).
+      - 0 ≤ r ≤ razon_max; al final se concentra cada tanque lo más posible
+        respetando razon_min en las zonas activas (menos litros de concentrado).
+
+    El problema es bilineal: se resuelve por mínimos cuadrados alternados
+    (composición con las razones fijas y viceversa), cada paso acotado y
+    vectorizado sobre todas las zonas. El error es relativo por nutriente.
+    """
+
+    def __init__(self, calc: NutrientCalculatorService):
+        self.base_path = os.path.dirname(os.path.abspath(__file__))
+        self.calc = calc
+        self.nutrient_order = calc.nutrient_order
+        self.ferts = calc.selected_ferts
+        self.salt_ions = self._load_json("data/salt_ions.json")
+        self.solubility = self._load_json("data/solubility.json")
+        self.groups = self._compatibility_groups()
+
+    def _load_json(self, path):
+        """Carga un archivo JSON relativo al script."""
+        full_path = os.path.join(self.base_path, path)
+        with open(full_path, "r", encoding="utf-8") as f:
+            return json.load(f)
+
+    def _compatibility_groups(self) -> Dict[str, List[str]]:
+        """Sales admitidas en cada tanque según sus iones (las Ca + SO4/PO4 quedan fuera)."""
+        groups: Dict[str, List[str]] = {"A": [], "B": [], "excluidas": []}
+        for fert in self.ferts:
+            ions = set(self.salt_ions.get(fert, {}).get("iones", {}))
+            has_ca, has_precip = bool(ions & CALCIUM_IONS), bool(ions & PRECIPITANT_IONS)
+            if has_ca and has_precip:
+                groups["excluidas"].append(fert)
+                continue
+            if not has_precip:
+                groups["A"].append(fert)
+            if not has_ca:
+                groups["B"].append(fert)
+        return groups
+
+    # -------------------------------------------------------------------------
+    # Entrada
+    # -------------------------------------------------------------------------
+    def _targets(self, zonas: List[Dict[str, Any]]) -> Tuple[List[str], np.ndarray, np.ndarray]:
+        names, targets, weights = [], [], []
+        for k, zona in enumerate(zonas):
+            if zona.get("objetivo"):
+                objetivo = zona["objetivo"]
+            elif zona.get("perfil"):
+                objetivo = self.calc.get_profile_data(zona["perfil"])
+            else:
+                raise ValueError(f"Zona {k}: falta 'perfil' u 'objetivo'.")
+            names.append(str(zona.get("zona", zona.get("perfil", k))))
+            targets.append([float(objetivo.get(nut, 0) or 0) for nut in self.nutrient_order])
+            weights.append(float(zona.get("peso", 1.0)))
+        targets = np.array(targets, dtype=float)
+        weights = np.array(weights, dtype=float)
+        if not np.isfinite(targets).all() or not np.isfinite(weights).all():
+            raise ValueError("Objetivos y pesos deben ser números finitos.")
+        if (targets < 0).any() or (weights < 0).any():
+            raise ValueError("Objetivos y pesos deben ser no negativos.")
+        return names, targets, weights
+
+    def _upper_bounds(self, columns: List[str], factor: float) -> np.ndarray:
+        limits = self.solubility["solubilidad_g_L"]
+        missing = [f for f in columns if f not in limits]
+        if missing:
+            raise ValueError(f"Sin dato de solubilidad para: {', '.join(missing)}")
+        return np.array([float(limits[f]) * factor for f in columns])
+
+    # -------------------------------------------------------------------------
+    # Optimización
+    # -------------------------------------------------------------------------
+    def _solve(self, P: np.ndarray, targets: np.ndarray, w: np.ndarray, upper: np.ndarray,
+               c0: np.ndarray, n_a: int, rmax: float, max_iter: int, tol: float):
+        """Mínimos cuadrados alternados desde una composición inicial; devuelve (c, r, obj, iteraciones)."""
+        c = c0.copy()
+        wt = w * targets
+        prev = np.inf
+        it = 0
+        for it in range(1, max_iter + 1):
+            # 1) Razones con la composición fija (cerrado, todas las zonas a la vez)
+            ua = w * (P[:, :n_a] @ c[:n_a])
+            ub = w * (P[:, n_a:] @ c[n_a:])
+            r = _ratios_step(ua, ub, wt, rmax)
+
+            # 2) Composición con las razones fijas: QP acotado sobre la suma de zonas.
+            # Como la ponderación es diagonal por zona, las ecuaciones normales solo
+            # necesitan sumas por nutriente: O(zonas · nutrientes) por iteración.
+            w2 = w * w
+            s_aa = (r[:, 0, None] ** 2 * w2).sum(axis=0)
+            s_bb = (r[:, 1, None] ** 2 * w2).sum(axis=0)
+            s_ab = (r[:, 0, None] * r[:, 1, None] * w2).sum(axis=0)
+            t_a = (r[:, 0, None] * w2 * targets).sum(axis=0)
+            t_b = (r[:, 1, None] * w2 * targets).sum(axis=0)
+            PA, PB = P[:, :n_a], P[:, n_a:]
+            G = np.block([
+                [PA.T @ (s_aa[:, None] * PA), PA.T @ (s_ab[:, None] * PB)],
+                [PB.T @ (s_ab[:, None] * PA), PB.T @ (s_bb[:, None] * PB)],
+            ])
+            h = np.concatenate([PA.T @ t_a, PB.T @ t_b])
+            c = box_qp(G, h, upper, c)
+
+            resid = w * (r[:, 0, None] * (PA @ c[:n_a]) + r[:, 1, None] * (PB @ c[n_a:])) - wt
+            obj = float(np.einsum("zn,zn->", resid, resid))
+            if np.isfinite(prev) and prev - obj <= tol * max(prev, 1e-12):
+                break
+            prev = obj
+        return c, r, obj, it
+
+    def optimize(
+        self,
+        zonas: List[Dict[str, Any]],
+        razon_min: float = 0.002,
+        razon_max: float = 0.02,
+        factor_seguridad: float | None = None,
+        volumen_stock_L: float | None = None,
+        max_iter: int = 300,
+        tol: float = 1e-9,
+    ) -> Dict[str, Any]:
+        """
+        zonas: [{"zona", "perfil" | "objetivo": {N, P, K, Ca, Mg}, "peso"?, "volumen_L"?}]
+        razon_min / razon_max: rango del inyector (0.01 = 1:100).
+        volumen_stock_L: si se indica, gramos de cada sal para preparar ese volumen de A y de B.
+        """
+        t0 = time.perf_counter()
+        if not zonas:
+            raise ValueError("Falta lista 'zonas'.")
+        if not 0 <= razon_min < razon_max <= 1:
+            raise ValueError("Se requiere 0 ≤ razon_min < razon_max ≤ 1.")
+        factor = float(self.solubility.get("factor_seguridad", 1.0) if factor_seguridad is None else factor_seguridad)
+        if not 0 < factor <= 1:
+            raise ValueError("factor_seguridad debe estar en (0, 1].")
+
+        names, targets, weights = self._targets(zonas)
+        cols_a, cols_b = self.groups["A"], self.groups["B"]
+        columns = cols_a + cols_b
+        n_a = len(cols_a)
+        fert_idx = [self.ferts.index(f) for f in columns]
+        P = self.calc.matrix_A[:, fert_idx]                       # ppm por g/L diluido
+        upper = self._upper_bounds(columns, factor)
+        # Error relativo por nutriente (K 300 ppm y Mg 50 ppm pesan igual) y peso de la zona
+        w = np.sqrt(weights)[:, None] / np.maximum(targets, 1.0)
+
+        # Arranques: dosis media de un tanque único, con las sales compartidas en A, en B o a medias
+        x_mean = np.clip(self.calc.solve_many(targets), 0, None).mean(axis=0) / (razon_max / 2)
+        shared = np.array([f in cols_a and f in cols_b for f in columns])
+        starts = []
+        for share_a in (1.0, 0.0, 0.5):
+            c0 = np.array([x_mean[self.ferts.index(f)] for f in columns])
+            c0[:n_a][shared[:n_a]] *= share_a
+            c0[n_a:][shared[n_a:]] *= 1.0 - share_a
+            starts.append(np.minimum(c0, upper))
+
+        best = None
+        for c0 in starts:
+            sol = self._solve(P, targets, w, upper, c0, n_a, razon_max, max_iter, tol)
+            if best is None or sol[2] < best[2]:
+                best = sol
+        c, r, obj, iterations = best
+
+        c, r, avisos = self._concentrate(c, r, n_a, upper, razon_min, razon_max)
+        delivered = r[:, 0, None] * (P[:, :n_a] @ c[:n_a]) + r[:, 1, None] * (P[:, n_a:] @ c[n_a:])
+
+        return self._report(
+            names, zonas, targets, delivered, c, r, columns, n_a, upper, factor,
+            volumen_stock_L, avisos, obj, iterations, (time.perf_counter() - t0) * 1000,
+        )
+
+    @staticmethod
+    def _concentrate(c: np.ndarray, r: np.ndarray, n_a: int, upper: np.ndarray,
+                     razon_min: float, razon_max: float):
+        """
+        c·r es lo que llega a cada zona: se escala cada tanque (c·s, r/s) para
+        que quede lo más concentrado posible sin pasar la solubilidad ni bajar
+        de razon_min en las zonas que lo usan.
+        """
+        avisos = []
+        for k, (sl, tank) in enumerate(((slice(0, n_a), "A"), (slice(n_a, len(c)), "B"))):
+            active = r[:, k] > 0
+            cs = c[sl]
+            if not active.any() or not (cs > 0).any():
+                r[:, k] = 0.0
+                continue
+            s_sol = float(np.min(upper[sl][cs > 0] / cs[cs > 0]))
+            s_min = float(r[active, k].min() / razon_min) if razon_min > 0 else np.inf
+            s_max = float(r[active, k].max() / razon_max)       # escalas menores subirían r por encima del máximo
+            s = min(s_sol, s_min)
+            if s < s_max:
+                s = s_max
+                avisos.append(
+                    f"Tanque {tank}: las zonas piden razones demasiado distintas para el rango del inyector; "
+                    f"alguna queda por debajo de razon_min."
+                )
+            c[sl] = cs * s
+            r[:, k] = r[:, k] / s
+        return c, r, avisos
+
+    def _report(self, names, zonas, targets, delivered, c, r, columns, n_a, upper, factor,
+                volumen_stock_L, avisos, obj, iterations, elapsed_ms) -> Dict[str, Any]:
+        rel_err = (delivered - targets) / np.maximum(targets, 1.0)
+
+        tanques = {}
+        for k, (sl, tank) in enumerate(((slice(0, n_a), "A"), (slice(n_a, len(c)), "B"))):
+            salts = {f: round(float(g), 2) for f, g in zip(columns[sl], c[sl]) if g > 1e-9}
+            info: Dict[str, Any] = {
+                "g_L": salts,
+                "carga_total_g_L": round(float(c[sl].sum()), 2),
+                "uso_solubilidad": {
+                    f: round(float(g / (u / factor)), 3) for f, g, u in zip(columns[sl], c[sl], upper[sl]) if g > 1e-9
+                },
+            }
+            if volumen_stock_L:
+                info["volumen_L"] = float(volumen_stock_L)
+                info["gramos"] = {f: round(g * float(volumen_stock_L), 1) for f, g in salts.items()}
+            tanques[tank] = info
+
+        zonas_out = []
+        consumo = np.zeros(2)
+        for z, name in enumerate(names):
+            item: Dict[str, Any] = {
+                "zona": name,
+                "perfil": zonas[z].get("perfil"),
+                "razon_A": round(float(r[z, 0]), 6),
+                "razon_B": round(float(r[z, 1]), 6),
+                "dilucion_A": f"1:{round(1 / r[z, 0])}" if r[z, 0] > 0 else None,
+                "dilucion_B": f"1:{round(1 / r[z, 1])}" if r[z, 1] > 0 else None,
+                "objetivo": dict(zip(self.nutrient_order, np.round(targets[z], 2).tolist())),
+                "obtenido": dict(zip(self.nutrient_order, np.round(delivered[z], 2).tolist())),
+                "error_rel": dict(zip(self.nutrient_order, np.round(rel_err[z], 4).tolist())),
+            }
+            if zonas[z].get("volumen_L"):
+                stock = r[z] * float(zonas[z]["volumen_L"])
+                consumo += stock
+                item["concentrado_L"] = {"A": round(float(stock[0]), 3), "B": round(float(stock[1]), 3)}
+            zonas_out.append(item)
+
+        result = {
+            "success": True,
+            "compatibilidad": {k: list(v) for k, v in self.groups.items()},
+            "tanques": tanques,
+            "zonas": zonas_out,
+            "error_rms_rel": round(float(np.sqrt(np.mean(rel_err ** 2))), 5),
+            "error_max_rel": round(float(np.abs(rel_err).max()), 5),
+            "objetivo_ponderado": round(obj, 6),
+            "iteraciones": iterations,
+            "tiempo_ms": round(elapsed_ms, 2),
+            "avisos": avisos,
+        }
+        if consumo.any():
+            result["concentrado_total_L"] = {"A": round(float(consumo[0]), 3), "B": round(float(consumo[1]), 3)}
+        return result
@@ -0,0 +1,233 @@
+import json
+import math
+import os
+import numpy as np
+from typing import Any, Dict, Iterator, List
+
+from calculator import NutrientCalculatorService
+from chemistry_engine import ConcentrationEngine
+
+
+class TankSimulatorService:
+    """
+    Simulador de agotamiento de tanques y programación de recargas.
+
+    Integra en el tiempo, para cientos de tanques a la vez (arrays numpy
+    tanques x nutrientes), el consumo de agua y nutrientes de cada cultivo:
+      - la transpiración se lleva agua y nutrientes (absorcion_ppm por litro)
+      - la evaporación se lleva solo agua (concentra la solución)
+
+    Cuando un tanque baja de nivel o se desvía del perfil, se emite un evento
+    de recarga: se repone el agua y se dosifican sales con la calculadora.
+    """
+
+    def __init__(self, calc_service: NutrientCalculatorService, max_pasos: int = 100_000,
+                 max_frames: int = 2_000, max_tanques: int = 1_000, max_recargas: int = 100_000):
+        self.base_path = os.path.dirname(os.path.abspath(__file__))
+        self.calc = calc_service
+        # Topes por simulación: pasos de integración, frames emitidos, tanques y
+        # eventos de recarga (cota a priori: una recarga por tanque e intervalo)
+        self.max_pasos = max_pasos
+        self.max_frames = max_frames
+        self.max_tanques = max_tanques
+        self.max_recargas = max_recargas
+        self.concentration = ConcentrationEngine()
+        self.nutrient_order = calc_service.nutrient_order
+        self.uptake_rates = self._load_json('data/uptake_rates.json')
+
+    def _load_json(self, path):
+        """Carga un archivo JSON relativo al script."""
+        full_path = os.path.join(self.base_path, path)
+        with open(full_path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+
+    def _crop_for(self, tank: Dict[str, Any]) -> Dict[str, Any]:
+        """Tasa de absorción del cultivo: campo 'cultivo' o primera palabra del perfil."""
+        crop = tank.get("cultivo") or str(tank["perfil"]).split(" ")[0].lower()
+        return self.uptake_rates.get(crop, self.uptake_rates["default"])
+
+    def _prepare(self, tanks: List[Dict[str, Any]]) -> Dict[str, np.ndarray]:
+        n = len(tanks)
+        targets = np.zeros((n, len(self.nutrient_order)))
+        uptake = np.zeros_like(targets)
+        transp = np.zeros(n)
+        evap = np.zeros(n)
+        vol0 = np.zeros(n)
+
+        for k, tank in enumerate(tanks):
+            profile = self.calc.get_profile_data(tank["perfil"])
+            crop = self._crop_for(tank)
+            targets[k] = [float(profile[nut]) for nut in self.nutrient_order]
+            uptake[k] = [float(crop["absorcion_ppm"].get(nut, 0)) for nut in self.nutrient_order]
+            transp[k] = float(tank.get("plantas", 0)) * float(crop["transpiracion_L_dia_planta"]) / 24.0
+            evap[k] = float(tank.get("evaporacion_L_dia", 0)) / 24.0
+            vol0[k] = float(tank["volumen_L"])
+
+        if (vol0 <= 0).any():
+            raise ValueError("El volumen de cada tanque debe ser mayor que cero.")
+
+        ppm0 = np.array([
+            [float(t["ppm_inicial"].get(nut, targets[k, i])) for i, nut in enumerate(self.nutrient_order)]
+            if t.get("ppm_inicial") else targets[k]
+            for k, t in enumerate(tanks)
+        ])
+
+        return {
+            "targets": targets, "uptake": uptake, "transp": transp,
+            "evap": evap, "vol0": vol0, "ppm0": ppm0,
+        }
+
+    def _top_up(self, idx: np.ndarray, mass_mg: np.ndarray, vol: np.ndarray, st: Dict[str, np.ndarray]):
+        """Repone agua hasta el volumen nominal y dosifica sales hacia el perfil."""
+        water_L = st["vol0"][idx] - vol[idx]
+        vol[idx] = st["vol0"][idx]
+
+        ppm_diluted = mass_mg[idx] / vol[idx, None]
+        deficit = np.clip(st["targets"][idx] - ppm_diluted, 0, None)
+        x_gl = np.clip(self.calc.solve_many(deficit), 0, None)
+        grams = x_gl * vol[idx, None]
+
+        # Aporte de las sales: ppm = A·x  →  mg = ppm · L
+        mass_mg[idx] += (x_gl @ self.calc.matrix_A.T) * vol[idx, None]
+        return water_L, grams
+
+    def run(
+        self,
+        tanks: List[Dict[str, Any]],
+        horas: float = 168.0,
+        paso_h: float = 1.0,
+        frame_cada_h: float = 6.0,
+        tolerancia: float = 0.15,
+        nivel_minimo: float = 0.8,
+        intervalo_min_h: float = 12.0,
+        as_arrays: bool = False,
+    ) -> Iterator[Dict[str, Any]]:
+        """
+        Genera frames de series de tiempo y eventos de recarga.
+
+        tanks: [{"id", "perfil", "volumen_L", "plantas", "cultivo"?,
+                 "evaporacion_L_dia"?, "ppm_inicial"?}]
+        tolerancia: déficit relativo máximo respecto al perfil antes de recargar.
+        nivel_minimo: fracción del volumen nominal que dispara una recarga.
+        intervalo_min_h: tiempo mínimo entre recargas de un mismo tanque (evita
+                         recargar en cada paso si el perfil no es alcanzable).
+        as_arrays: los frames llevan arrays numpy en vez de listas (ver run_columnar).
+        """
+        if not all(math.isfinite(v) and v > 0 for v in (horas, paso_h, frame_cada_h)):
+            raise ValueError("'horas', 'paso_h' y 'frame_cada_h' deben ser números mayores que cero.")
+        if len(tanks) > self.max_tanques:
+            raise ValueError(f"Demasiados tanques ({len(tanks)}, máximo {self.max_tanques}).")
+        n_steps = int(round(horas / paso_h))
+        if n_steps > self.max_pasos:
+            raise ValueError(f"La simulación tiene {n_steps} pasos (máximo {self.max_pasos}): sube 'paso_h' o baja 'horas'.")
+        frame_every = max(1, int(round(frame_cada_h / paso_h)))
+        n_frames = n_steps // frame_every + 1
+        if n_frames > self.max_frames:
+            raise ValueError(f"La simulación emite {n_frames} frames (máximo {self.max_frames}): sube 'frame_cada_h'.")
+        if not (math.isfinite(intervalo_min_h) and intervalo_min_h > 0):
+            raise ValueError("'intervalo_min_h' debe ser un número mayor que cero.")
+        if not (math.isfinite(tolerancia) and 0 <= tolerancia <= 1):
+            raise ValueError("'tolerancia' debe estar entre 0 y 1.")
+        if not (math.isfinite(nivel_minimo) and 0 <= nivel_minimo <= 1):
+            raise ValueError("'nivel_minimo' debe estar entre 0 y 1.")
+        # Cada tanque recarga como mucho una vez por intervalo (y por paso)
+        recargas_max = len(tanks) * (int(horas // max(intervalo_min_h, paso_h)) + 1)
+        if recargas_max > self.max_recargas:
+            raise ValueError(
+                f"La simulación puede emitir hasta {recargas_max} recargas (máximo {self.max_recargas}): "
+                "sube 'intervalo_min_h' o baja 'horas' o el número de tanques."
+            )
+
+        st = self._prepare(tanks)
+        ids = [t.get("id", k) for k, t in enumerate(tanks)]
+        vol = st["vol0"].copy()
+        mass_mg = st["ppm0"] * vol[:, None]
+        targets_safe = np.where(st["targets"] > 0, st["targets"], 1.0)
+
+        n_events = 0
+        last_top_up = np.full(len(tanks), -np.inf)
+        grams_total = np.zeros(len(self.calc.selected_ferts))
+
+        for step in range(n_steps + 1):
+            t_h = step * paso_h
+            ppm = self.concentration.g_per_L_to_ppm(mass_mg / vol[:, None] / 1000.0)
+            deviation = (ppm - st["targets"]) / targets_safe
+
+            if step % frame_every == 0:
+                frame = {
+                    "volumen_L": np.round(vol, 2),
+                    "nivel": np.round(vol / st["vol0"], 4),
+                    "ppm": {nut: np.round(ppm[:, i], 2) for i, nut in enumerate(self.nutrient_order)},
+                    "desvio_max": np.round(np.abs(deviation).max(axis=1), 4),
+                }
+                if not as_arrays:
+                    frame = {k: ({n: a.tolist() for n, a in v.items()} if isinstance(v, dict) else v.tolist())
+                             for k, v in frame.items()}
+                yield {"tipo": "frame", "t_h": round(t_h, 3), **frame}
+
+            if step == n_steps:
+                break
+
+            # Recargas para los tanques con déficit fuera de tolerancia o nivel bajo
+            trigger = (deviation.min(axis=1) < -tolerancia) | (vol < nivel_minimo * st["vol0"])
+            trigger &= (t_h - last_top_up) >= intervalo_min_h
+            if trigger.any():
+                idx = np.flatnonzero(trigger)
+                last_top_up[idx] = t_h
+                water_L, grams = self._top_up(idx, mass_mg, vol, st)
+                grams_total += grams.sum(axis=0)
+                for r, k in enumerate(idx):
+                    n_events += 1
+                    yield {
+                        "tipo": "recarga",
+                        "t_h": round(t_h, 3),
+                        "tanque": ids[k],
+                        "agua_L": round(float(water_L[r]), 2),
+                        "dosis_gramos": {
+                            fert: round(float(g), 2)
+                            for fert, g in zip(self.calc.selected_ferts, grams[r]) if g > 0.005
+                        },
+                    }
+
+            # Paso de integración (Euler explícito)
+            transp_L = np.minimum(st["transp"] * paso_h, vol * 0.5)
+            evap_L = np.minimum(st["evap"] * paso_h, vol * 0.5 - transp_L)
+            uptake_mg = np.minimum(st["uptake"] * transp_L[:, None], mass_mg)
+            mass_mg -= uptake_mg
+            vol -= transp_L + evap_L
+
+        yield {
+            "tipo": "resumen",
+            "horas": horas,
+            "tanques": len(tanks),
+            "recargas": n_events,
+            "gramos_totales": {
+                fert: round(float(g), 2) for fert, g in zip(self.calc.selected_ferts, grams_total)
+            },
+        }
+
+    def run_columnar(self, tanks: List[Dict[str, Any]], **params) -> Dict[str, Any]:
+        """
+        Simulación completa con los frames apilados en matrices (frames x tanques)
+        para la respuesta binaria columnar; recargas y resumen van aparte.
+        """
+        frames, eventos, resumen = [], [], None
+        for item in self.run(tanks, as_arrays=True, **params):
+            if item["tipo"] == "frame":
+                frames.append(item)
+            elif item["tipo"] == "recarga":
+                eventos.append(item)
+            else:
+                resumen = item
+
+        return {
+            "success": True,
+            "tanques": [t.get("id", k) for k, t in enumerate(tanks)],
+            "t_h": np.array([f["t_h"] for f in frames]),
+            "volumen_L": np.stack([f["volumen_L"] for f in frames]),
+            "nivel": np.stack([f["nivel"] for f in frames]),
+            "ppm": {nut: np.stack([f["ppm"][nut] for f in frames]) for nut in self.nutrient_order},
+            "desvio_max": np.stack([f["desvio_max"] for f in frames]),
+            "recargas": eventos,
+            "resumen": resumen,
+        }
@@ -0,0 +1,42 @@
+import io
+import json
+from concurrent.futures import ThreadPoolExecutor
+
+from rpc_server import HEADER, MAX_FRAME, encode_frame, read_frame, serve_stream
+
+
+class EchoDispatcher:
+    def dispatch(self, message, emit=None):
+        return {"jsonrpc": "2.0", "id": message.get("id"), "result": message.get("params")}
+
+
+def _replies(data: bytes):
+    stream, out = io.BytesIO(data), []
+    while (raw := read_frame(stream)) is not None:
+        out.append(json.loads(raw))
+    return out
+
+
+def test_marco_demasiado_grande_responde_y_cierra():
+    valid = encode_frame({"jsonrpc": "2.0", "id": 1, "method": "/api/x", "params": {"a": 1}})
+    oversized = HEADER.pack(MAX_FRAME + 1)
+    after = encode_frame({"jsonrpc": "2.0", "id": 2, "method": "/api/x"})
+    written = []
+
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        serve_stream(EchoDispatcher(), io.BytesIO(valid + oversized + after), written.append, executor)
+
+    replies = _replies(b"".join(written))
+    # La petición previa se responde; la posterior al marco inválido no se lee
+    assert [r.get("id") for r in replies if "result" in r] == [1]
+    errors = [r for r in replies if "error" in r]
+    assert len(errors) == 1
+    assert errors[0]["id"] is None
+    assert errors[0]["error"]["code"] == -32600
+
+
+def test_fin_de_flujo_sin_error():
+    written = []
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        serve_stream(EchoDispatcher(), io.BytesIO(b""), written.append, executor)
+    assert written == []
@@ -0,0 +1,152 @@
+import atexit
+import hashlib
+import json
+import os
+import struct
+import threading
+import zlib
+from typing import Any, Dict
+
+CACHE_VERSION = 1
+MAGIC = b"HSWC"
+HEADER = struct.Struct("<4sI32s")   # magia, versión, sha256 del cuerpo
+
+
+class WarmCache:
+    """
+    Caché en disco de artefactos compilados (biblioteca de compuestos, masas
+    molares, reacciones balanceadas, índices de la matriz de fertilizantes),
+    junto a hidrosynapse.db.
+
+    Un solo archivo que se lee de una vez al arrancar:
+
+        "HSWC" | uint32 versión | sha256(cuerpo) | cuerpo = zlib(JSON)
+
+    El JSON tiene una sección por artefacto con la huella de sus datos de
+    origen: section(nombre, huella) devuelve el dict guardado solo si la
+    huella coincide; si no, uno vacío que el dueño vuelve a llenar. Un archivo
+    truncado, con otra versión o con el hash incorrecto se descarta entero (se
+    recompila todo, como en un arranque en frío). Las escrituras son atómicas
+    (archivo temporal + os.replace) y se hacen al salir o con flush().
+    """
+
+    def __init__(self, path: str | None = None):
+        self.path = path or os.path.join(os.path.dirname(os.path.abspath(__file__)), "hidrosynapse.cache")
+        self._sections: Dict[str, Dict[str, Any]] = {}
+        self._dirty = False
+        self._lock = threading.RLock()
+        self.estado = "frio"
+        self._load()
+        atexit.register(self.flush)
+
+    @staticmethod
+    def fingerprint(*sources: Any) -> str:
+        """Huella de los datos de origen: bytes tal cual, el resto como JSON canónico."""
+        h = hashlib.sha256()
+        for src in sources:
+            if isinstance(src, (bytes, bytearray)):
+                h.update(src)
+            else:
+                h.update(json.dumps(src, sort_keys=True, default=str).encode("utf-8"))
+            h.update(b"\0")
+        return h.hexdigest()
+
+    @staticmethod
+    def file_fingerprint(*paths: str) -> str:
+        """Huella del contenido de archivos de datos (un archivo ausente cuenta como vacío)."""
+        chunks = []
+        for path in paths:
+            try:
+                with open(path, "rb") as f:
+                    chunks.append(f.read())
+            except OSError:
+                chunks.append(b"")
+        return WarmCache.fingerprint(*chunks)
+
+    # -------------------------------------------------------------------------
+    # Lectura / escritura
+    # -------------------------------------------------------------------------
+    def _load(self):
+        try:
+            with open(self.path, "rb") as f:
+                raw = f.read()
+        except FileNotFoundError:
+            return
+        except OSError as e:
+            print(f"[WarmCache] No se pudo leer {self.path}: {e}")
+            return
+
+        try:
+            magic, version, digest = HEADER.unpack_from(raw)
+            body = raw[HEADER.size:]
+            if magic != MAGIC or version != CACHE_VERSION:
+                raise ValueError("versión o formato distinto")
+            if hashlib.sha256(body).digest() != digest:
+                raise ValueError("hash incorrecto (archivo truncado o corrupto)")
+            sections = json.loads(zlib.decompress(body))
+            if not isinstance(sections, dict):
+                raise ValueError("contenido inesperado")
+        except (struct.error, zlib.error, ValueError) as e:
+            print(f"[WarmCache] Caché descartada, se recompila: {e}")
+            self.estado = "descartada"
+            self._dirty = True    # reescribir aunque nadie cambie nada
+            return
+
+        self._sections = sections
+        self.estado = "caliente"
+
+    def flush(self):
+        """Escribe la caché si algo cambió (atómico: o queda la vieja o la nueva)."""
+        with self._lock:
+            if not self._dirty:
+                return
+            try:
+                body = zlib.compress(json.dumps(self._sections, separators=(",", ":")).encode("utf-8"), 1)
+            except RuntimeError:
+                return   # una sección cambió mientras se serializaba: queda pendiente para el próximo flush
+            tmp = f"{self.path}.{os.getpid()}.tmp"
+            try:
+                with open(tmp, "wb") as f:
+                    f.write(HEADER.pack(MAGIC, CACHE_VERSION, hashlib.sha256(body).digest()))
+                    f.write(body)
+                    f.flush()
+                    os.fsync(f.fileno())
+                os.replace(tmp, self.path)
+                self._dirty = False
+            except OSError as e:
+                print(f"[WarmCache] No se pudo escribir {self.path}: {e}")
+                try:
+                    os.remove(tmp)
+                except OSError:
+                    pass
+
+    # -------------------------------------------------------------------------
+    # Secciones
+    # -------------------------------------------------------------------------
+    def section(self, name: str, key: str) -> Dict[str, Any]:
+        """
+        Datos de la sección 'name' si se compilaron con la misma huella 'key';
+        si no, un dict vacío (ya registrado) para que el dueño lo llene y
+        llame a touch().
+        """
+        with self._lock:
+            entry = self._sections.get(name)
+            if entry is None or entry.get("key") != key:
+                entry = {"key": key, "data": {}}
+                self._sections[name] = entry
+                self._dirty = True
+            return entry["data"]
+
+    def touch(self):
+        """Marca la caché como modificada (se escribe en el próximo flush)."""
+        self._dirty = True
+
+    def status(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "ruta": self.path,
+                "estado": self.estado,
+                "version": CACHE_VERSION,
+                "pendiente": self._dirty,
+                "secciones": {name: len(entry.get("data", {})) for name, entry in self._sections.items()},
+            }
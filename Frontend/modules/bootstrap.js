@@ -0,0 +1,118 @@
+// Arranque en una sola petición: /api/bootstrap devuelve perfiles, fertilizantes,
+// calculadora y síntomas. Se guarda con su ETag; al volver a abrir la app se
+// revalida con If-None-Match y un 304 reutiliza la copia local. Los perfiles
+// no se guardan aquí sino en la caché de profiles.js (una sola copia).
+// Los cambios posteriores llegan por Server-Sent Events (/api/bootstrap/events)
+// como versiones por fuente: los perfiles se traen por deltas y el payload
+// completo solo se vuelve a pedir si cambian fertilizantes o síntomas.
+import { applyProfilesSnapshot, ensureProfiles, loadProfilesToUI, syncProfiles } from "./profiles.js";
+
+const API = "http://localhost:8000/api/bootstrap";
+const CACHE_KEY = "hydrosynapse.bootstrap";
+
+let current = null;   // { etag, payload } (payload sin 'perfiles')
+let events = null;
+
+function loadCache() {
+    try {
+        const entry = JSON.parse(localStorage.getItem(CACHE_KEY) || "null");
+        if (!entry) return null;
+        // Copias antiguas guardaban también la lista de perfiles: se descarta
+        if (entry.payload?.perfiles) storeCache(entry);
+        const { perfiles, ...payload } = entry.payload || {};
+        return { etag: entry.etag, payload };
+    } catch (err) {
+        console.warn("Caché de arranque inválida:", err);
+        return null;
+    }
+}
+
+function storeCache(entry) {
+    try {
+        const { perfiles, ...payload } = entry.payload;
+        localStorage.setItem(CACHE_KEY, JSON.stringify({ etag: entry.etag, payload }));
+    } catch (err) {
+        console.warn("No se pudo guardar la caché de arranque:", err);
+    }
+}
+
+export async function fetchBootstrap() {
+    const cached = current || loadCache();
+    const headers = cached?.etag ? { "If-None-Match": cached.etag } : {};
+    const res = await fetch(API, { headers });
+
+    if (res.status === 304 && cached) {
+        current = cached;
+        return { ...cached, changed: false };
+    }
+    const payload = await res.json();
+    if (!res.ok || !payload.success) throw new Error(payload.error || "Error cargando datos de arranque");
+
+    current = { etag: res.headers.get("ETag"), payload };
+    storeCache(current);
+    applyProfilesSnapshot(payload.perfiles, payload.version.perfiles);
+    delete payload.perfiles;
+    return { ...current, changed: true };
+}
+
+// Síntomas del motor de diagnóstico: conserva las etiquetas del HTML y añade los códigos nuevos
+function applySymptoms(sintomas) {
+    const sel = document.getElementById("symptomSelector");
+    if (!sel || !sintomas?.length) return;
+
+    const labels = new Map([...sel.options].map(o => [o.value, o.textContent]));
+    const frag = document.createDocumentFragment();
+    sintomas.forEach(({ codigo, nutrientes }) => {
+        const opt = document.createElement("option");
+        opt.value = codigo;
+        opt.textContent = labels.get(codigo)
+            || `${codigo.replaceAll("_", " ")}${nutrientes.length ? ` (${nutrientes.join(", ")})` : ""}`;
+        frag.appendChild(opt);
+    });
+    const selected = sel.value;
+    sel.innerHTML = "";
+    sel.appendChild(frag);
+    if (labels.has(selected)) sel.value = selected;
+}
+
+// Payload de arranque sin los perfiles (están en profiles.js: getCachedProfile)
+export function getBootstrap() {
+    return current?.payload || null;
+}
+
+// Avisos del backend con las versiones por fuente: perfiles por deltas, el
+// resto revalidando /api/bootstrap (que vuelve a traer también los perfiles)
+function watchBootstrap() {
+    if (events) return;
+    events = new EventSource(`${API}/events`);
+    events.addEventListener("bootstrap", async (ev) => {
+        const { version } = JSON.parse(ev.data);
+        const local = current?.payload?.version;
+        if (!local) return;
+        try {
+            if (version.fertilizantes !== local.fertilizantes || version.sintomas !== local.sintomas) {
+                const { payload, changed } = await fetchBootstrap();
+                if (changed) applySymptoms(payload.sintomas);
+            } else if (version.perfiles !== local.perfiles) {
+                await syncProfiles();
+                local.perfiles = version.perfiles;
+            }
+        } catch (err) {
+            console.error("Error actualizando datos de arranque:", err);
+        }
+    });
+}
+
+export async function loadBootstrap() {
+    try {
+        const { payload, changed } = await fetchBootstrap();
+        // Con 304 los perfiles salen de su propia caché (deltas si va por detrás)
+        if (!changed) await ensureProfiles(payload.version.perfiles);
+        applySymptoms(payload.sintomas);
+        console.log(`Arranque ${changed ? "descargado" : "en caché (304)"}`);
+        watchBootstrap();
+    } catch (err) {
+        console.error("Error en /api/bootstrap, se sincroniza por módulos:", err);
+        loadProfilesToUI();
+    }
+}
@@ -33,9 +33,47 @@ export async function calcularDosis() {
 
 
 // --- ENVIAR A PROCESADOR ---
-export function enviarAProcesador() {
-    alert("⚠️ enviarAProcesador() aún no implementado");
-    console.log("Simulación: enviando receta al procesador…");
+// Registra el tanque en el controlador de lazo cerrado del backend y arranca el lazo:
+// a partir de aquí el backend lee los sensores y acciona las bombas (driver simulado por defecto).
+const CONTROLLER_URL = "http://localhost:8000/api/controller";
+
+export async function enviarAProcesador() {
+    const volumen = parseFloat(document.getElementById("volumenTanque").value);
+    const perfil = document.getElementById("perfilPlanta").value;
+
+    if (!(volumen > 0) || !perfil) {
+        alert("Indica un volumen y un perfil antes de enviar al dosificador.");
+        return;
+    }
+
+    try {
+        let res = await fetch(`${CONTROLLER_URL}/tanks`, {
+            method: "POST",
+            headers: { "Content-Type": "application/json" },
+            body: JSON.stringify({
+                tanques: [{ id: "principal", perfil, volumen_L: volumen }]
+            })
+        });
+        let data = await res.json();
+        if (!data.success) {
+            alert("Error en el controlador: " + data.error);
+            return;
+        }
+
+        res = await fetch(`${CONTROLLER_URL}/start`, { method: "POST" });
+        data = await res.json();
+        if (!data.success) {
+            alert("No se pudo arrancar el lazo: " + data.error);
+            return;
+        }
+
+        console.log("Controlador de dosificación activo:", data);
+        logConsole(`Dosificador activo (${data.driver}) → ${perfil}, ${volumen} L`);
+
+    } catch (err) {
+        console.error(err);
+        alert("Error en conexión con backend");
+    }
 }
 
 
@@ -0,0 +1,32 @@
+// Formato binario columnar del backend (Accept: application/x-hydrosynapse-columnar).
+// Cabecera JSON + buffers little-endian alineados a 8 bytes: cada columna se
+// envuelve como typed array sobre el mismo ArrayBuffer, sin copiar.
+
+export const COLUMNAR_MIME = "application/x-hydrosynapse-columnar";
+
+const VIEWS = { f8: Float64Array, f4: Float32Array, u1: Uint8Array };
+
+export function decodeColumnar(buffer) {
+    const bytes = new Uint8Array(buffer, 0, 4);
+    if (String.fromCharCode(...bytes) !== "HSC1") throw new Error("Respuesta columnar inválida");
+
+    const headerLength = new DataView(buffer).getUint32(4, true);
+    const header = JSON.parse(new TextDecoder().decode(new Uint8Array(buffer, 8, headerLength)));
+
+    const columns = {};
+    for (const col of header.columns) {
+        columns[col.name] = new VIEWS[col.dtype](buffer, col.offset, col.count);
+        columns[col.name].shape = col.shape;
+    }
+    return { meta: header.meta, columns };
+}
+
+// fetch con el formato columnar; si el backend responde JSON (error), se devuelve tal cual
+export async function fetchColumnar(url, { dtype = "f8", ...options } = {}) {
+    const headers = { ...(options.headers || {}), Accept: `${COLUMNAR_MIME}; dtype=${dtype}, application/json;q=0.5` };
+    const res = await fetch(url, { ...options, headers });
+    if (!(res.headers.get("Content-Type") || "").startsWith(COLUMNAR_MIME)) {
+        return { meta: await res.json(), columns: {} };
+    }
+    return decodeColumnar(await res.arrayBuffer());
+}
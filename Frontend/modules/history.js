@@ -1,4 +1,53 @@
-export async function loadHistory() {
-    // Cuando agregues el endpoint /api/history, llenar aquí
-    console.log("Historial pendiente de implementación backend");
+import Chart from "../public/libs/chart.js";
+import { fetchColumnar } from "./columnar.js";
+
+const SERIES_URL = "http://localhost:8000/api/history/series";
+
+let chart = null;
+
+// Tendencia de EC: el backend ya reduce la serie (LTTB / min-max) a ~1 punto por píxel
+export async function loadHistory({ dias = 90, perfil = null } = {}) {
+    const canvas = document.getElementById("historyChart");
+    if (!canvas) return;
+
+    const hasta = new Date();
+    const desde = new Date(hasta.getTime() - dias * 86400000);
+    const params = new URLSearchParams({
+        metricas: "ec",
+        desde: toLocalISO(desde),
+        hasta: toLocalISO(hasta),
+        max_puntos: Math.max(50, canvas.clientWidth || 500)
+    });
+    if (perfil) params.set("perfil", perfil);
+
+    try {
+        // Columnas binarias (Float64Array) en vez de listas JSON
+        const { meta: data, columns } = await fetchColumnar(`${SERIES_URL}?${params}`);
+        if (!data.success) throw new Error(data.error);
+
+        const ec = { t: columns["series.ec.t"], y: Array.from(columns["series.ec.y"]) };
+        // Los tiempos vienen como "hora de pared" en UTC: se formatean en UTC
+        const labels = Array.from(ec.t, ms => new Date(ms).toISOString().slice(0, 16).replace("T", " "));
+
+        if (!chart) {
+            chart = new Chart(canvas, {
+                type: "line",
+                data: { labels, datasets: [{ label: "EC final (mS/cm)", data: ec.y, pointRadius: 0, borderWidth: 1 }] },
+                options: { animation: false, scales: { x: { ticks: { maxTicksLimit: 8 } } } }
+            });
+        } else {
+            chart.data.labels = labels;
+            chart.data.datasets[0].data = ec.y;
+            chart.update();
+        }
+
+        console.log(`Historial: ${ec.t.length} puntos (${data.filas_crudas} filas, ${data.metodo})`);
+    } catch (err) {
+        console.error("Error cargando historial:", err);
+    }
+}
+
+function toLocalISO(d) {
+    const off = d.getTimezoneOffset() * 60000;
+    return new Date(d.getTime() - off).toISOString().slice(0, 19);
 }
@@ -1,5 +1,60 @@
+const AUTOCOMPLETE_URL = "http://localhost:8000/api/compounds/autocomplete";
+const DEBOUNCE_MS = 120;
+
+let debounceTimer = null;
+let lastQuery = null;
+let controller = null;
+
+// Sugerencias mientras se escribe: fórmula/nombre → masa molar (sin esperar a calcular)
+async function fetchSuggestions(query) {
+    if (query === lastQuery) return;
+    lastQuery = query;
+
+    // Solo importa la respuesta de la última tecla
+    if (controller) controller.abort();
+    controller = new AbortController();
+
+    try {
+        const params = new URLSearchParams({ q: query, limit: 8 });
+        const res = await fetch(`${AUTOCOMPLETE_URL}?${params}`, { signal: controller.signal });
+        const data = await res.json();
+        if (!data.success) return;
+
+        const list = document.getElementById("molarSuggestions");
+        list.innerHTML = "";
+        data.matches.forEach(m => {
+            const opt = document.createElement("option");
+            opt.value = m.formula;
+            opt.label = `${m.nombre} — ${m.masa_molar} g/mol`;
+            list.appendChild(opt);
+        });
+
+        const hint = document.getElementById("molarHint");
+        if (data.error) {
+            hint.innerText = "⚠ " + data.error;
+        } else if (data.matches.length) {
+            const top = data.matches[0];
+            hint.innerText = `${top.nombre}: ${top.masa_molar} g/mol`;
+        } else {
+            hint.innerText = "";
+        }
+    } catch (err) {
+        if (err.name !== "AbortError") console.error("Error en autocompletado:", err);
+    }
+}
+
+export function setupMolarAutocomplete() {
+    const input = document.getElementById("molarCompound");
+    if (!input) return;
+
+    input.addEventListener("input", () => {
+        clearTimeout(debounceTimer);
+        debounceTimer = setTimeout(() => fetchSuggestions(input.value.trim()), DEBOUNCE_MS);
+    });
+}
+
 export async function calcularMolar() {
-    const compound = document.getElementById("molarCompound").value;
+    const compound = document.getElementById("molarCompound").value.trim();
     const volume = parseFloat(document.getElementById("molarVolume").value);
 
     const res = await fetch("http://localhost:8000/api/molar_solution", {
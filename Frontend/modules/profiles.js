@@ -1,21 +1,176 @@
-export async function loadProfilesToUI() {
+// Caché local del catálogo: se sincroniza por deltas (/api/profiles/changes)
+// en vez de volver a pedir y reconstruir la lista completa en cada guardado.
+const API = "http://localhost:8000/api/profiles";
+const CACHE_KEY = "hydrosynapse.profiles";
+
+const catalog = {
+    version: 0,
+    profiles: new Map(),   // nombre -> perfil
+    options: new Map(),    // nombre -> <option>
+    sorted: []             // nombres ordenados (posición de inserción en el <select>)
+};
+
+function loadCache() {
+    try {
+        const raw = JSON.parse(localStorage.getItem(CACHE_KEY) || "null");
+        if (!raw) return;
+        catalog.version = raw.version || 0;
+        raw.profiles.forEach(p => catalog.profiles.set(p.nombre, p));
+    } catch (err) {
+        console.warn("Caché de perfiles inválida, se sincroniza desde cero:", err);
+        catalog.version = 0;
+        catalog.profiles.clear();
+    }
+}
+
+function storeCache() {
     try {
-        const res = await fetch("http://localhost:8000/api/profiles");
+        localStorage.setItem(CACHE_KEY, JSON.stringify({
+            version: catalog.version,
+            profiles: [...catalog.profiles.values()]
+        }));
+    } catch (err) {
+        console.warn("No se pudo guardar la caché de perfiles:", err);
+    }
+}
+
+const collator = new Intl.Collator("es", { sensitivity: "base" });
+
+function sortedIndex(nombre) {
+    let lo = 0, hi = catalog.sorted.length;
+    while (lo < hi) {
+        const mid = (lo + hi) >> 1;
+        if (collator.compare(catalog.sorted[mid], nombre) < 0) lo = mid + 1;
+        else hi = mid;
+    }
+    return lo;
+}
+
+function upsertOption(sel, nombre) {
+    if (catalog.options.has(nombre)) return;
+    const opt = document.createElement("option");
+    opt.value = nombre;
+    opt.textContent = nombre;
+
+    const idx = sortedIndex(nombre);
+    const next = catalog.options.get(catalog.sorted[idx]);
+    sel.insertBefore(opt, next || null);
+    catalog.sorted.splice(idx, 0, nombre);
+    catalog.options.set(nombre, opt);
+}
+
+function removeOption(nombre) {
+    const opt = catalog.options.get(nombre);
+    if (!opt) return;
+    opt.remove();
+    catalog.options.delete(nombre);
+    let idx = sortedIndex(nombre);
+    if (catalog.sorted[idx] !== nombre) idx = catalog.sorted.indexOf(nombre);
+    if (idx >= 0) catalog.sorted.splice(idx, 1);
+}
+
+function renderAll(sel) {
+    const frag = document.createDocumentFragment();
+    catalog.sorted = [...catalog.profiles.keys()].sort(collator.compare);
+    catalog.options.clear();
+    catalog.sorted.forEach(nombre => {
+        const opt = document.createElement("option");
+        opt.value = nombre;
+        opt.textContent = nombre;
+        catalog.options.set(nombre, opt);
+        frag.appendChild(opt);
+    });
+    sel.innerHTML = "";
+    sel.appendChild(frag);
+}
+
+// Pide los cambios desde la versión local (paginados) y los aplica al <select>
+export async function syncProfiles() {
+    const sel = document.getElementById("perfilPlanta");
+    let applied = 0;
+    let hasMore = true;
+
+    while (hasMore) {
+        const res = await fetch(`${API}/changes?since=${catalog.version}&limit=2000`);
         const data = await res.json();
+        if (!data.success) throw new Error(data.error || "Error sincronizando perfiles");
+
+        // Base de datos reemplazada (versión menor que la local): empezar de cero
+        if (data.version < catalog.version) {
+            catalog.version = 0;
+            catalog.profiles.clear();
+            renderAll(sel);
+            continue;
+        }
+
+        data.changes.forEach(p => {
+            if (p.deleted) {
+                catalog.profiles.delete(p.nombre);
+                removeOption(p.nombre);
+            } else {
+                const { version, deleted, ...profile } = p;
+                catalog.profiles.set(p.nombre, profile);
+                upsertOption(sel, p.nombre);
+            }
+        });
+
+        applied += data.changes.length;
+        catalog.version = data.version;
+        hasMore = data.has_more;
+    }
+
+    if (applied) storeCache();
+    return applied;
+}
+
+// Búsqueda en el servidor (prefijo o texto completo), paginada por cursor
+export async function searchProfiles(query, { prefix = false, after = null, limit = 50 } = {}) {
+    const params = new URLSearchParams({ limit });
+    params.set(prefix ? "prefix" : "q", query);
+    if (after) params.set("after", after);
+
+    const res = await fetch(`${API}?${params}`);
+    const data = await res.json();
+    if (!data.success) throw new Error(data.error || "Error buscando perfiles");
+    return { profiles: data.profiles, nextCursor: data.next_cursor };
+}
 
-        if (!data.success) throw new Error("Error cargando perfiles");
+// Catálogo completo recibido en /api/bootstrap: sustituye al local sin pedir deltas
+export function applyProfilesSnapshot(profiles, version) {
+    if (version === catalog.version && catalog.options.size) return;
+    const sel = document.getElementById("perfilPlanta");
+    catalog.version = version;
+    catalog.profiles.clear();
+    profiles.forEach(p => catalog.profiles.set(p.nombre, p));
+    renderAll(sel);
+    storeCache();
+}
+
+// Perfiles en la versión indicada (304 de /api/bootstrap): caché local y, si va por detrás, deltas
+export async function ensureProfiles(version) {
+    const sel = document.getElementById("perfilPlanta");
+    if (!catalog.options.size) {
+        loadCache();
+        renderAll(sel);
+    }
+    if (catalog.version !== version) await syncProfiles();
+}
+
+export function getCachedProfile(nombre) {
+    return catalog.profiles.get(nombre) || null;
+}
 
+export async function loadProfilesToUI() {
+    try {
         const sel = document.getElementById("perfilPlanta");
-        sel.innerHTML = "";
 
-        data.profiles.forEach(p => {
-            const opt = document.createElement("option");
-            opt.value = p.nombre;
-            opt.textContent = p.nombre;
-            sel.appendChild(opt);
-        });
+        if (!catalog.options.size) {
+            loadCache();
+            renderAll(sel);
+        }
 
-        console.log("Perfiles cargados:", data.profiles);
+        const applied = await syncProfiles();
+        console.log(`Perfiles sincronizados: ${catalog.profiles.size} (v${catalog.version}, ${applied} cambios)`);
 
     } catch (err) {
         console.error("Error cargando perfiles:", err);
@@ -62,8 +217,8 @@ export async function saveNutrientProfile() {
 
         alert("Perfil guardado correctamente.");
 
-        // recargar lista
-        loadProfilesToUI();
+        // aplicar solo los cambios nuevos
+        syncProfiles();
 
     } catch (err) {
         console.error("Error guardando perfil:", err);
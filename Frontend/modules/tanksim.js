@@ -0,0 +1,47 @@
+// modules/tanksim.js
+import { updateNPKChart } from "./npk.js";
+import { startDosingAnimation } from "./simulator3d.js";
+
+/**
+ * Consume /api/simulate_tanks como NDJSON (un frame/evento por línea).
+ *  - frames: actualizan el gráfico NPK con el tanque indicado
+ *  - recargas: disparan la animación de dosificación del simulador 3D
+ * onItem (opcional) recibe cada objeto tal cual llega.
+ */
+export async function streamTankSimulation(payload, { tankIndex = 0, onItem = null } = {}) {
+    const res = await fetch("http://localhost:8000/api/simulate_tanks", {
+        method: "POST",
+        headers: { "Content-Type": "application/json" },
+        body: JSON.stringify({ ...payload, stream: true })
+    });
+
+    if (!res.ok) {
+        const data = await res.json();
+        throw new Error(data.error || "Error en la simulación");
+    }
+
+    const reader = res.body.getReader();
+    const decoder = new TextDecoder();
+    let buffer = "";
+
+    while (true) {
+        const { value, done } = await reader.read();
+        if (done) break;
+
+        buffer += decoder.decode(value, { stream: true });
+        const lines = buffer.split("\n");
+        buffer = lines.pop();
+
+        lines.filter(l => l.trim()).forEach(line => {
+            const item = JSON.parse(line);
+
+            if (item.tipo === "frame") {
+                updateNPKChart(item.ppm.N[tankIndex], item.ppm.P[tankIndex], item.ppm.K[tankIndex]);
+            } else if (item.tipo === "recarga") {
+                startDosingAnimation();
+            }
+
+            if (onItem) onItem(item);
+        });
+    }
+}
@@ -9,7 +9,8 @@ console.log("🟩 IMPORTS COMPLETADOS");
 
 // --- IMPORTS DE MÓDULOS ---
 import { initUI, toggleModule } from "./modules/ui.js";
-import { loadProfilesToUI, saveNutrientProfile } from "./modules/profiles.js";
+import { saveNutrientProfile } from "./modules/profiles.js";
+import { loadBootstrap } from "./modules/bootstrap.js";
 import { setupCalculatorHandlers, calcularDosis, enviarAProcesador } from "./modules/calculator.js";
 import { setupResultsModule } from "./modules/results.js";
 import { setupAnalyzer, agregarSal, analizarAgua } from "./modules/analyzer.js";
@@ -18,10 +19,11 @@ import { initNPKChart, updateNPKChart } from "./modules/npk.js";
 import { setupDiagnosis } from "./modules/diagnosis.js";
 import { loadHistory } from "./modules/history.js";
 import { initConsole } from "./modules/console.js";
-import { calcularMolar } from "./modules/molar.js";
+import { calcularMolar, setupMolarAutocomplete } from "./modules/molar.js";
 import { balanceEquation } from "./modules/stoich.js";
 
 import { init3DSimulation, startDosingAnimation } from "./modules/simulator3d.js";
+import { streamTankSimulation } from "./modules/tanksim.js";
 
 console.log("🟨 EXPONIENDO FUNCIONES GLOBALES");
 window.toggleModule = toggleModule;
@@ -32,18 +34,20 @@ window.analizarAgua = analizarAgua;
 window.saveNutrientProfile = saveNutrientProfile;
 window.calcularMolar = calcularMolar;
 window.balanceEquation = balanceEquation;
+window.streamTankSimulation = streamTankSimulation;
 
 // --- ESTA PARTE FALTABA 🔥🔥🔥 ---
 console.log("🟧 INICIALIZANDO SISTEMA...");
 
 initUI();
-loadProfilesToUI();
+loadBootstrap();
 setupCalculatorHandlers();
 setupResultsModule();
 setupAnalyzer();
 loadInventory();
 initNPKChart();
 setupDiagnosis();
+setupMolarAutocomplete();
 loadHistory();
 init3DSimulation();
 